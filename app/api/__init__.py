@@ -1,5 +1,8 @@
 from fastapi import APIRouter
-from app.api.endpoints import pdf
+from app.api.endpoints import pdf, uploads, health, search
 
 api_router = APIRouter()
-api_router.include_router(pdf.router, tags=["pdf"]) 
\ No newline at end of file
+api_router.include_router(pdf.router, tags=["pdf"])
+api_router.include_router(uploads.router, tags=["uploads"])
+api_router.include_router(health.router, tags=["health"])
+api_router.include_router(search.router, tags=["search"]) 
\ No newline at end of file
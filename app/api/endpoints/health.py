@@ -0,0 +1,26 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.services.health_service import check_readiness
+from app.services.postprocess_service import available_stages
+
+router = APIRouter()
+
+@router.get("/healthz")
+async def liveness():
+    """存活检查：进程能响应请求即返回200"""
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readiness():
+    """就绪检查：模型已加载且队列可以接收任务时返回200，否则返回503"""
+    ready, checks = await check_readiness()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "checks": checks}
+    )
+
+@router.get("/capabilities")
+async def capabilities():
+    """节点支持的可选功能：postprocess_stages为提交任务时可以声明的后处理步骤（已配置接口地址）"""
+    return {"postprocess_stages": available_stages()}
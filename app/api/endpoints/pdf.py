@@ -1,27 +1,127 @@
-from fastapi import APIRouter, File, UploadFile, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException, Request, Header, Query
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import os
+import asyncio
+from datetime import datetime
+from typing import Optional
 
-from app.models.task import TaskStatus
-from app.services.task_service import create_task, get_task, create_zip_archive
+from app.models.task import TaskStatus, BulkStatusRequest, BulkStatusResponse, TaskList
+from app.services.task_service import (
+    create_task, get_task, get_task_statuses, list_tasks, retry_task, cancel_task,
+    create_zip_archive, markdown_file_name, iter_markdown
+)
 from app.services.pdf_service import tasks
+from app.services.storage_service import get_storage
+from app.services.block_index_service import BLOCK_INDEX_SUFFIX, block_index_name, iter_blocks
+from app.services.compression_service import stored_file, accepts_gzip, decompressed_size, iter_decompressed
+from app.utils.http import ranged_file_response, ranged_stream_response
 
 router = APIRouter()
 
 @router.post("/convert/", response_model=TaskStatus)
-async def convert_pdf(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    """上传PDF文件并开始转换任务"""
-    return await create_task(file, background_tasks)
+async def convert_pdf(file: UploadFile = File(...), idempotency_key: Optional[str] = Header(None),
+                      postprocess: Optional[str] = Form(None)):
+    """上传PDF文件并开始转换任务，相同Idempotency-Key的重复请求返回已创建的任务
+
+    postprocess为转换完成后在服务端执行的步骤（JSON数组），如 [{"name": "image_host"}, {"name": "kb_push", "options": {"kb_id": "..."}}]
+    """
+    return await create_task(file, idempotency_key, postprocess)
 
 @router.get("/status/{task_id}", response_model=TaskStatus)
 async def get_task_status(task_id: str):
     """获取任务状态"""
-    return get_task(task_id)
+    task = await asyncio.to_thread(get_task, task_id)
+    return task.to_status()
+
+@router.post("/status/bulk", response_model=BulkStatusResponse)
+async def get_bulk_status(request: BulkStatusRequest):
+    """一次查询多个任务的状态"""
+    return await asyncio.to_thread(get_task_statuses, request.task_ids)
+
+@router.get("/tasks", response_model=TaskList)
+async def list_task_statuses(
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """按创建时间分页列出任务，status按状态筛选，since只返回该时间之后创建的任务，cursor为上一页返回的next_cursor"""
+    return await asyncio.to_thread(list_tasks, status, since, cursor, limit)
+
+@router.post("/retry/{task_id}", response_model=TaskStatus)
+async def retry_failed_task(task_id: str):
+    """重试失败的任务，已完成推理的页面从检查点恢复"""
+    return await retry_task(task_id)
+
+@router.delete("/tasks/{task_id}", response_model=TaskStatus, status_code=202)
+async def cancel_conversion(task_id: str):
+    """取消排队中或执行中的任务"""
+    return await cancel_task(task_id)
+
+@router.get("/tasks/{task_id}/blocks")
+async def get_blocks(
+    task_id: str,
+    page: Optional[int] = Query(None, ge=0),
+    type: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
+    """按页码（从0开始）和类型（text、image、table、equation）读取content_list中的内容块，只读取匹配的部分"""
+    task = await asyncio.to_thread(get_task, task_id)
+    
+    if task.status != "completed":
+        raise HTTPException(
+            status_code=400,
+            detail="Task not completed"
+        )
+    
+    name = block_index_name(task.files)
+    if name is None or not await asyncio.to_thread(get_storage().exists, task_id, f"{name}{BLOCK_INDEX_SUFFIX}"):
+        raise HTTPException(
+            status_code=404,
+            detail="Block index not available"
+        )
+    
+    blocks = iter_blocks(task_id, name, page, type)
+    if format == "ndjson":
+        return StreamingResponse((line + b"\n" for line in blocks), media_type="application/x-ndjson")
+    
+    def iter_json_array():
+        yield b"["
+        for index, line in enumerate(blocks):
+            yield b"," + line if index else line
+        yield b"]"
+    
+    return StreamingResponse(iter_json_array(), media_type="application/json")
+
+@router.get("/stream/{task_id}")
+async def stream_markdown(task_id: str, offset: int = 0):
+    """流式读取任务的Markdown，转换进行中时随每批页面完成持续输出，offset为续读的字节位置"""
+    task = await asyncio.to_thread(get_task, task_id)
+    
+    if task.status == "failed":
+        raise HTTPException(
+            status_code=400,
+            detail="Task failed"
+        )
+    
+    md_name = markdown_file_name(task)
+    if md_name is None:
+        raise HTTPException(
+            status_code=404,
+            detail="File not found"
+        )
+    
+    return StreamingResponse(
+        iter_markdown(task_id, md_name, offset),
+        media_type="text/markdown; charset=utf-8",
+        headers={"X-Task-Status": task.status}
+    )
 
 @router.get("/download/{task_id}/{file_name}")
-async def download_file(task_id: str, file_name: str):
+async def download_file(task_id: str, file_name: str, request: Request):
     """下载特定任务的单个文件"""
-    task = get_task(task_id)
+    task = await asyncio.to_thread(get_task, task_id)
         
     if task.status != "completed":
         raise HTTPException(
@@ -35,19 +135,38 @@ async def download_file(task_id: str, file_name: str):
             detail="File not found"
         )
     
-    from app.core.config import settings
-    file_path = os.path.join(settings.OUTPUT_DIR, task_id, file_name)
-    if not os.path.exists(file_path):
+    storage = get_storage()
+    stored = await asyncio.to_thread(stored_file, storage, task_id, file_name)
+    if stored is None:
         raise HTTPException(
             status_code=404,
             detail="File not found on server"
         )
-        
-    return FileResponse(
-        path=file_path,
-        filename=file_name,
-        media_type='application/octet-stream'
-    )
+    rel_path, compressed = stored
+    
+    if compressed and not accepts_gzip(request.headers.get("accept-encoding")):
+        # 客户端不接受gzip，实时解压，Range按解压后的字节计算
+        size = await asyncio.to_thread(decompressed_size, storage, task_id, rel_path)
+        return ranged_stream_response(
+            request,
+            size,
+            lambda start, length: iter_decompressed(storage, task_id, rel_path, start, length),
+            file_name,
+            headers={"Vary": "Accept-Encoding"}
+        )
+    
+    content_encoding = "gzip" if compressed else None
+    # 对象存储直接重定向到预签名URL，由客户端从存储下载（支持Range）
+    presigned_url = await asyncio.to_thread(storage.presigned_url, task_id, rel_path, file_name, content_encoding)
+    if presigned_url:
+        return RedirectResponse(presigned_url)
+    
+    response = ranged_file_response(request, storage.local_path(task_id, rel_path), file_name)
+    if compressed:
+        # 直接返回压缩保存的内容，Range按压缩后的字节计算
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
 
 @router.get("/download-zip/{task_id}")
 async def download_zip(task_id: str):
@@ -58,13 +177,13 @@ async def download_zip(task_id: str):
         path=zip_path,
         filename=zip_filename,
         media_type='application/zip',
-        background=BackgroundTasks().add_task(lambda: os.unlink(zip_path))  # 下载后删除临时文件
+        background=BackgroundTask(os.unlink, zip_path)  # 下载后删除临时文件
     )
 
 @router.get("/files/{task_id}")
 async def list_files(task_id: str):
     """列出任务的所有可用文件"""
-    task = get_task(task_id)
+    task = await asyncio.to_thread(get_task, task_id)
         
     if task.status != "completed":
         raise HTTPException(
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, HTTPException, Query
+import asyncio
+from typing import Optional
+
+from app.core.config import settings
+from app.models.search import SearchResults
+from app.services.search_service import search_index
+
+router = APIRouter()
+
+@router.get("/search", response_model=SearchResults)
+async def search_documents(
+    q: str = Query(..., min_length=1),
+    task_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """在已完成任务的转换结果中全文检索，返回匹配内容块所在的任务、页码和片段，task_id限定在一个任务内"""
+    if not settings.SEARCH_INDEX_ENABLED:
+        raise HTTPException(
+            status_code=404,
+            detail="Search index is disabled"
+        )
+    hits = await asyncio.to_thread(search_index.search, q, task_id, limit)
+    return SearchResults(query=q, hits=hits)
@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Header, Request, Response
+import asyncio
+
+from app.models.task import TaskStatus
+from app.models.upload import UploadCreate, UploadSession
+from app.services.upload_service import create_upload, get_upload, append_chunk, finalize_upload
+
+router = APIRouter()
+
+def _offset_headers(session: UploadSession) -> dict:
+    return {
+        "Upload-Offset": str(session.offset),
+        "Upload-Length": str(session.length),
+        "Cache-Control": "no-store"
+    }
+
+@router.post("/uploads/", response_model=UploadSession, status_code=201)
+async def start_upload(request: UploadCreate, response: Response):
+    """创建可续传的分块上传"""
+    session = await create_upload(request)
+    response.headers["Location"] = f"/uploads/{session.upload_id}"
+    return session
+
+@router.get("/uploads/{upload_id}", response_model=UploadSession)
+async def get_upload_status(upload_id: str, response: Response):
+    """获取上传进度"""
+    session = await asyncio.to_thread(get_upload, upload_id)
+    response.headers.update(_offset_headers(session))
+    return session
+
+@router.head("/uploads/{upload_id}")
+async def head_upload(upload_id: str):
+    """通过响应头返回已接收的字节数（Upload-Offset）"""
+    session = await asyncio.to_thread(get_upload, upload_id)
+    return Response(status_code=200, headers=_offset_headers(session))
+
+@router.patch("/uploads/{upload_id}", status_code=204)
+async def upload_chunk(upload_id: str, request: Request, upload_offset: int = Header(...)):
+    """上传一个分块，请求体为原始字节，Upload-Offset为该分块在文件中的起始位置"""
+    session = await append_chunk(upload_id, upload_offset, request)
+    return Response(status_code=204, headers=_offset_headers(session))
+
+@router.post("/uploads/{upload_id}/finalize", response_model=TaskStatus)
+async def finish_upload(upload_id: str):
+    """完成上传并开始转换，任务ID与上传ID相同"""
+    return await finalize_upload(upload_id)
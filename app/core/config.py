@@ -12,10 +12,109 @@ class Settings(BaseSettings):
     UPLOAD_DIR: str = "uploads"
     OUTPUT_DIR: str = "outputs"
     MAX_FILE_SIZE: int = 100 * 1024 * 1024  # 100MB
+    UPLOAD_SESSION_EXPIRY_HOURS: int = 24  # 未完成的分块上传在没有新数据后保留的时间（小时）
+    
+    # 输出存储配置
+    STORAGE_BACKEND: str = "local"  # "local"：保留在OUTPUT_DIR；"s3"：发布到S3兼容对象存储
+    S3_ENDPOINT_URL: Optional[str] = None  # 如本地MinIO: http://127.0.0.1:9000，为空时使用AWS S3
+    S3_BUCKET: str = "mineru-outputs"
+    S3_PREFIX: str = ""  # 对象键前缀，对象键为 <S3_PREFIX><task_id>/<文件名>
+    S3_ACCESS_KEY: Optional[str] = None
+    S3_SECRET_KEY: Optional[str] = None
+    S3_REGION: Optional[str] = None
+    S3_MULTIPART_THRESHOLD: int = 8 * 1024 * 1024  # 超过该大小的文件使用分段上传
+    S3_MULTIPART_CHUNKSIZE: int = 8 * 1024 * 1024  # 分段大小
+    S3_PRESIGNED_EXPIRES: int = 3600  # 预签名下载链接有效期（秒）
+    COMPRESS_OUTPUTS: bool = True  # Markdown、content_list和middle JSON以gzip压缩保存，下载时客户端支持gzip则直接返回压缩内容，否则实时解压
+    OUTPUT_COMPRESSION_LEVEL: int = 6  # gzip压缩级别（1-9），级别越高文件越小、转换收尾越慢
     
     # 任务配置
     TASK_EXPIRY_HOURS: int = 24  # 任务结果保留时间（小时）
     MAX_CONCURRENT_TASKS: int = 5  # 最大并发任务数
+    MAX_TASK_RETRIES: int = 2  # 转换失败后自动重试的次数，重试从最近的检查点继续
+    RETRY_BACKOFF_SECONDS: float = 5.0  # 第一次重试前的等待时间，之后每次翻倍
+    TASK_TIMEOUT_SECONDS: int = 3600  # 单个任务的最长转换时间（秒），超时的任务被结束并标记为失败（0表示不限制）
+    PAGE_TIMEOUT_SECONDS: float = 60.0  # 按页数计算的转换时限：页数×该值（秒），与TASK_TIMEOUT_SECONDS取较小者（0表示不限制）
+    COALESCE_IDENTICAL_UPLOADS: bool = True  # 本地模式下内容和文件名都相同的文件正在排队或转换时，新任务跟随该任务，共享状态和输出，不重复转换
+    MAX_BULK_STATUS_IDS: int = 1000  # /status/bulk单次查询的最大任务数
+    CONVERSION_ISOLATION: str = "process"  # "process"：在常驻子进程中转换，取消或超时时直接结束子进程；"thread"：在线程中转换，取消或超时在当前这段页面处理完后生效。process模式下每个子进程各加载一套模型，内存/显存占用约为thread模式的MAX_CONCURRENT_TASKS倍
+    WARMUP_MODELS: bool = True  # 启动时预先加载模型（进程模式下在每个转换子进程中加载），加载完成前/readyz返回503
+    
+    # 转换配置
+    PAGE_LEVEL_OCR_ROUTING: bool = True  # 逐页判断是否需要OCR，只对缺少文本层的页面做OCR推理
+    PAGE_BATCH_SIZE: int = 0  # 分批处理的页数，每批完成后追加输出到Markdown和内容列表（0表示整个文档一次处理）。每批作为独立的子文档分析，跨页段落合并等文档级处理不跨越批次边界，输出与整个文档一次处理不完全相同
+    JOB_MEMORY_BUDGET_MB: int = 0  # 单个任务的内存预算（MB），按预算限制每批的页数，并发任务的总占用约为预算×MAX_CONCURRENT_TASKS（0表示不限制）
+    PAGE_MEMORY_ESTIMATE_MB: int = 64  # 推理时每页的估算内存占用（页面图像和模型中间结果）
+    MICRO_BATCH_WINDOW_MS: int = 200  # 小文档等待与其他任务合并推理的时间（毫秒），0表示不合并；进程模式下同时转换的小文档共用一个子进程
+    MICRO_BATCH_MAX_DOC_PAGES: int = 3  # 参与跨任务合并推理的文档最大页数
+    MICRO_BATCH_MAX_PAGES: int = 64  # 单个合并批次的最大页数，凑满后立即推理
+    THREAD_BUDGET: bool = True  # 把CPU核数平均分给同时执行的转换（torch/OpenMP/MKL/OpenCV线程数），转换开始或结束时重新分配
+    THREAD_BUDGET_CORES: int = 0  # 参与分配的CPU核数，0表示按进程的CPU亲和性自动检测（容器有CPU配额时应设置为配额）
+    STREAM_POLL_INTERVAL: float = 0.5  # /stream接口检查Markdown新内容的间隔（秒）
+    
+    # 图片后处理配置
+    IMAGE_POSTPROCESS: bool = False  # 转换完成后按内容对提取的图片去重，并更新Markdown、content_list和middle JSON中的引用
+    IMAGE_TRANSCODE_FORMAT: str = ""  # 图片转码格式："webp"、"jpeg"，为空时不转码；转码后比原图大时保留原图
+    IMAGE_QUALITY: int = 80  # 转码和缩略图的压缩质量（1-100）
+    IMAGE_THUMBNAIL_SIZE: int = 0  # 缩略图最长边的像素数，缩略图保存在images/thumbs下，与原图同名（0表示不生成）
+    IMAGE_POSTPROCESS_WORKERS: int = 2  # 转码和生成缩略图的进程数，进程模式下每个转换子进程各有一个进程池
+    
+    # 服务端后处理配置（提交任务时通过postprocess声明步骤）
+    POSTPROCESS_TIMEOUT_SECONDS: int = 1800  # 后处理步骤的总时限（秒），不计入转换时限，超时后尚未开始的步骤标记为失败（0表示不限制）
+    POSTPROCESS_HTTP_TIMEOUT_SECONDS: float = 300.0  # 调用图床、大模型和知识库接口的超时时间（秒）
+    POSTPROCESS_IMAGE_HOST_URL: Optional[str] = None  # 图床上传地址（multipart字段file，返回{"url": ...}），为空时不能使用image_host步骤
+    POSTPROCESS_IMAGE_UPLOAD_CONCURRENCY: int = 4  # 同时上传的图片数
+    POSTPROCESS_LLM_BASE_URL: Optional[str] = None  # OpenAI兼容接口地址（如 http://host:port/v1），为空时不能使用llm_cleanup步骤
+    POSTPROCESS_LLM_API_KEY: Optional[str] = None
+    POSTPROCESS_LLM_MODEL: str = "Qwen3-32B"  # 未在步骤参数中指定model时使用的模型
+    POSTPROCESS_LLM_MAX_CHUNK_SIZE: int = 102400  # 每次请求的最大字符数，长文档按段落分块处理
+    POSTPROCESS_LLM_TEMPERATURE: float = 0.3
+    POSTPROCESS_LLM_MAX_TOKENS: int = 102400
+    POSTPROCESS_KB_BASE_URL: Optional[str] = None  # 知识库（RAGFlow）接口地址（如 http://host:port/api/v1），为空时不能使用kb_push步骤
+    POSTPROCESS_KB_API_KEY: Optional[str] = None
+    POSTPROCESS_KB_DEFAULT_ID: Optional[str] = None  # 未在步骤参数中指定kb_id时使用的知识库
+    
+    # 缓存配置
+    RASTER_CACHE_DIR: str = "raster_cache"  # 页面栅格图缓存目录，重试和相同内容的文档复用渲染结果
+    RASTER_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # 栅格缓存的磁盘上限，超出时按LRU淘汰（0表示不缓存）
+    PAGE_RESULT_CACHE_DIR: str = "page_result_cache"  # 逐页推理结果缓存目录，按页面内容哈希复用，文档修订版只推理改动的页面
+    PAGE_RESULT_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # 逐页结果缓存的磁盘上限，超出时按LRU淘汰（0表示不缓存）
+    
+    # 检索配置
+    SEARCH_INDEX_ENABLED: bool = False  # 任务完成时把content_list写入全文索引，通过/search检索
+    SEARCH_INDEX_PATH: str = "search_index.db"  # 索引文件，broker模式下API节点和工作进程需共享该文件
+    SEARCH_TOKENIZER: str = "trigram"  # FTS5分词器："trigram"支持中文等任意子串（查询至少3个字符）；"unicode61"按词匹配
+    
+    # 调度配置
+    SCHEDULER_COST_WEIGHT: float = 1.0  # 排队优先级 = 提交时间 + 估算耗时 × 权重，小任务优先，等待越久的大任务越靠前
+    MAX_QUEUED_TASKS: int = 100  # 本地模式下最多排队的任务数
+    MAX_PAGES_PER_TASK: int = 0  # 单个任务允许的最大页数（0表示不限制）
+    PREFLIGHT_SAMPLE_PAGES: int = 20  # 预检时抽样检查的页数
+    PREFLIGHT_TEXT_PAGE_SECONDS: float = 0.5  # 文本页的估算处理耗时（秒）
+    PREFLIGHT_OCR_PAGE_SECONDS: float = 3.0  # 扫描页的估算处理耗时（秒）
+    
+    # 服务配置（run.py）
+    SERVER_MODE: str = "dev"  # "dev"：单进程并在代码变化时自动重载；"prod"：不监视文件，可多进程，收到SIGTERM时排空后退出
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 1  # prod模式下的HTTP进程数，大于1时需要EXECUTION_MODE=broker（本地模式的任务状态只在单个进程内）
+    SERVER_LOOP: str = "auto"  # 事件循环："auto"（安装了uvloop时使用uvloop）、"uvloop"或"asyncio"
+    SERVER_HTTP: str = "auto"  # HTTP解析器："auto"（安装了httptools时使用httptools）、"httptools"或"h11"
+    SERVER_BACKLOG: int = 2048  # 监听队列长度
+    SERVER_KEEPALIVE_SECONDS: int = 5  # 空闲keep-alive连接的保持时间，负载均衡器后面应大于负载均衡器的空闲超时
+    SERVER_GRACEFUL_TIMEOUT_SECONDS: int = 30  # 停止时等待进行中的请求（如上传）完成的时间
+    SHUTDOWN_DRAIN_TIMEOUT_SECONDS: int = 600  # 收到SIGTERM后等待已接收的转换完成的最长时间；工作进程中超时的任务被中断并放回队列
+    
+    # 执行模式配置
+    EXECUTION_MODE: str = "local"  # "local"：API进程内转换；"broker"：API只投递任务，由run_worker.py启动的工作进程转换
+    BROKER_URL: str = "sqlite:///broker.db"  # 任务队列地址，支持 sqlite:///<文件路径> 和 redis://<host>:<port>/<db>
+    WORKER_POLL_INTERVAL: float = 1.0  # 工作进程轮询队列的间隔（秒）
+    BROKER_LEASE_SECONDS: int = 120  # 工作进程取出任务后的租约时长（秒），执行期间定期续约；工作进程崩溃后租约过期，任务被放回队列
+    
+    # 清理配置
+    CLEANUP_MAX_DELETES_PER_SECOND: float = 5.0  # 每秒最多删除的任务目录数，避免大批量删除占满磁盘IO
+    OUTPUT_DIR_QUOTA_BYTES: int = 0  # OUTPUT_DIR总大小上限，超出时提前淘汰最旧的已完成任务（0表示不限制）
+    QUOTA_CHECK_INTERVAL_SECONDS: int = 300  # 磁盘配额检查间隔（秒）
     
     class Config:
         env_file = ".env"
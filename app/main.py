@@ -7,23 +7,36 @@ from app.api import api_router
 from app.core.config import settings
 from app.utils.logger import setup_logger
 from app.services.task_service import cleanup_expired_tasks
+from app.services.runner_service import runner
+from app.services.coalesce_service import single_flight
 
 logger = setup_logger()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动时执行
-    cleanup_task = asyncio.create_task(cleanup_expired_tasks())
-    logger.info("MinerU PDF Conversion API started")
+    # 启动时执行（broker模式下任务由工作进程转换和清理）
+    cleanup_task = None
+    warmup_task = None
+    if settings.EXECUTION_MODE != "broker":
+        cleanup_task = asyncio.create_task(cleanup_expired_tasks())
+        single_flight.bind()
+        if settings.WARMUP_MODELS:
+            # 模型在后台加载，HTTP服务立即可用，加载完成后/readyz才返回就绪
+            warmup_task = asyncio.create_task(runner.warm_up())
+    logger.info(f"MinerU PDF Conversion API started in {settings.EXECUTION_MODE} mode")
     
     yield  # 这里是应用程序运行的地方
     
     # 关闭时执行
-    cleanup_task.cancel()
-    try:
-        await cleanup_task
-    except asyncio.CancelledError:
-        logger.info("Cleanup task cancelled")
+    if warmup_task is not None:
+        warmup_task.cancel()
+    if cleanup_task is not None:
+        cleanup_task.cancel()
+        try:
+            await cleanup_task
+        except asyncio.CancelledError:
+            logger.info("Cleanup task cancelled")
+    runner.shutdown()
     logger.info("MinerU PDF Conversion API shutdown")
 
 app = FastAPI(
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from typing import Optional, List
+
+class SearchHit(BaseModel):
+    task_id: str
+    page: int  # 页码，从0开始
+    type: str  # 内容块类型：text、title、table、image、equation
+    snippet: str  # 匹配位置附近的文本，命中部分用**标出
+    bbox: Optional[List[float]] = None  # 内容块在页面上的位置，content_list不含坐标时为空
+
+class SearchResults(BaseModel):
+    query: str
+    hits: List[SearchHit]
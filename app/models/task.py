@@ -1,11 +1,74 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 
+class PreflightInfo(BaseModel):
+    page_count: Optional[int] = None
+    text_coverage: Optional[float] = None  # 有可用文本层的页面比例（抽样）
+    image_ratio: Optional[float] = None  # 以图片为主的页面比例（抽样）
+    needs_ocr: Optional[bool] = None
+    estimated_seconds: float = 0.0  # 估算的转换耗时
+
+class PostprocessStage(BaseModel):
+    """转换完成后在服务端执行的一个后处理步骤，提交时声明name和options，执行状态随任务状态返回"""
+    name: str  # "image_host"、"llm_cleanup"、"kb_push"
+    options: Dict[str, Any] = Field(default_factory=dict)  # 步骤参数，如llm_cleanup的model、kb_push的kb_id
+    status: str = "pending"  # "pending", "running", "completed", "failed"
+    detail: Optional[Dict[str, Any]] = None  # 执行结果，如上传的图片数、知识库文档ID
+    error: Optional[str] = None
+
 class TaskStatus(BaseModel):
     task_id: str
-    status: str  # "pending", "processing", "completed", "failed"
+    status: str  # "pending", "processing", "completed", "failed", "cancelled"
     files: Optional[List[str]] = None
     error: Optional[str] = None
-    created_at: datetime = datetime.now()
-    expires_at: Optional[datetime] = None 
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.now)
+    expires_at: Optional[datetime] = None
+    preflight: Optional[PreflightInfo] = None
+    eta: Optional[datetime] = None  # 预计完成时间
+    pages_completed: Optional[int] = None  # 已输出的页数
+    retries: int = 0  # 自动重试的次数
+    postprocess: Optional[List[PostprocessStage]] = None  # 声明的后处理步骤，按顺序执行
+
+class TaskRecord:
+    """进程内保存的任务记录，字段与TaskStatus相同
+
+    使用__slots__，每个任务只占几个指针的内存；只在响应请求或写入队列时转换为TaskStatus。
+    """
+
+    __slots__ = tuple(TaskStatus.model_fields)
+
+    def __init__(self, task_id: str, status: str, files: Optional[List[str]] = None, error: Optional[str] = None,
+                 created_at: Optional[datetime] = None, expires_at: Optional[datetime] = None,
+                 preflight: Optional[PreflightInfo] = None, eta: Optional[datetime] = None,
+                 pages_completed: Optional[int] = None, retries: int = 0,
+                 postprocess: Optional[List[PostprocessStage]] = None):
+        self.task_id = task_id
+        self.status = status
+        self.files = files
+        self.error = error
+        self.created_at = created_at or datetime.now()
+        self.expires_at = expires_at
+        self.preflight = preflight
+        self.eta = eta
+        self.pages_completed = pages_completed
+        self.retries = retries
+        self.postprocess = postprocess
+
+    @classmethod
+    def from_status(cls, status: TaskStatus) -> "TaskRecord":
+        return cls(**{field: getattr(status, field) for field in cls.__slots__})
+
+    def to_status(self) -> TaskStatus:
+        return TaskStatus.model_construct(**{field: getattr(self, field) for field in self.__slots__})
+
+class BulkStatusRequest(BaseModel):
+    task_ids: List[str]
+
+class BulkStatusResponse(BaseModel):
+    tasks: List[TaskStatus]
+    missing: List[str]  # 不存在或已过期的任务ID
+
+class TaskList(BaseModel):
+    tasks: List[TaskStatus]
+    next_cursor: Optional[str] = None  # 下一页的游标，没有更多任务时为空
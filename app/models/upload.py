@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+class UploadCreate(BaseModel):
+    file_name: str
+    length: int  # 文件总字节数
+
+class UploadSession(BaseModel):
+    upload_id: str  # 完成后即为任务ID
+    file_name: str
+    offset: int  # 已接收的字节数，续传时从这里开始
+    length: int
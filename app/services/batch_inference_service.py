@@ -0,0 +1,83 @@
+import time
+import logging
+import threading
+from typing import List
+
+from app.core.config import settings
+
+logger = logging.getLogger("mineru-api")
+
+class _BatchRequest:
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class MicroBatcher:
+    """跨任务合并小文档的模型推理
+
+    转换线程调用analyze提交数据集，同一模式下第一个到达的请求负责收集：等待一个时间窗口
+    （或凑满页数上限）后用batch_doc_analyze一次推理所有页面，再把结果交还给各自的任务继续解析。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = {True: [], False: []}
+        self._pending_pages = {True: 0, False: 0}
+
+    def analyze(self, dataset, ocr: bool):
+        """推理一个数据集，返回它自己的InferenceResult"""
+        request = _BatchRequest(dataset)
+        with self._cond:
+            leader = not self._pending[ocr]
+            self._pending[ocr].append(request)
+            self._pending_pages[ocr] += len(dataset)
+            if self._pending_pages[ocr] >= settings.MICRO_BATCH_MAX_PAGES:
+                self._cond.notify_all()
+
+            if leader:
+                deadline = time.monotonic() + settings.MICRO_BATCH_WINDOW_MS / 1000
+                while self._pending_pages[ocr] < settings.MICRO_BATCH_MAX_PAGES:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[ocr]
+                self._pending[ocr] = []
+                self._pending_pages[ocr] = 0
+
+        if leader:
+            self._run(batch, ocr)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self, batch: List[_BatchRequest], ocr: bool):
+        from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze, batch_doc_analyze
+
+        try:
+            if len(batch) > 1:
+                page_count = sum(len(request.dataset) for request in batch)
+                try:
+                    results = batch_doc_analyze([request.dataset for request in batch], "ocr" if ocr else "txt")
+                    logger.info(f"Batched inference of {len(batch)} documents, {page_count} pages, ocr={ocr}")
+                    for request, result in zip(batch, results):
+                        request.result = result
+                    return
+                except Exception as e:
+                    # 一个损坏的文档不应连累同批的其他任务，逐个重新推理
+                    logger.warning(f"Batched inference failed, falling back to per-document inference: {str(e)}")
+
+            for request in batch:
+                try:
+                    request.result = request.dataset.apply(doc_analyze, ocr=ocr)
+                except Exception as e:
+                    request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
+
+# 全局批处理器
+micro_batcher = MicroBatcher()
@@ -0,0 +1,83 @@
+import os
+import json
+from contextlib import closing
+from typing import Iterator, List, Optional
+
+from app.services.storage_service import get_storage
+
+# 内容块文件（每行一个content_list条目）和它的偏移索引
+BLOCKS_SUFFIX = "_blocks.ndjson"
+BLOCK_INDEX_SUFFIX = "_blocks_index.json"
+
+# 按类型合并的相邻区间的最大字节数，限制一次读取的数据量
+MAX_RANGE_BYTES = 1024 * 1024
+
+# 不筛选时顺序读取内容块文件的块大小
+READ_CHUNK_SIZE = 1024 * 1024
+
+def write_block_index(output_dir: str, name: str, content_list: list):
+    """把content_list写成逐行的内容块文件，并记录每页和每种类型的内容块所在的字节区间
+
+    索引格式: {"pages": {页码: [偏移, 长度]}, "types": {类型: [[偏移, 长度], ...]}}，
+    同一类型的相邻内容块合并为一个区间。查询时按区间读取，不需要加载整个content_list。
+    """
+    pages = {}
+    types = {}
+    offset = 0
+    with open(os.path.join(output_dir, f"{name}{BLOCKS_SUFFIX}"), "wb") as f:
+        for block in content_list:
+            line = (json.dumps(block, ensure_ascii=False) + "\n").encode("utf-8")
+            f.write(line)
+
+            page = str(block.get("page_idx", 0))
+            start = pages[page][0] if page in pages else offset
+            pages[page] = [start, offset + len(line) - start]
+
+            ranges = types.setdefault(block.get("type", "text"), [])
+            if ranges and sum(ranges[-1]) == offset and ranges[-1][1] + len(line) <= MAX_RANGE_BYTES:
+                ranges[-1][1] += len(line)
+            else:
+                ranges.append([offset, len(line)])
+            offset += len(line)
+
+    with open(os.path.join(output_dir, f"{name}{BLOCK_INDEX_SUFFIX}"), "w", encoding="utf-8") as f:
+        json.dump({"pages": pages, "types": types}, f, separators=(",", ":"))
+
+def block_index_name(files: List[str]) -> Optional[str]:
+    """任务输出文件名的前缀（与上传的文件名相同），用于找到内容块文件"""
+    for file_name in files or []:
+        if file_name.endswith("_content_list.json"):
+            return file_name[:-len("_content_list.json")]
+    return None
+
+def iter_blocks(task_id: str, name: str, page: Optional[int] = None, block_type: Optional[str] = None) -> Iterator[bytes]:
+    """逐行返回匹配的内容块（JSON文本，不含换行），只读取索引指向的字节区间"""
+    storage = get_storage()
+    blocks_file = f"{name}{BLOCKS_SUFFIX}"
+    if page is None and block_type is None:
+        # 不筛选时按顺序流式读取整个文件
+        with closing(storage.open(task_id, blocks_file)) as f:
+            pending = b""
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                yield from (line for line in lines if line)
+            if pending:
+                yield pending
+        return
+
+    with closing(storage.open(task_id, f"{name}{BLOCK_INDEX_SUFFIX}")) as f:
+        index = json.load(f)
+    if page is not None:
+        ranges = [index["pages"][str(page)]] if str(page) in index["pages"] else []
+    else:
+        ranges = index["types"].get(block_type, [])
+
+    for offset, length in ranges:
+        for line in storage.read_range(task_id, blocks_file, offset, length).splitlines():
+            block = json.loads(line)
+            if page is not None and block.get("page_idx", 0) != page:
+                continue
+            if block_type is not None and block.get("type", "text") != block_type:
+                continue
+            yield line
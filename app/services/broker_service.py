@@ -0,0 +1,396 @@
+import json
+import time
+import heapq
+import sqlite3
+import logging
+from contextlib import closing
+from functools import lru_cache
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.models.task import TaskStatus
+
+logger = logging.getLogger("mineru-api")
+
+# SQLite单条语句中IN列表的最大参数数
+SQLITE_MAX_PARAMS = 500
+
+def select_tasks(items: Iterable, status: Optional[str] = None, since: Optional[datetime] = None,
+                 after: Optional[Tuple[datetime, str]] = None, limit: int = 100) -> list:
+    """按(created_at, task_id)排序筛选任务，返回after之后的最多limit个，适用于TaskStatus和TaskRecord"""
+    selected = [
+        item for item in items
+        if (status is None or item.status == status)
+        and (since is None or item.created_at >= since)
+        and (after is None or (item.created_at, item.task_id) > after)
+    ]
+    return heapq.nsmallest(limit, selected, key=lambda item: (item.created_at, item.task_id))
+
+class Broker:
+    """任务队列和任务状态存储
+
+    API节点只负责把任务投递到队列并从这里读取状态，工作进程拉取任务、执行转换后把状态写回。
+    """
+
+    def ping(self):
+        """检查队列是否可用，不可用时抛出异常"""
+        raise NotImplementedError
+
+    def enqueue(self, job: dict):
+        """投递任务，job至少包含task_id，按priority从小到大出队（默认为投递时间）"""
+        raise NotImplementedError
+
+    def dequeue(self, timeout: float) -> Optional[dict]:
+        """取出一个任务，超时返回None。取出的任务需在处理结束后ack
+
+        取出时获得BROKER_LEASE_SECONDS的租约，执行期间需要定期renew；
+        工作进程崩溃后租约过期，任务由reclaim_expired放回队列。
+        """
+        raise NotImplementedError
+
+    def renew(self, job: dict):
+        """延长已取出任务的租约"""
+        raise NotImplementedError
+
+    def reclaim_expired(self) -> int:
+        """把租约已过期（取出它的工作进程已崩溃）的任务放回队列，返回放回的任务数"""
+        raise NotImplementedError
+
+    def ack(self, job: dict):
+        """确认任务已处理完毕，从队列中移除"""
+        raise NotImplementedError
+
+    def requeue(self, job: dict):
+        """把已取出但未处理完的任务放回队列，按原优先级重新出队"""
+        raise NotImplementedError
+
+    def save_status(self, task: TaskStatus):
+        raise NotImplementedError
+
+    def load_status(self, task_id: str) -> Optional[TaskStatus]:
+        raise NotImplementedError
+
+    def delete_status(self, task_id: str):
+        raise NotImplementedError
+
+    def list_statuses(self) -> List[TaskStatus]:
+        raise NotImplementedError
+
+    def load_statuses(self, task_ids: List[str]) -> List[TaskStatus]:
+        """批量读取任务状态，不存在的任务不出现在结果中"""
+        return [task for task in map(self.load_status, task_ids) if task is not None]
+
+    def query_statuses(self, status: Optional[str] = None, since: Optional[datetime] = None,
+                       after: Optional[Tuple[datetime, str]] = None, limit: int = 100) -> List[TaskStatus]:
+        """按创建时间分页查询任务状态，after为上一页最后一个任务的(created_at, task_id)"""
+        return select_tasks(self.list_statuses(), status, since, after, limit)
+
+    def claim_key(self, key: str, task_id: str) -> str:
+        """原子地把幂等键关联到task_id，键已存在时不覆盖，返回键当前关联的task_id"""
+        raise NotImplementedError
+
+    def release_key(self, key: str):
+        raise NotImplementedError
+
+    def request_cancel(self, task_id: str):
+        """标记任务需要取消，工作进程出队时跳过，执行中的任务由工作进程结束"""
+        raise NotImplementedError
+
+    def cancel_requested(self, task_id: str) -> bool:
+        raise NotImplementedError
+
+class SQLiteBroker(Broker):
+    """基于SQLite文件的队列，适合单机多进程部署和测试"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT NOT NULL, "
+                "payload TEXT NOT NULL, priority REAL NOT NULL, claimed_at REAL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS statuses (task_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY, task_id TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cancellations (task_id TEXT PRIMARY KEY)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每次操作使用独立连接，可在多个线程和进程中安全使用
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def ping(self):
+        with closing(self._connect()) as conn:
+            conn.execute("SELECT 1")
+
+    def enqueue(self, job: dict):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (task_id, payload, priority) VALUES (?, ?, ?)",
+                (job["task_id"], json.dumps(job), job.get("priority", time.time()))
+            )
+
+    def _claim(self) -> Optional[dict]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # claimed_at为最近一次取出或续约的时间
+            row = conn.execute("SELECT id, payload FROM jobs WHERE claimed_at IS NULL ORDER BY priority, id LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE jobs SET claimed_at = ? WHERE id = ?", (time.time(), row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        job = json.loads(row[1])
+        job["_job_id"] = row[0]
+        return job
+
+    def dequeue(self, timeout: float) -> Optional[dict]:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._claim()
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            time.sleep(min(settings.WORKER_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+    def renew(self, job: dict):
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET claimed_at = ? WHERE id = ? AND claimed_at IS NOT NULL", (time.time(), job["_job_id"]))
+
+    def reclaim_expired(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "UPDATE jobs SET claimed_at = NULL WHERE claimed_at < ?",
+                (time.time() - settings.BROKER_LEASE_SECONDS,)
+            ).rowcount
+
+    def ack(self, job: dict):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job["_job_id"],))
+
+    def requeue(self, job: dict):
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET claimed_at = NULL WHERE id = ?", (job["_job_id"],))
+
+    def save_status(self, task: TaskStatus):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO statuses (task_id, data) VALUES (?, ?)",
+                (task.task_id, task.model_dump_json())
+            )
+
+    def load_status(self, task_id: str) -> Optional[TaskStatus]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT data FROM statuses WHERE task_id = ?", (task_id,)).fetchone()
+        return TaskStatus.model_validate_json(row[0]) if row else None
+
+    def delete_status(self, task_id: str):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM statuses WHERE task_id = ?", (task_id,))
+            conn.execute("DELETE FROM idempotency_keys WHERE task_id = ?", (task_id,))
+            conn.execute("DELETE FROM cancellations WHERE task_id = ?", (task_id,))
+
+    def list_statuses(self) -> List[TaskStatus]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT data FROM statuses").fetchall()
+        return [TaskStatus.model_validate_json(row[0]) for row in rows]
+
+    def load_statuses(self, task_ids: List[str]) -> List[TaskStatus]:
+        result = []
+        with closing(self._connect()) as conn:
+            for i in range(0, len(task_ids), SQLITE_MAX_PARAMS):
+                chunk = task_ids[i:i + SQLITE_MAX_PARAMS]
+                rows = conn.execute(
+                    f"SELECT data FROM statuses WHERE task_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                result.extend(TaskStatus.model_validate_json(row[0]) for row in rows)
+        return result
+
+    def query_statuses(self, status: Optional[str] = None, since: Optional[datetime] = None,
+                       after: Optional[Tuple[datetime, str]] = None, limit: int = 100) -> List[TaskStatus]:
+        # created_at以ISO格式保存，按字符串比较即按时间比较
+        conditions, params = [], []
+        if status is not None:
+            conditions.append("json_extract(data, '$.status') = ?")
+            params.append(status)
+        if since is not None:
+            conditions.append("json_extract(data, '$.created_at') >= ?")
+            params.append(since.isoformat())
+        if after is not None:
+            conditions.append("(json_extract(data, '$.created_at'), task_id) > (?, ?)")
+            params.extend([after[0].isoformat(), after[1]])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT data FROM statuses {where} ORDER BY json_extract(data, '$.created_at'), task_id LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [TaskStatus.model_validate_json(row[0]) for row in rows]
+
+    def claim_key(self, key: str, task_id: str) -> str:
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR IGNORE INTO idempotency_keys (key, task_id) VALUES (?, ?)", (key, task_id))
+            return conn.execute("SELECT task_id FROM idempotency_keys WHERE key = ?", (key,)).fetchone()[0]
+
+    def release_key(self, key: str):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+    def request_cancel(self, task_id: str):
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR IGNORE INTO cancellations (task_id) VALUES (?)", (task_id,))
+
+    def cancel_requested(self, task_id: str) -> bool:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT 1 FROM cancellations WHERE task_id = ?", (task_id,)).fetchone() is not None
+
+class RedisBroker(Broker):
+    """基于Redis有序集合的优先级队列，兼容redis-py接口的客户端（如fakeredis）均可使用"""
+
+    QUEUE_KEY = "mineru:queue"
+    LEASE_KEY = "mineru:leases"  # 已取出的任务，分数为租约到期时间
+    STATUS_PREFIX = "mineru:status:"
+    IDEMPOTENCY_PREFIX = "mineru:idempotency:"
+    TASK_KEY_PREFIX = "mineru:task-idempotency:"  # task_id -> 幂等键，删除任务时一并删除键
+    CANCEL_PREFIX = "mineru:cancel:"
+
+    def __init__(self, url: str = None, client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def ping(self):
+        self.client.ping()
+
+    def enqueue(self, job: dict):
+        self.client.zadd(self.QUEUE_KEY, {json.dumps(job): job.get("priority", time.time())})
+
+    def _transaction(self, watch_key: str, func):
+        """在WATCH watch_key的事务中执行func(pipe)，键被其他客户端修改时重试"""
+        from redis.exceptions import WatchError
+
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(watch_key)
+                    return func(pipe)
+                except WatchError:
+                    continue
+
+    def _claim(self) -> Optional[bytes]:
+        # 取出优先级最高的任务和登记租约在同一事务中完成，工作进程在两步之间退出不会丢失任务
+        def claim(pipe) -> Optional[bytes]:
+            items = pipe.zrange(self.QUEUE_KEY, 0, 0)
+            if not items:
+                return None
+            pipe.multi()
+            pipe.zrem(self.QUEUE_KEY, items[0])
+            pipe.zadd(self.LEASE_KEY, {items[0]: time.time() + settings.BROKER_LEASE_SECONDS})
+            pipe.execute()
+            return items[0]
+
+        return self._transaction(self.QUEUE_KEY, claim)
+
+    def dequeue(self, timeout: float) -> Optional[dict]:
+        # BZPOPMIN无法和登记租约组成事务，改为轮询
+        deadline = time.monotonic() + timeout
+        while True:
+            payload = self._claim()
+            if payload is not None:
+                job = json.loads(payload)
+                job["_payload"] = payload.decode() if isinstance(payload, bytes) else payload
+                return job
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(settings.WORKER_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+    def renew(self, job: dict):
+        self.client.zadd(self.LEASE_KEY, {job["_payload"]: time.time() + settings.BROKER_LEASE_SECONDS}, xx=True)
+
+    def reclaim_expired(self) -> int:
+        def reclaim(pipe) -> int:
+            expired = pipe.zrangebyscore(self.LEASE_KEY, "-inf", time.time())
+            if not expired:
+                return 0
+            pipe.multi()
+            for payload in expired:
+                pipe.zrem(self.LEASE_KEY, payload)
+                pipe.zadd(self.QUEUE_KEY, {payload: json.loads(payload).get("priority", time.time())})
+            pipe.execute()
+            return len(expired)
+
+        return self._transaction(self.LEASE_KEY, reclaim)
+
+    def ack(self, job: dict):
+        self.client.zrem(self.LEASE_KEY, job["_payload"])
+
+    def requeue(self, job: dict):
+        pipe = self.client.pipeline()
+        pipe.zadd(self.QUEUE_KEY, {job["_payload"]: job.get("priority", time.time())})
+        pipe.zrem(self.LEASE_KEY, job["_payload"])
+        pipe.execute()
+
+    def save_status(self, task: TaskStatus):
+        self.client.set(self.STATUS_PREFIX + task.task_id, task.model_dump_json())
+
+    def load_status(self, task_id: str) -> Optional[TaskStatus]:
+        data = self.client.get(self.STATUS_PREFIX + task_id)
+        return TaskStatus.model_validate_json(data) if data else None
+
+    def delete_status(self, task_id: str):
+        key = self.client.get(self.TASK_KEY_PREFIX + task_id)
+        if key is not None:
+            self.client.delete(self.IDEMPOTENCY_PREFIX + (key.decode() if isinstance(key, bytes) else key))
+        self.client.delete(self.STATUS_PREFIX + task_id, self.TASK_KEY_PREFIX + task_id, self.CANCEL_PREFIX + task_id)
+
+    def list_statuses(self) -> List[TaskStatus]:
+        result = []
+        for key in self.client.scan_iter(match=self.STATUS_PREFIX + "*"):
+            data = self.client.get(key)
+            if data:
+                result.append(TaskStatus.model_validate_json(data))
+        return result
+
+    def load_statuses(self, task_ids: List[str]) -> List[TaskStatus]:
+        if not task_ids:
+            return []
+        values = self.client.mget([self.STATUS_PREFIX + task_id for task_id in task_ids])
+        return [TaskStatus.model_validate_json(data) for data in values if data]
+
+    def claim_key(self, key: str, task_id: str) -> str:
+        # 键与任务结果同时过期
+        redis_key = self.IDEMPOTENCY_PREFIX + key
+        expires = settings.TASK_EXPIRY_HOURS * 3600
+        if self.client.set(redis_key, task_id, nx=True, ex=expires):
+            self.client.set(self.TASK_KEY_PREFIX + task_id, key, ex=expires)
+            return task_id
+        existing = self.client.get(redis_key)
+        if existing is None:
+            return self.claim_key(key, task_id)
+        return existing.decode() if isinstance(existing, bytes) else existing
+
+    def release_key(self, key: str):
+        self.client.delete(self.IDEMPOTENCY_PREFIX + key)
+
+    def request_cancel(self, task_id: str):
+        self.client.set(self.CANCEL_PREFIX + task_id, 1, ex=settings.TASK_EXPIRY_HOURS * 3600)
+
+    def cancel_requested(self, task_id: str) -> bool:
+        return bool(self.client.exists(self.CANCEL_PREFIX + task_id))
+
+@lru_cache(maxsize=None)
+def get_broker() -> Broker:
+    """根据BROKER_URL返回队列实例"""
+    if settings.BROKER_URL.startswith("sqlite:///"):
+        return SQLiteBroker(settings.BROKER_URL[len("sqlite:///"):])
+    if settings.BROKER_URL.startswith(("redis://", "rediss://")):
+        return RedisBroker(settings.BROKER_URL)
+    raise ValueError(f"Unsupported broker url: {settings.BROKER_URL}")
@@ -0,0 +1,60 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("mineru-api")
+
+class CheckpointStore:
+    """转换阶段的检查点
+
+    每完成一段页面的推理和解析就保存模型结果和中间结果，重试时已完成的部分直接读取，
+    不再重新执行doc_analyze。检查点放在任务的上传目录中，不会被发布到存储后端，
+    任务删除时一并删除。
+    """
+
+    def __init__(self, task_id: str):
+        self.dir = os.path.join(settings.UPLOAD_DIR, task_id, ".checkpoints")
+
+    def _path(self, name: str, kind: str) -> str:
+        return os.path.join(self.dir, f"{name}.{kind}.json")
+
+    def load(self, name: str) -> Optional[Tuple[list, dict]]:
+        """读取检查点，返回(model_json, middle_json)，不存在或不完整时返回None"""
+        try:
+            with open(self._path(name, "model"), "r", encoding="utf-8") as f:
+                model_json = json.load(f)
+            with open(self._path(name, "middle"), "r", encoding="utf-8") as f:
+                middle_json = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return model_json, middle_json
+
+    def _write(self, path: str, content: str):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def save(self, name: str, infer_result, pipe_result):
+        """保存一个阶段的推理结果和解析结果"""
+        os.makedirs(self.dir, exist_ok=True)
+        try:
+            self._write(self._path(name, "model"), json.dumps(infer_result.get_infer_res(), ensure_ascii=False))
+            self._write(self._path(name, "middle"), pipe_result.get_middle_json())
+        except (OSError, TypeError, ValueError) as e:
+            # 检查点只用于加速重试，保存失败不影响本次转换
+            logger.warning(f"Failed to save checkpoint {name}: {str(e)}")
+
+    def middle_files(self) -> List[str]:
+        """已保存的中间结果文件，图片后处理改名时一并更新其中的图片引用"""
+        if not os.path.isdir(self.dir):
+            return []
+        return [os.path.join(self.dir, name) for name in os.listdir(self.dir) if name.endswith(".middle.json")]
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
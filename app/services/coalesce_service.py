@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.core.config import settings
+from app.models.task import TaskStatus, TaskRecord
+from app.services.pdf_service import tasks, notify_status, status_listeners
+from app.services.expiry_service import expiry_queue
+from app.services.storage_service import get_storage
+from app.services.scheduler_service import scheduler
+from app.services.search_service import search_index
+
+logger = logging.getLogger("mineru-api")
+
+# 跟随者从领头任务同步的字段
+FOLLOWED_FIELDS = ("status", "error", "pages_completed", "retries", "eta", "postprocess")
+
+class SingleFlight:
+    """合并同时提交的相同转换（本地执行模式）
+
+    上传内容的哈希和文件名相同、且已有任务在排队或转换中时，新任务作为跟随者挂到该任务上，
+    不再占用调度器的并发槽位。跟随者同步领头任务的状态和进度；领头任务完成后输出被复制到
+    跟随者名下，失败时跟随者以同样的错误结束，领头任务被取消时由第一个跟随者重新提交转换。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leaders = {}  # {合并键: 领头任务ID}
+        self._keys = {}  # {领头任务ID: 合并键}
+        self._followers = {}  # {领头任务ID: {跟随任务ID: (PDF路径, 估算耗时)}}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind(self):
+        """绑定到当前事件循环并开始监听任务状态（在应用启动时调用）"""
+        self._loop = asyncio.get_running_loop()
+        if self._on_status not in status_listeners:
+            status_listeners.append(self._on_status)
+
+    def lead(self, key: str, task_id: str):
+        """登记即将提交转换的任务，之后相同的上传会跟随它"""
+        with self._lock:
+            self._leaders[key] = task_id
+            self._keys[task_id] = key
+            self._followers[task_id] = {}
+
+    def follow(self, key: str, task: TaskRecord, pdf_path: str, estimated_seconds: float) -> Optional[str]:
+        """有相同的转换在进行中时把任务挂到它上面并返回领头任务ID，否则返回None"""
+        with self._lock:
+            leader_id = self._leaders.get(key)
+            if leader_id is None or leader_id not in tasks:
+                return None
+            leader = tasks[leader_id]
+            for field in FOLLOWED_FIELDS:
+                setattr(task, field, getattr(leader, field))
+            tasks[task.task_id] = task
+            self._followers[leader_id][task.task_id] = (pdf_path, estimated_seconds)
+        logger.info(f"Task {task.task_id} follows identical in-flight task {leader_id}")
+        return leader_id
+
+    def detach(self, task_id: str) -> bool:
+        """取消跟随（跟随者被取消时调用），任务不是跟随者时返回False"""
+        with self._lock:
+            for followers in self._followers.values():
+                if followers.pop(task_id, None) is not None:
+                    return True
+        return False
+
+    def _on_status(self, status: TaskStatus):
+        """领头任务的状态变化同步给跟随者，领头任务结束时在事件循环中处理跟随者"""
+        with self._lock:
+            if status.task_id not in self._followers:
+                return
+            finished = status.status not in ("pending", "processing")
+            if finished:
+                key = self._keys.pop(status.task_id)
+                if self._leaders.get(key) == status.task_id:
+                    del self._leaders[key]
+                followers = self._followers.pop(status.task_id)
+            else:
+                followers = dict(self._followers[status.task_id])
+
+        if finished:
+            if followers and self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.create_task, self._finish(status, key, followers))
+            return
+        for follower_id in followers:
+            follower = tasks.get(follower_id)
+            if follower is None:
+                continue
+            for field in FOLLOWED_FIELDS:
+                setattr(follower, field, getattr(status, field))
+            notify_status(follower_id)
+
+    async def _finish(self, status: TaskStatus, key: str, followers: dict):
+        """领头任务结束后完成跟随者：复制输出、同步失败，或在领头任务被取消时重新提交"""
+        if status.status == "cancelled":
+            new_leader = None
+            for follower_id, (pdf_path, estimated_seconds) in followers.items():
+                if follower_id not in tasks:
+                    continue
+                if new_leader is None:
+                    # 领头任务被它的提交者取消，跟随者仍需要转换结果
+                    new_leader = follower_id
+                    self.lead(key, follower_id)
+                    tasks[follower_id].status = "pending"
+                    tasks[follower_id].error = None
+                    scheduler.submit(follower_id, pdf_path, estimated_seconds)
+                    logger.info(f"Task {follower_id} takes over cancelled task {status.task_id}")
+                else:
+                    with self._lock:
+                        self._followers[new_leader][follower_id] = (pdf_path, estimated_seconds)
+            return
+
+        for follower_id in followers:
+            follower = tasks.get(follower_id)
+            if follower is None:
+                continue
+            if status.status == "completed":
+                try:
+                    await asyncio.to_thread(get_storage().copy, status.task_id, follower_id)
+                    if settings.SEARCH_INDEX_ENABLED:
+                        await asyncio.to_thread(search_index.copy_task, status.task_id, follower_id)
+                except Exception as e:
+                    logger.error(f"Failed to copy outputs of task {status.task_id} to {follower_id}: {str(e)}", exc_info=True)
+                    follower.status = "failed"
+                    follower.error = f"Failed to copy outputs: {str(e)}"
+                    follower.expires_at = datetime.now() + timedelta(hours=1)
+                else:
+                    follower.status = "completed"
+                    follower.error = None
+                    follower.files = status.files
+                    follower.pages_completed = status.pages_completed
+                    follower.expires_at = datetime.now() + timedelta(hours=settings.TASK_EXPIRY_HOURS)
+            else:
+                follower.status = status.status
+                follower.error = status.error
+                follower.expires_at = datetime.now() + timedelta(hours=1)
+            follower.eta = None
+            expiry_queue.schedule(follower_id, follower.expires_at)
+            notify_status(follower_id)
+            logger.info(f"Task {follower_id} finished with task {status.task_id}: {follower.status}")
+
+# 全局合并器
+single_flight = SingleFlight()
@@ -0,0 +1,138 @@
+import os
+import gzip
+import shutil
+import time
+import struct
+import zipfile
+from contextlib import closing
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+
+# 压缩保存的文件在存储中的后缀，任务的文件列表中仍使用原文件名
+COMPRESSED_SUFFIX = ".gz"
+
+# 压缩保存的文本输出
+COMPRESSIBLE_SUFFIXES = (".md", "_content_list.json", "_middle.json")
+
+# 不带文件名和额外字段的gzip头长度，以及gzip尾部（CRC32和原始大小）的长度
+GZIP_HEADER_SIZE = 10
+GZIP_TRAILER_SIZE = 8
+
+def compress_outputs(output_dir: str, files: List[str]):
+    """把工作目录中的文本输出压缩为.gz并删除原文件（转换完成、发布之前调用）"""
+    for file_name in files:
+        if not file_name.endswith(COMPRESSIBLE_SUFFIXES):
+            continue
+        path = os.path.join(output_dir, file_name)
+        if not os.path.isfile(path):
+            continue
+        # 固定mtime且不写入文件名，gzip头为最短的10字节，打包ZIP时可以直接取出其中的DEFLATE数据
+        with open(path, "rb") as src, open(path + COMPRESSED_SUFFIX, "wb") as raw, \
+                gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=settings.OUTPUT_COMPRESSION_LEVEL, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.remove(path)
+
+def stored_file(storage, task_id: str, file_name: str) -> Optional[Tuple[str, bool]]:
+    """文件在存储中的实际路径和是否压缩，不存在时返回None；压缩功能开启前的任务按原文件名保存"""
+    if file_name.endswith(COMPRESSIBLE_SUFFIXES) and storage.exists(task_id, file_name + COMPRESSED_SUFFIX):
+        return file_name + COMPRESSED_SUFFIX, True
+    if storage.exists(task_id, file_name):
+        return file_name, False
+    return None
+
+def open_output(storage, task_id: str, file_name: str) -> BinaryIO:
+    """读取任务的输出文件，压缩保存的文件在读取时解压"""
+    stored = stored_file(storage, task_id, file_name)
+    if stored is None:
+        raise FileNotFoundError(file_name)
+    rel_path, compressed = stored
+    src = storage.open(task_id, rel_path)
+    return gzip.GzipFile(fileobj=src, mode="rb") if compressed else src
+
+def decompressed_size(storage, task_id: str, rel_path: str) -> int:
+    """存储中.gz文件解压后的大小，取自gzip尾部（原始大小的低32位，文本输出远小于4GB）"""
+    stored_size = storage.size(task_id, rel_path)
+    return struct.unpack("<I", storage.read_range(task_id, rel_path, stored_size - 4, 4))[0]
+
+def iter_decompressed(storage, task_id: str, rel_path: str, start: int = 0, length: Optional[int] = None,
+                      chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """流式解压存储中的.gz文件，start和length为解压后内容的字节范围（用于Range请求）"""
+    with closing(storage.open(task_id, rel_path)) as src, gzip.GzipFile(fileobj=src, mode="rb") as f:
+        if start:
+            f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+def _quality(params: str) -> float:
+    """Accept-Encoding中一项的q值，没有q参数或无法解析时按1处理"""
+    for param in params.split(";"):
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value.strip() or 1)
+            except ValueError:
+                return 1.0
+    return 1.0
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """客户端的Accept-Encoding是否接受gzip（q=0表示拒绝）
+
+    明确列出的gzip优先于*（RFC 9110），gzip未列出时才按*的q值判断。
+    """
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if coding in ("gzip", "*"):
+            qualities.setdefault(coding, _quality(params))
+    return qualities.get("gzip", qualities.get("*", 0)) > 0
+
+def write_precompressed(zipf: zipfile.ZipFile, storage, task_id: str, rel_path: str, arcname: str) -> bool:
+    """把.gz中的DEFLATE数据原样写入ZIP条目，不重新压缩
+
+    gzip和ZIP的DEFLATED条目使用相同的压缩数据和CRC32，只需要换成ZIP的文件头。
+    gzip头不是compress_outputs写出的10字节格式时返回False，由调用方按普通文件处理。
+    """
+    stored_size = storage.size(task_id, rel_path)
+    header = storage.read_range(task_id, rel_path, 0, GZIP_HEADER_SIZE)
+    # 魔数、DEFLATE方法、无任何可选字段
+    if stored_size < GZIP_HEADER_SIZE + GZIP_TRAILER_SIZE or header[:4] != b"\x1f\x8b\x08\x00":
+        return False
+    crc, file_size = struct.unpack("<II", storage.read_range(task_id, rel_path, stored_size - GZIP_TRAILER_SIZE, GZIP_TRAILER_SIZE))
+    compress_size = stored_size - GZIP_HEADER_SIZE - GZIP_TRAILER_SIZE
+
+    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = compress_size
+    zinfo.external_attr = 0o644 << 16
+    # 条目不使用ZIP64，gzip尾部也只记录原始大小的低32位；文本输出远小于4GB，异常大的文件按普通文件写入
+    if compress_size >= zipfile.ZIP64_LIMIT:
+        return False
+
+    # zipfile没有写入已压缩数据的公开接口，按ZipFile.write的方式直接写文件头和数据
+    zipf._writecheck(zinfo)
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader(False))
+    with closing(storage.open(task_id, rel_path)) as src:
+        src.read(GZIP_HEADER_SIZE)
+        remaining = compress_size
+        while remaining > 0:
+            chunk = src.read(min(1024 * 1024, remaining))
+            if not chunk:
+                raise IOError(f"Unexpected end of {rel_path}")
+            zipf.fp.write(chunk)
+            remaining -= len(chunk)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+    zipf._didModify = True
+    return True
@@ -0,0 +1,42 @@
+import time
+import asyncio
+import logging
+from fastapi import HTTPException
+
+from app.services.scheduler_service import scheduler
+from app.services.runner_service import runner
+
+logger = logging.getLogger("mineru-api")
+
+class DrainState:
+    """进程的排空状态：收到停止信号后不再接收新任务，已接收的任务继续执行，状态查询和下载照常响应"""
+
+    def __init__(self):
+        self.draining = False
+
+    def check_accepting(self):
+        """排空期间拒绝创建新任务，客户端可以重试到其他节点"""
+        if self.draining:
+            raise HTTPException(
+                status_code=503,
+                detail="Server is shutting down. Please retry.",
+                headers={"Retry-After": "5"}
+            )
+
+    async def drain(self, timeout: float) -> bool:
+        """停止接收新任务并等待本进程中排队和执行中的转换及后处理完成，超时返回False"""
+        self.draining = True
+        logger.info(f"Draining: {scheduler.pending_count} queued, {scheduler.running_count} running, "
+                    f"{runner.postprocessing_count} post-processing tasks")
+        deadline = time.monotonic() + timeout
+        while scheduler.pending_count or scheduler.running_count or runner.postprocessing_count:
+            if time.monotonic() >= deadline:
+                logger.warning(f"Drain timed out with {scheduler.pending_count} queued, {scheduler.running_count} running, "
+                               f"{runner.postprocessing_count} post-processing tasks")
+                return False
+            await asyncio.sleep(1)
+        logger.info("Drain complete")
+        return True
+
+# 全局排空状态
+drain_state = DrainState()
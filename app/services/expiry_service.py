@@ -0,0 +1,59 @@
+import asyncio
+import heapq
+import itertools
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+
+class ExpiryQueue:
+    """按过期时间排序的最小堆
+
+    清理协程只需睡眠到堆顶的过期时间，有更早的过期时间加入时被唤醒。
+    任务的过期时间改变后直接重新入堆，旧条目在出堆时由调用方按任务当前状态过滤。
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def bind(self):
+        """绑定到当前事件循环（在清理协程中调用）"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, task_id: str, expires_at: datetime):
+        """登记任务的过期时间，可在任意线程中调用"""
+        with self._lock:
+            heapq.heappush(self._heap, (expires_at, next(self._counter), task_id))
+            is_earliest = self._heap[0][2] == task_id
+        if is_earliest and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def pop_due(self, now: datetime) -> List[str]:
+        """弹出所有过期时间不晚于now的任务ID"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def next_expiry(self) -> Optional[datetime]:
+        """返回最早的过期时间"""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    async def wait(self, timeout: Optional[float]):
+        """睡眠到超时或有更早的过期时间加入"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+
+# 全局过期队列
+expiry_queue = ExpiryQueue()
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Tuple
+
+from app.core.config import settings
+from app.services.broker_service import get_broker
+from app.services.runner_service import runner
+from app.services.scheduler_service import scheduler
+from app.services.drain_service import drain_state
+
+async def check_readiness() -> Tuple[bool, dict]:
+    """检查节点是否可以接收新任务，返回(是否就绪, 各项检查结果)"""
+    checks = {}
+    ready = True
+    
+    if drain_state.draining:
+        checks["drain"] = "draining"
+        ready = False
+    
+    if settings.EXECUTION_MODE == "broker":
+        # API节点不加载模型，只需队列可用
+        try:
+            await asyncio.to_thread(get_broker().ping)
+            checks["broker"] = "ok"
+        except Exception as e:
+            checks["broker"] = f"unavailable: {str(e)}"
+            ready = False
+        return ready, checks
+    
+    if runner.models_ready:
+        checks["models"] = "warm"
+    elif runner.warmup_error:
+        checks["models"] = f"failed: {runner.warmup_error}"
+        ready = False
+    elif not settings.WARMUP_MODELS:
+        checks["models"] = "lazy"
+    else:
+        checks["models"] = "loading"
+        ready = False
+    
+    if scheduler.pending_count >= settings.MAX_QUEUED_TASKS:
+        checks["queue"] = "full"
+        ready = False
+    else:
+        checks["queue"] = "accepting"
+    return ready, checks
@@ -0,0 +1,162 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger("mineru-api")
+
+# 引用图片的文件（Markdown、content_list中为images/<文件名>，middle JSON中为<文件名>）
+REFERENCING_SUFFIXES = (".md", "_content_list.json", "_middle.json")
+
+# 输出文件中的图片文件名
+IMAGE_NAME = re.compile(r"[\w\-.]+\.(?:jpe?g|png|webp)", re.IGNORECASE)
+
+# 缩略图目录（相对于图片目录），缩略图与原图同名
+THUMBNAIL_DIR = "thumbs"
+
+# 转码格式对应的扩展名
+TRANSCODE_FORMATS = {"webp": ".webp", "jpeg": ".jpg"}
+
+# 按扩展名保存时使用的PIL格式
+PIL_FORMATS = {".png": "PNG", ".webp": "WEBP"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _exit_with_parent():
+    """进程池工作进程的初始化函数：父进程退出（包括转换子进程被结束）时随之退出，不留下孤儿进程"""
+    sentinel = multiprocessing.parent_process().sentinel
+
+    def watch():
+        multiprocessing.connection.wait([sentinel])
+        os._exit(1)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+def _get_pool() -> ProcessPoolExecutor:
+    """图片转码的进程池，第一次使用时创建，同一进程中的转换任务共用"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn启动，不复制转换进程中已加载的模型
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_POSTPROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_exit_with_parent
+            )
+        return _pool
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def transcode_image(image_dir: str, name: str, image_format: str, quality: int, thumbnail_size: int) -> str:
+    """转码一张图片并生成缩略图（在进程池中执行），返回处理后的文件名
+
+    转码后比原图大时保留原图。改名时原图不删除，由调用方更新引用后再删除。
+    """
+    from PIL import Image
+
+    def save(image, target: str, ext: str):
+        pil_format = PIL_FORMATS.get(ext.lower(), "JPEG")
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(target, pil_format, quality=quality)
+
+    path = os.path.join(image_dir, name)
+    with Image.open(path) as image:
+        image.load()
+
+    if image_format in TRANSCODE_FORMATS:
+        new_name = os.path.splitext(name)[0] + TRANSCODE_FORMATS[image_format]
+        tmp_path = os.path.join(image_dir, f"{new_name}.tmp")
+        save(image, tmp_path, TRANSCODE_FORMATS[image_format])
+        if os.path.getsize(tmp_path) < os.path.getsize(path):
+            os.replace(tmp_path, os.path.join(image_dir, new_name))
+            name = new_name
+        else:
+            os.remove(tmp_path)
+
+    if thumbnail_size > 0:
+        os.makedirs(os.path.join(image_dir, THUMBNAIL_DIR), exist_ok=True)
+        image.thumbnail((thumbnail_size, thumbnail_size))
+        save(image, os.path.join(image_dir, THUMBNAIL_DIR, name), os.path.splitext(name)[1])
+    return name
+
+def _rewrite_references(path: str, renames: Dict[str, str]):
+    """把文件中引用的图片文件名替换为新文件名"""
+    tmp_path = f"{path}.tmp"
+    replace = lambda match: renames.get(match.group(0), match.group(0))
+    with open(path, "r", encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+        for line in src:
+            dst.write(IMAGE_NAME.sub(replace, line))
+    os.replace(tmp_path, path)
+
+def postprocess_images(output_dir: str, image_dir: str, referencing_files: Iterable[str] = ()):
+    """转换输出的图片后处理：按内容去重，可选转码和生成缩略图，并更新Markdown、content_list和middle JSON中的引用
+
+    MinerU按页面和位置给裁剪出的图片命名，不同页面上相同的图片（页眉徽标、重复的图表）会保存多份。
+    内容相同的图片只保留第一张，其余的引用指向它；转码和缩略图在进程池中并行执行。
+    referencing_files为输出目录之外引用图片的文件（检查点中的中间结果），所有引用更新后才删除被替换的图片，
+    中途失败重试时从检查点重新输出的内容不会引用已删除的文件。
+    """
+    image_path = os.path.join(output_dir, image_dir)
+    if not os.path.isdir(image_path):
+        return
+    names = sorted(
+        entry.name for entry in os.scandir(image_path)
+        if entry.is_file() and IMAGE_NAME.fullmatch(entry.name)
+    )
+    if not names:
+        return
+
+    renames = {}
+    unique = {}  # {内容哈希: 保留的文件名}
+    for name in names:
+        kept = unique.setdefault(_file_digest(os.path.join(image_path, name)), name)
+        if kept != name:
+            renames[name] = kept
+
+    if settings.IMAGE_TRANSCODE_FORMAT in TRANSCODE_FORMATS or settings.IMAGE_THUMBNAIL_SIZE > 0:
+        pool = _get_pool()
+        futures = {
+            name: pool.submit(transcode_image, image_path, name, settings.IMAGE_TRANSCODE_FORMAT,
+                              settings.IMAGE_QUALITY, settings.IMAGE_THUMBNAIL_SIZE)
+            for name in unique.values()
+        }
+        transcoded = {}
+        for name, future in futures.items():
+            try:
+                new_name = future.result()
+            except Exception as e:
+                # 无法解码的图片保持原样
+                logger.warning(f"Failed to transcode image {name}: {str(e)}")
+                continue
+            if new_name != name:
+                transcoded[name] = new_name
+        renames = {name: transcoded.get(kept, kept) for name, kept in renames.items()}
+        renames.update(transcoded)
+
+    if renames:
+        for file_name in os.listdir(output_dir):
+            if file_name.endswith(REFERENCING_SUFFIXES):
+                _rewrite_references(os.path.join(output_dir, file_name), renames)
+        for path in referencing_files:
+            _rewrite_references(path, renames)
+        for name in renames:
+            try:
+                os.remove(os.path.join(image_path, name))
+            except FileNotFoundError:
+                pass
+    logger.info(f"Post-processed {len(names)} images in {output_dir}: {len(names) - len(unique)} duplicates removed, "
+                f"{sum(1 for name in unique.values() if renames.get(name, name) != name)} transcoded")
@@ -0,0 +1,166 @@
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+from typing import Callable, List, Optional
+import fitz
+
+from app.core.config import settings
+from app.utils.fs import EVICTION_CHECK_FRACTION, evict_lru_files
+
+logger = logging.getLogger("mineru-api")
+
+def _stream_digest(doc, xref: int, digests: dict) -> str:
+    """对象内容的摘要，同一文档中被多页引用的图片和表单只计算一次"""
+    if xref not in digests:
+        if xref <= 0:
+            digests[xref] = ""
+        elif doc.xref_is_stream(xref):
+            digests[xref] = hashlib.sha256(doc.xref_stream_raw(xref)).hexdigest()
+        else:
+            digests[xref] = hashlib.sha256(doc.xref_object(xref, compressed=True).encode()).hexdigest()
+    return digests[xref]
+
+def page_fingerprints(pdf_bytes: bytes) -> List[str]:
+    """逐页计算页面内容的哈希：页面尺寸、内容流，以及内容流按名称引用的字体、图片、表单和注释
+
+    只使用对象的内容而不使用对象编号，修订版中未改动的页面即使对象被重新编号，哈希也不变。
+    """
+    fingerprints = []
+    digests = {}
+    with fitz.open("pdf", pdf_bytes) as doc:
+        for page in doc:
+            digest = hashlib.sha256()
+            digest.update(repr((tuple(page.rect), page.rotation)).encode())
+            digest.update(page.read_contents())
+            for xref, ext, font_type, basefont, name, encoding, *_ in page.get_fonts(full=True):
+                digest.update(repr((name, ext, font_type, basefont, encoding)).encode())
+            for xref, smask, *_, name, _, _ in page.get_images(full=True):
+                digest.update(name.encode())
+                digest.update(_stream_digest(doc, xref, digests).encode())
+                digest.update(_stream_digest(doc, smask, digests).encode())
+            for xref, name, *_ in page.get_xobjects():
+                digest.update(name.encode())
+                digest.update(_stream_digest(doc, xref, digests).encode())
+            for annot in page.annots():
+                digest.update(repr((annot.type, tuple(annot.rect), annot.info.get("content"))).encode())
+            fingerprints.append(digest.hexdigest())
+    return fingerprints
+
+def _model_signature() -> str:
+    """推理模型的版本和配置，换模型或改配置后旧的缓存结果不再命中"""
+    parts = []
+    try:
+        from importlib.metadata import version
+        parts.append(version("magic-pdf"))
+    except Exception:
+        parts.append("unknown")
+    try:
+        from magic_pdf.libs.config_reader import read_config
+        parts.append(json.dumps(read_config(), sort_keys=True, default=str))
+    except Exception:
+        pass
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+class PageResultCache:
+    """逐页推理结果的磁盘缓存
+
+    键为页面内容哈希+解析模式+模型签名，值为该页的模型结果（版面检测和OCR结果）。
+    同一规范的不同修订版只有少数页面改动，再次转换时只对哈希变化的页面执行doc_analyze，
+    其余页面直接使用缓存的结果。总大小按LRU限制在max_bytes以内，多个进程可以共用同一目录。
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._unchecked_bytes = 0  # 上次按磁盘统计总大小之后本进程写入的字节数
+        self._signature = None
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+            evict_lru_files(root, ".json", max_bytes)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def page_keys(self, pdf_bytes: bytes, ocr: bool) -> List[str]:
+        if self._signature is None:
+            self._signature = _model_signature()
+        mode = "ocr" if ocr else "txt"
+        return [f"{fingerprint}_{mode}_{self._signature}" for fingerprint in page_fingerprints(pdf_bytes)]
+
+    def get(self, key: str) -> Optional[dict]:
+        # 直接读取文件，其他进程写入的结果也能命中
+        name = f"{key}.json"
+        path = os.path.join(self.root, name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                page = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return page
+
+    def put(self, key: str, page: dict):
+        name = f"{key}.json"
+        path = os.path.join(self.root, name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(page, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to cache page result {name}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        # 按磁盘上的实际大小淘汰，其他进程写入的文件也计入总大小
+        with self._lock:
+            self._unchecked_bytes += size
+            if self._unchecked_bytes < self.max_bytes // EVICTION_CHECK_FRACTION:
+                return
+            self._unchecked_bytes = 0
+        evict_lru_files(self.root, ".json", self.max_bytes)
+
+    def analyze(self, ds, ocr: bool, analyze: Callable):
+        """推理数据集，缓存中已有的页面直接使用保存的结果，只把其余页面交给analyze(ds, ocr)
+
+        未命中的页面切成一份只包含这些页面的PDF推理，页面渲染沿用原数据集的get_image，
+        栅格缓存仍然有效。返回整个数据集的InferenceResult。
+        """
+        from magic_pdf.data.dataset import PymuDocDataset
+        from magic_pdf.operators.models import InferenceResult
+
+        keys = self.page_keys(ds.data_bits(), ocr)
+        pages = [self.get(key) for key in keys]
+        missing = [index for index, page in enumerate(pages) if page is None]
+        if len(missing) < len(pages):
+            logger.info(f"Page result cache: reusing {len(pages) - len(missing)}/{len(pages)} pages, "
+                        f"analyzing {len(missing)}")
+
+        if missing:
+            if len(missing) == len(pages):
+                sub_ds = ds
+            else:
+                with fitz.open("pdf", ds.data_bits()) as doc:
+                    doc.select(missing)
+                    sub_ds = PymuDocDataset(doc.tobytes())
+                for sub_index, index in enumerate(missing):
+                    sub_ds.get_page(sub_index).get_image = ds.get_page(index).get_image
+            for index, page in zip(missing, analyze(sub_ds, ocr).get_infer_res()):
+                pages[index] = page
+                self.put(keys[index], page)
+
+        model_json = [
+            {**page, "page_info": {**page["page_info"], "page_no": index}}
+            for index, page in enumerate(pages)
+        ]
+        return InferenceResult(model_json, ds)
+
+# 全局逐页推理结果缓存
+page_result_cache = PageResultCache(settings.PAGE_RESULT_CACHE_DIR, settings.PAGE_RESULT_CACHE_MAX_BYTES)
@@ -1,64 +1,542 @@
 import os
+import gc
+import json
+import time
+import shutil
 import logging
+import textwrap
+from contextlib import closing
 from datetime import datetime, timedelta
-import magic_pdf.data.data_reader_writer as drw
-from magic_pdf.data.dataset import PymuDocDataset
-from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
-from magic_pdf.config.enums import SupportedPdfParseMethod
+from typing import List, Optional, Tuple
+import fitz
 
 from app.core.config import settings
 from app.models.task import TaskStatus
+from app.services.expiry_service import expiry_queue
+from app.services.storage_service import get_storage
+from app.services.preflight_service import page_has_text_layer
+from app.services.batch_inference_service import micro_batcher
+from app.services.raster_cache_service import raster_cache
+from app.services.page_result_cache_service import page_result_cache
+from app.services.thread_budget_service import thread_budget
+from app.services.search_service import search_index
+from app.services.block_index_service import write_block_index
+from app.services.compression_service import compress_outputs, open_output
+from app.services.image_service import postprocess_images
+from app.services.postprocess_service import STAGES, RUN_ONCE_STAGES
+from app.services.checkpoint_service import CheckpointStore
+from app.utils.fs import file_sha256
 
 logger = logging.getLogger("mineru-api")
 
-# 全局任务状态存储
+# 全局任务状态存储 {task_id: TaskRecord}
 tasks = {}
 active_tasks = 0
 
-async def process_pdf(task_id: str, pdf_path: str):
-    global active_tasks
-    try:
-        active_tasks += 1
-        tasks[task_id].status = "processing"
-        logger.info(f"Processing task {task_id}, file: {pdf_path}")
+# 任务状态变更回调，工作进程模式下用于把状态回报给队列
+status_listeners = []
+
+def notify_status(task_id: str):
+    """通知所有状态监听者任务状态已变化"""
+    if not status_listeners:
+        return
+    status = tasks[task_id].to_status()
+    for listener in status_listeners:
+        try:
+            listener(status)
+        except Exception as e:
+            logger.error(f"Status listener failed for task {task_id}: {str(e)}", exc_info=True)
+
+class TaskStopped(Exception):
+    """任务被取消或超时，不再重试"""
+
+    def __init__(self, status: str, error: Optional[str]):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+
+# 请求停止的任务 {task_id: (最终状态, 错误信息)}，线程中转换时在每段页面之间检查
+stop_requests = {}
+
+def check_stopped(task_id: str):
+    """任务已被请求停止时抛出TaskStopped"""
+    request = stop_requests.get(task_id)
+    if request is not None:
+        raise TaskStopped(*request)
+
+def mark_stopped(task_id: str, status: str, error: Optional[str]):
+    """把被取消或超时的任务标记为结束，与失败任务一样保留1小时；status为pending表示任务被中断后重新入队"""
+    task = tasks[task_id]
+    task.status = status
+    task.error = error
+    if status == "pending":
+        task.expires_at = None
+        return
+    task.expires_at = datetime.now() + timedelta(hours=1)
+    expiry_queue.schedule(task_id, task.expires_at)
+
+def classify_pages(ds) -> List[bool]:
+    """逐页判断是否需要OCR：没有可用文本层的页面走OCR，其余页面直接抽取文本"""
+    return [not page_has_text_layer(ds.get_page(index).get_doc()) for index in range(len(ds))]
+
+def plan_page_modes(ds) -> List[bool]:
+    """确定每一页是否走OCR，未开启逐页路由时整个文档使用同一种模式"""
+    from magic_pdf.config.enums import SupportedPdfParseMethod
+    
+    if settings.PAGE_LEVEL_OCR_ROUTING:
+        return classify_pages(ds)
+    return [ds.classify() == SupportedPdfParseMethod.OCR] * len(ds)
+
+def run_doc_analyze(ds, ocr: bool):
+    """模型推理，内容未变的页面使用逐页结果缓存，只推理其余页面"""
+    thread_budget.apply(active_tasks)
+    if page_result_cache.enabled:
+        return page_result_cache.analyze(ds, ocr, analyze_pages)
+    return analyze_pages(ds, ocr)
+
+def analyze_pages(ds, ocr: bool):
+    """对数据集的所有页面执行推理，有其他任务同时转换时，小文档合并到跨任务的推理批次中"""
+    if settings.MICRO_BATCH_WINDOW_MS > 0 and len(ds) <= settings.MICRO_BATCH_MAX_DOC_PAGES and active_tasks > 1:
+        return micro_batcher.analyze(ds, ocr)
+    from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
+    
+    return ds.apply(doc_analyze, ocr=ocr)
+
+def warm_up_models():
+    """加载文本模式和OCR模式的模型，第一个任务不再承担模型加载时间"""
+    from magic_pdf.model.doc_analyze_by_custom_model import ModelSingleton
+    
+    model_manager = ModelSingleton()
+    model_manager.get_model(False, False)
+    model_manager.get_model(True, False)
+
+# 检查点名称中的解析模式，None表示由页面自行判断
+CHECKPOINT_MODES = {True: "ocr", False: "txt", None: "auto"}
+
+def split_page_runs(page_modes: List[bool]) -> List[Tuple[int, int, bool]]:
+    """把逐页的OCR标记合并为连续区间 [(起始页, 结束页, 是否OCR)]"""
+    runs = []
+    for index, ocr in enumerate(page_modes):
+        if runs and runs[-1][2] == ocr:
+            runs[-1] = (runs[-1][0], index, ocr)
+        else:
+            runs.append((index, index, ocr))
+    return runs
+
+def slice_pdf(source_doc, start: int, end: int) -> bytes:
+    """把[start, end]页复制为一份独立的PDF"""
+    with fitz.open() as sub_doc:
+        sub_doc.insert_pdf(source_doc, from_page=start, to_page=end)
+        return sub_doc.tobytes()
+
+def analyze_page_range(source_doc, start: int, end: int, ocr: Optional[bool], image_writer,
+                       doc_hash: str, checkpoints: CheckpointStore):
+    """单独推理并解析[start, end]页，返回这部分页面的(infer_result, pipe_result)
+
+    与magic-pdf命令行处理页码范围的方式一致，先把这些页面切成独立的PDF，
+    范围外的页面不会以宽高为0的空页参与坐标换算。结果中的页码从0开始，
+    ocr为None时由这部分页面自行判断模式。已有检查点时直接使用保存的结果。
+    """
+    from magic_pdf.data.dataset import PymuDocDataset
+    from magic_pdf.config.enums import SupportedPdfParseMethod
+    from magic_pdf.operators.models import InferenceResult
+    from magic_pdf.operators.pipes import PipeResult
+    
+    sub_ds = PymuDocDataset(slice_pdf(source_doc, start, end))
+    checkpoint_name = f"pages_{start}_{end}_{CHECKPOINT_MODES[ocr]}"
+    saved = checkpoints.load(checkpoint_name)
+    if saved is not None:
+        model_json, middle_json = saved
+        return InferenceResult(model_json, sub_ds), PipeResult(middle_json, sub_ds)
+    
+    raster_cache.attach(sub_ds, doc_hash, start)
+    if ocr is None:
+        ocr = sub_ds.classify() == SupportedPdfParseMethod.OCR
+    infer_result = run_doc_analyze(sub_ds, ocr)
+    if ocr:
+        pipe_result = infer_result.pipe_ocr_mode(image_writer)
+    else:
+        pipe_result = infer_result.pipe_txt_mode(image_writer)
+    checkpoints.save(checkpoint_name, infer_result, pipe_result)
+    return infer_result, pipe_result
+
+def page_range_json(infer_result, pipe_result, start: int) -> Tuple[list, dict]:
+    """取出页面区间的模型结果和中间结果，页码换算为在原文档中的页码"""
+    # 复制页面信息再修改，原结果还要用于绘制这部分页面
+    model_json = [
+        {**page, "page_info": {**page["page_info"], "page_no": page["page_info"]["page_no"] + start}}
+        for page in infer_result.get_infer_res()
+    ]
+    middle_json = json.loads(pipe_result.get_middle_json())
+    for page in middle_json["pdf_info"]:
+        page["page_idx"] += start
+    return model_json, middle_json
+
+def record_parse_runs(middle_json: dict, parse_runs: List[Tuple[int, int, Optional[str]]]):
+    """记录合并后的中间JSON中各页面区间的解析模式 [(起始页, 结束页, _parse_type)]
+
+    各区间的模式相同时与整个文档一次解析的输出一致；不同时_parse_type记为hybrid，
+    _parse_runs按页码顺序列出每个区间的页码范围和解析模式，相邻的同模式区间（如分批处理的各批）合并为一项。
+    """
+    if len({parse_type for _, _, parse_type in parse_runs}) <= 1:
+        return
+    merged = []
+    for start, end, parse_type in parse_runs:
+        if merged and merged[-1]["parse_type"] == parse_type:
+            merged[-1]["end_page"] = end
+        else:
+            merged.append({"start_page": start, "end_page": end, "parse_type": parse_type})
+    middle_json["_parse_type"] = "hybrid"
+    middle_json["_parse_runs"] = merged
+
+def analyze_dataset(task_id: str, ds, image_writer, doc_hash: str, checkpoints: CheckpointStore):
+    """推理并解析PDF，返回(infer_result, pipe_result)
+
+    开启PAGE_LEVEL_OCR_ROUTING时按页选择模式：只有缺少文本层的页面做OCR推理，
+    其余页面走文本模式，最后按页码顺序合并为一份结果。
+    """
+    from magic_pdf.operators.models import InferenceResult
+    from magic_pdf.operators.pipes import PipeResult
+    
+    page_modes = plan_page_modes(ds)
+    
+    if len(set(page_modes)) <= 1:
+        ocr = bool(page_modes) and page_modes[0]
+        checkpoint_name = f"document_{CHECKPOINT_MODES[ocr]}"
+        saved = checkpoints.load(checkpoint_name)
+        if saved is not None:
+            logger.info(f"Task {task_id}: Resuming from checkpoint")
+            model_json, middle_json = saved
+            return InferenceResult(model_json, ds), PipeResult(middle_json, ds)
+        
+        if ocr:
+            logger.info(f"Task {task_id}: Using OCR mode")
+            infer_result = run_doc_analyze(ds, True)
+            pipe_result = infer_result.pipe_ocr_mode(image_writer)
+        else:
+            logger.info(f"Task {task_id}: Using text mode")
+            infer_result = run_doc_analyze(ds, False)
+            pipe_result = infer_result.pipe_txt_mode(image_writer)
+        checkpoints.save(checkpoint_name, infer_result, pipe_result)
+        return infer_result, pipe_result
+    
+    runs = split_page_runs(page_modes)
+    logger.info(f"Task {task_id}: Using hybrid mode, {sum(page_modes)}/{len(page_modes)} pages need OCR, {len(runs)} page runs")
+    
+    # 按页码顺序拼接各区间的模型结果和解析结果
+    model_json = []
+    middle_json = None
+    parse_runs = []
+    with fitz.open("pdf", ds.data_bits()) as source_doc:
+        for start, end, ocr in runs:
+            check_stopped(task_id)
+            run_infer, run_pipe = analyze_page_range(source_doc, start, end, ocr, image_writer, doc_hash, checkpoints)
+            run_model, run_middle = page_range_json(run_infer, run_pipe, start)
+            model_json.extend(run_model)
+            parse_runs.append((start, end, run_middle.get("_parse_type")))
+            if middle_json is None:
+                middle_json = run_middle
+            else:
+                middle_json["pdf_info"].extend(run_middle["pdf_info"])
+    record_parse_runs(middle_json, parse_runs)
+    
+    return InferenceResult(model_json, ds), PipeResult(middle_json, ds)
+
+def page_window_size() -> int:
+    """分批处理时每批的页数，取PAGE_BATCH_SIZE和内存预算允许的页数中较小的一个，0表示不分批"""
+    limits = []
+    if settings.PAGE_BATCH_SIZE > 0:
+        limits.append(settings.PAGE_BATCH_SIZE)
+    if settings.JOB_MEMORY_BUDGET_MB > 0:
+        limits.append(max(settings.JOB_MEMORY_BUDGET_MB // settings.PAGE_MEMORY_ESTIMATE_MB, 1))
+    return min(limits) if limits else 0
+
+class JsonArrayWriter:
+    """逐项写出JSON数组，完成后的格式与json.dumps(indent=4)相同"""
+
+    def __init__(self, file, depth: int = 0):
+        self._file = file
+        self._depth = depth
+        self._count = 0
+        file.write("[")
+
+    def write(self, item):
+        text = textwrap.indent(json.dumps(item, ensure_ascii=False, indent=4), "    " * (self._depth + 1))
+        self._file.write((",\n" if self._count else "\n") + text)
+        self._count += 1
+
+    def close(self):
+        self._file.write("\n" + "    " * self._depth + "]" if self._count else "]")
+
+class IncrementalOutput:
+    """分批转换时逐个页面区间追加输出
+
+    Markdown和内容列表写入后立即刷新，/stream可以读取已完成的部分；中间JSON逐页写出，
+    模型、布局和spans的可视化PDF按区间绘制，结束时按页码顺序合并。
+    完成后的文件与一次性输出的内容相同，整个过程不需要在内存中保留全文档的结果。
+    """
+
+    def __init__(self, output_dir: str, name: str, image_dir: str):
+        self.output_dir = output_dir
+        self.name = name
+        self.image_dir = image_dir
+        self._parts_dir = os.path.join(output_dir, ".parts")
+        os.makedirs(self._parts_dir, exist_ok=True)
+        self._parts = []
+        self._has_markdown = False
+        self._middle_meta = None
+        self._parse_runs = []
         
-        # 创建输出目录
-        task_output_dir = os.path.join(settings.OUTPUT_DIR, task_id)
-        local_image_dir = os.path.join(task_output_dir, "images")
-        os.makedirs(local_image_dir, exist_ok=True)
+        self._md_file = open(os.path.join(output_dir, f"{name}.md"), "w", encoding="utf-8")
+        self._content_list_file = open(os.path.join(output_dir, f"{name}_content_list.json"), "w", encoding="utf-8")
+        self._middle_file = open(os.path.join(output_dir, f"{name}_middle.json"), "w", encoding="utf-8")
+        self._content_list = JsonArrayWriter(self._content_list_file)
+        self._middle_file.write('{\n    "pdf_info": ')
+        self._pdf_info = JsonArrayWriter(self._middle_file, depth=1)
+
+    def append_run(self, start: int, infer_result, pipe_result):
+        """追加从start页开始的一个页面区间的输出"""
+        markdown = pipe_result.get_markdown(self.image_dir)
+        if markdown:
+            # 与get_markdown一致，页面之间以空行分隔
+            self._md_file.write("\n\n" + markdown if self._has_markdown else markdown)
+            self._has_markdown = True
+        for entry in pipe_result.get_content_list(self.image_dir):
+            entry["page_idx"] += start
+            self._content_list.write(entry)
+        self._md_file.flush()
+        self._content_list_file.flush()
         
-        # 准备环境
-        image_dir = "images"
-        image_writer = drw.FileBasedDataWriter(local_image_dir)
-        md_writer = drw.FileBasedDataWriter(task_output_dir)
+        _, middle_json = page_range_json(infer_result, pipe_result, start)
+        pages = middle_json.pop("pdf_info")
+        for page in pages:
+            self._pdf_info.write(page)
+        self._parse_runs.append((start, start + len(pages) - 1, middle_json.get("_parse_type")))
+        if self._middle_meta is None:
+            self._middle_meta = middle_json
         
+        prefix = os.path.join(self._parts_dir, f"{start:06d}")
+        infer_result.draw_model(f"{prefix}_model.pdf")
+        pipe_result.draw_layout(f"{prefix}_layout.pdf")
+        pipe_result.draw_span(f"{prefix}_spans.pdf")
+        self._parts.append(prefix)
+
+    def _close_files(self):
+        self._content_list.close()
+        self._pdf_info.close()
+        if self._middle_meta:
+            record_parse_runs(self._middle_meta, self._parse_runs)
+            # 去掉外层花括号，接在pdf_info之后
+            self._middle_file.write(",\n" + json.dumps(self._middle_meta, ensure_ascii=False, indent=4)[2:-2])
+        self._middle_file.write("\n}")
+        for file in (self._md_file, self._content_list_file, self._middle_file):
+            file.close()
+
+    def close(self):
+        """结束输出，合并各区间的可视化PDF"""
+        try:
+            self._close_files()
+            for kind in ("model", "layout", "spans"):
+                with fitz.open() as merged:
+                    for prefix in self._parts:
+                        with fitz.open(f"{prefix}_{kind}.pdf") as part:
+                            merged.insert_pdf(part)
+                    merged.save(os.path.join(self.output_dir, f"{self.name}_{kind}.pdf"), garbage=1, deflate=True)
+        finally:
+            shutil.rmtree(self._parts_dir, ignore_errors=True)
+
+    def abort(self):
+        """转换失败时关闭文件并删除临时分段"""
+        if not self._md_file.closed:
+            self._close_files()
+        shutil.rmtree(self._parts_dir, ignore_errors=True)
+
+def convert_in_windows(task_id: str, source_doc, doc_hash: str, checkpoints: CheckpointStore, window_size: int,
+                       image_writer, output: IncrementalOutput):
+    """每window_size页推理解析一次，每批完成后追加输出、更新进度并释放这一批的中间结果
+
+    页面直接从按需读取的PDF文件中切出，同一时间只有一批页面的图像和模型结果在内存中。
+    """
+    page_count = source_doc.page_count
+    logger.info(f"Task {task_id}: Processing {page_count} pages in batches of {window_size}")
+    
+    for window_start in range(0, page_count, window_size):
+        window_end = min(window_start + window_size, page_count)
+        if settings.PAGE_LEVEL_OCR_ROUTING:
+            page_modes = [not page_has_text_layer(source_doc[index]) for index in range(window_start, window_end)]
+        else:
+            page_modes = [None] * (window_end - window_start)
+        
+        for start, end, ocr in split_page_runs(page_modes):
+            check_stopped(task_id)
+            infer_result, pipe_result = analyze_page_range(
+                source_doc, window_start + start, window_start + end, ocr, image_writer, doc_hash, checkpoints
+            )
+            output.append_run(window_start + start, infer_result, pipe_result)
+            del infer_result, pipe_result
+        
+        tasks[task_id].pages_completed = window_end
+        notify_status(task_id)
+        
+        # 释放这一批的页面图像和推理结果，以及MuPDF缓存的页面对象
+        gc.collect()
+        fitz.TOOLS.store_shrink(100)
+    
+    output.close()
+
+def run_postprocess(task_id: str, output_dir: str, md_name: str):
+    """按顺序执行任务声明的后处理步骤，每个步骤的状态随任务状态更新；步骤失败不影响后续步骤和转换结果
+
+    重新执行时已完成的RUN_ONCE_STAGES步骤跳过，其余步骤对重新输出的Markdown再执行一次。
+    超过POSTPROCESS_TIMEOUT_SECONDS后尚未开始的步骤标记为失败。
+    """
+    task = tasks[task_id]
+    md_path = os.path.join(output_dir, md_name)
+    for stage in task.postprocess:
+        if not (stage.status == "completed" and stage.name in RUN_ONCE_STAGES):
+            stage.status, stage.detail, stage.error = "pending", None, None
+    deadline = time.monotonic() + settings.POSTPROCESS_TIMEOUT_SECONDS
+    for stage in task.postprocess:
+        if stage.status == "completed":
+            logger.info(f"Task {task_id}: postprocess stage {stage.name} already completed, skipping")
+            continue
+        check_stopped(task_id)
+        if settings.POSTPROCESS_TIMEOUT_SECONDS > 0 and time.monotonic() >= deadline:
+            stage.status = "failed"
+            stage.error = f"Postprocess timed out after {settings.POSTPROCESS_TIMEOUT_SECONDS:g} seconds"
+            notify_status(task_id)
+            logger.warning(f"Task {task_id}: postprocess stage {stage.name} skipped, {stage.error}")
+            continue
+        stage.status = "running"
+        notify_status(task_id)
+        try:
+            stage.detail = STAGES[stage.name][0](stage, output_dir, md_path)
+            stage.status = "completed"
+        except Exception as e:
+            logger.warning(f"Task {task_id}: postprocess stage {stage.name} failed: {str(e)}", exc_info=True)
+            stage.status = "failed"
+            stage.error = str(e)
+        notify_status(task_id)
+        logger.info(f"Task {task_id}: postprocess stage {stage.name} {stage.status}")
+
+def postprocess_pending(task_id: str) -> bool:
+    """任务已转换完成（输出文件列表已确定），正在等待执行后处理步骤"""
+    task = tasks.get(task_id)
+    return task is not None and task.status == "processing" and task.files is not None
+
+def postprocess_task(task_id: str):
+    """执行已转换完成的任务声明的后处理步骤，然后发布输出并把任务标记为完成
+
+    在转换槽位和子进程之外执行，耗时不计入转换时限；转换输出留在工作目录中，
+    步骤改写Markdown后才发布，/stream在任务完成后才输出。
+    """
+    task = tasks[task_id]
+    storage = get_storage()
+    try:
+        md_name = next(file_name for file_name in task.files if file_name.endswith(".md"))
+        run_postprocess(task_id, storage.work_dir(task_id), md_name)
+        check_stopped(task_id)
+        publish_outputs(task_id)
+        CheckpointStore(task_id).clear()
+        complete_task(task_id)
+    except TaskStopped as e:
+        logger.info(f"Task {task_id} stopped: {e.error or e.status}")
+        mark_stopped(task_id, e.status, e.error)
+    except Exception as e:
+        logger.error(f"Error post-processing task {task_id}: {str(e)}", exc_info=True)
+        # 与转换失败一样保留1小时，检查点保留到任务删除，可通过/retry继续；已完成的RUN_ONCE_STAGES步骤不再执行
+        mark_stopped(task_id, "failed", str(e))
+    finally:
+        stop_requests.pop(task_id, None)
+        notify_status(task_id)
+
+def publish_outputs(task_id: str):
+    """把工作目录中的输出压缩（按配置）并发布到存储后端"""
+    storage = get_storage()
+    task_output_dir = storage.work_dir(task_id)
+    # 文本输出压缩保存（/stream读取的是发布前的原文件，压缩后从存储解压读取）
+    if settings.COMPRESS_OUTPUTS:
+        compress_outputs(task_output_dir, os.listdir(task_output_dir))
+    storage.publish(task_id)
+
+def complete_task(task_id: str):
+    """把输出已发布的任务标记为完成并设置过期时间"""
+    task = tasks[task_id]
+    task.status = "completed"
+    task.error = None
+    task.expires_at = datetime.now() + timedelta(hours=settings.TASK_EXPIRY_HOURS)
+    expiry_queue.schedule(task_id, task.expires_at)
+    if settings.SEARCH_INDEX_ENABLED:
+        index_outputs(task_id)
+    logger.info(f"Task {task_id} completed successfully")
+
+def index_outputs(task_id: str):
+    """把已发布的content_list写入全文索引，索引失败不影响转换结果
+
+    只索引已完成的任务，失败、超时或取消的任务不会留下指向不存在输出的索引行。
+    """
+    try:
+        name = next(file_name for file_name in tasks[task_id].files if file_name.endswith("_content_list.json"))
+        with closing(open_output(get_storage(), task_id, name)) as f:
+            content_list = json.load(f)
+        search_index.index_task(task_id, content_list)
+    except Exception as e:
+        logger.warning(f"Failed to index task {task_id}: {str(e)}", exc_info=True)
+
+async def process_pdf(task_id: str, pdf_path: str):
+    """在API进程内处理PDF（本地执行模式）"""
+    convert_task(task_id, pdf_path)
+
+def _convert_pdf(task_id: str, pdf_path: str, checkpoints: CheckpointStore) -> Tuple[List[str], int]:
+    """执行一次转换，返回(输出文件列表, 页数)"""
+    # 输出先写入存储后端的本地工作目录
+    storage = get_storage()
+    task_output_dir = storage.work_dir(task_id)
+    
+    # 准备环境
+    image_dir = "images"
+    image_writer = storage.get_writer(task_id, image_dir)
+    md_writer = storage.get_writer(task_id)
+    
+    # 处理PDF
+    name_without_suff = os.path.basename(pdf_path).split(".")[0]
+    
+    # 内容哈希用于页面栅格缓存，相同内容的文档复用渲染结果
+    doc_hash = file_sha256(pdf_path)
+    
+    # MuPDF按需读取文件，分批处理时不需要把整个PDF读入内存
+    output = None
+    with fitz.open(pdf_path) as source_doc:
+        page_count = source_doc.page_count
+        window_size = page_window_size()
+        if 0 < window_size < page_count:
+            # 分批处理，每批完成后追加输出，/stream可以读取已完成的部分
+            output = IncrementalOutput(task_output_dir, name_without_suff, image_dir)
+            try:
+                convert_in_windows(task_id, source_doc, doc_hash, checkpoints, window_size, image_writer, output)
+            except Exception:
+                output.abort()
+                raise
+    
+    if output is None:
         # 读取PDF内容
         with open(pdf_path, "rb") as f:
             pdf_bytes = f.read()
         
-        # 处理PDF
-        name_without_suff = os.path.basename(pdf_path).split(".")[0]
-        
         # 创建数据集实例
+        from magic_pdf.data.dataset import PymuDocDataset
+        
         ds = PymuDocDataset(pdf_bytes)
+        raster_cache.attach(ds, doc_hash)
         
         # 推理
-        if ds.classify() == SupportedPdfParseMethod.OCR:
-            logger.info(f"Task {task_id}: Using OCR mode")
-            infer_result = ds.apply(doc_analyze, ocr=True)
-            pipe_result = infer_result.pipe_ocr_mode(image_writer)
-        else:
-            logger.info(f"Task {task_id}: Using text mode")
-            infer_result = ds.apply(doc_analyze, ocr=False)
-            pipe_result = infer_result.pipe_txt_mode(image_writer)
+        infer_result, pipe_result = analyze_dataset(task_id, ds, image_writer, doc_hash, checkpoints)
+        check_stopped(task_id)
         
         # 绘制模型结果
         model_path = os.path.join(task_output_dir, f"{name_without_suff}_model.pdf")
         infer_result.draw_model(model_path)
         
-        # 获取模型推理结果
-        model_inference_result = infer_result.get_infer_res()
-        
         # 绘制布局结果
         layout_path = os.path.join(task_output_dir, f"{name_without_suff}_layout.pdf")
         pipe_result.draw_layout(layout_path)
@@ -67,37 +545,97 @@ async def process_pdf(task_id: str, pdf_path: str):
         spans_path = os.path.join(task_output_dir, f"{name_without_suff}_spans.pdf")
         pipe_result.draw_span(spans_path)
         
-        # 获取并保存Markdown内容
-        md_content = pipe_result.get_markdown(image_dir)
+        # 保存Markdown内容
         md_path = f"{name_without_suff}.md"
         pipe_result.dump_md(md_writer, md_path, image_dir)
         
-        # 获取并保存内容列表
+        # 保存内容列表
         content_list_path = f"{name_without_suff}_content_list.json"
         pipe_result.dump_content_list(md_writer, content_list_path, image_dir)
         
-        # 获取并保存中间JSON
+        # 保存中间JSON
         middle_json_path = f"{name_without_suff}_middle.json"
         pipe_result.dump_middle_json(md_writer, middle_json_path)
+    
+    # 图片去重、转码和缩略图，同时更新输出和检查点中的图片引用
+    if settings.IMAGE_POSTPROCESS:
+        check_stopped(task_id)
+        postprocess_images(task_output_dir, image_dir, checkpoints.middle_files())
+    
+    # 内容块索引，/tasks/{task_id}/blocks按页码和类型读取内容块
+    with open(os.path.join(task_output_dir, f"{name_without_suff}_content_list.json"), "r", encoding="utf-8") as f:
+        content_list = json.load(f)
+    write_block_index(task_output_dir, name_without_suff, content_list)
+    del content_list
+    
+    # 发布输出到存储后端；声明了后处理步骤时由postprocess_task在步骤执行完后发布
+    if not tasks[task_id].postprocess:
+        publish_outputs(task_id)
+    
+    files = [
+        f"{name_without_suff}_model.pdf",
+        f"{name_without_suff}_layout.pdf",
+        f"{name_without_suff}_spans.pdf",
+        f"{name_without_suff}.md",
+        f"{name_without_suff}_content_list.json",
+        f"{name_without_suff}_middle.json"
+    ]
+    return files, page_count
+
+def convert_task(task_id: str, pdf_path: str):
+    """执行PDF转换并更新任务状态
+
+    失败时按指数退避自动重试最多MAX_TASK_RETRIES次，每次从最近的检查点继续，
+    已完成推理的页面不会重新执行doc_analyze。
+    """
+    global active_tasks
+    try:
+        active_tasks += 1
+        tasks[task_id].status = "processing"
+        notify_status(task_id)
+        logger.info(f"Processing task {task_id}, file: {pdf_path}")
+        
+        checkpoints = CheckpointStore(task_id)
+        while True:
+            try:
+                check_stopped(task_id)
+                files, page_count = _convert_pdf(task_id, pdf_path, checkpoints)
+                break
+            except TaskStopped:
+                raise
+            except Exception as e:
+                if tasks[task_id].retries >= settings.MAX_TASK_RETRIES:
+                    raise
+                tasks[task_id].retries += 1
+                tasks[task_id].error = str(e)
+                notify_status(task_id)
+                delay = settings.RETRY_BACKOFF_SECONDS * 2 ** (tasks[task_id].retries - 1)
+                logger.warning(f"Task {task_id} failed: {str(e)}, retrying in {delay}s "
+                               f"({tasks[task_id].retries}/{settings.MAX_TASK_RETRIES})", exc_info=True)
+                time.sleep(delay)
         
         # 更新任务状态
-        tasks[task_id].status = "completed"
-        tasks[task_id].files = [
-            f"{name_without_suff}_model.pdf",
-            f"{name_without_suff}_layout.pdf",
-            f"{name_without_suff}_spans.pdf",
-            f"{name_without_suff}.md",
-            f"{name_without_suff}_content_list.json",
-            f"{name_without_suff}_middle.json"
-        ]
-        # 设置过期时间
-        tasks[task_id].expires_at = datetime.now() + timedelta(hours=settings.TASK_EXPIRY_HOURS)
-        logger.info(f"Task {task_id} completed successfully")
+        tasks[task_id].pages_completed = page_count
+        tasks[task_id].files = files
+        if tasks[task_id].postprocess:
+            # 后处理步骤由调用方在转换槽位之外执行（postprocess_task），任务保持processing
+            tasks[task_id].error = None
+            logger.info(f"Task {task_id} converted, waiting for postprocess")
+            return
+        
+        checkpoints.clear()
+        complete_task(task_id)
         
+    except TaskStopped as e:
+        logger.info(f"Task {task_id} stopped: {e.error or e.status}")
+        mark_stopped(task_id, e.status, e.error)
     except Exception as e:
         logger.error(f"Error processing task {task_id}: {str(e)}", exc_info=True)
         tasks[task_id].status = "failed"
         tasks[task_id].error = str(e)
-        tasks[task_id].expires_at = datetime.now() + timedelta(hours=1)  # 失败任务保留1小时
+        tasks[task_id].expires_at = datetime.now() + timedelta(hours=1)  # 失败任务保留1小时，检查点保留到任务删除，可通过/retry继续
+        expiry_queue.schedule(task_id, tasks[task_id].expires_at)
     finally:
-        active_tasks -= 1 
\ No newline at end of file
+        active_tasks -= 1
+        stop_requests.pop(task_id, None)
+        notify_status(task_id)
@@ -0,0 +1,203 @@
+import os
+import re
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import httpx
+from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
+
+from app.core.config import settings
+from app.models.task import PostprocessStage
+
+logger = logging.getLogger("mineru-api")
+
+# Markdown中引用的本地图片
+LOCAL_IMAGE_LINK = re.compile(r"!\[(.*?)\]\((images/[^)\s]+)\)")
+
+# 大模型清洗的提示词，待处理的文本接在后面
+FORMAT_PROMPT = """
+请根据以下要求和参考示例，优化所提供文本的格式。
+
+**核心要求：**
+1.  **保留原文内容**：除了明确指示需要移除的内容外，不要用你自身的知识修改，不得修改文本的原始语句。
+2.  **优化排版与可读性**：重点在于调整各级标题、段落结构和列表格式，使其清晰、规范、易读。
+
+**必须移除的内容 (不应出现在最终输出中)：**
+1.  **页码标识**：例如 "第 n 页"、"第n页 共n页" 或任何类似的页码信息。
+2.  **文档元数据/辅助信息**：例如 "变更记录"、"修订历史"、"制定日期"、"生效日期"、"版本号"等部分。如果这些信息作为独立的章节或段落出现，请直接删除。
+
+**格式优化细节 (请严格参考提供的示例)：**
+1.  **层级标题**：确保各级标题（如 `### 1.` 和 `#### 1.1.`）结构清晰，层级分明。
+2.  **段落划分**：合理划分段落，确保每个段落讨论一个核心点。
+3.  **列表项**：
+    * 主要列表项使用 `- **加粗文本**` 的格式。
+    * 次级列表项（如对主要列表项的解释或示例）使用 `o 普通文本` 并进行适当缩进。
+
+
+请开始处理以下文本：
+"""
+
+def _write_text(path: str, text: str):
+    """写入临时文件后替换，失败时原文件保持不变"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def run_image_host(stage: PostprocessStage, output_dir: str, md_path: str) -> dict:
+    """把Markdown引用的图片上传到图床，并把链接替换为图床URL"""
+    with open(md_path, "r", encoding="utf-8") as f:
+        markdown = f.read()
+    links = sorted({match.group(2) for match in LOCAL_IMAGE_LINK.finditer(markdown)})
+    if not links:
+        return {"images": 0, "uploaded": 0, "failed": 0}
+
+    def upload(client: httpx.Client, link: str) -> Optional[str]:
+        path = os.path.join(output_dir, link)
+        ext = os.path.splitext(link)[1][1:].lower() or "jpg"
+        try:
+            with open(path, "rb") as f:
+                response = client.post(
+                    settings.POSTPROCESS_IMAGE_HOST_URL,
+                    files={"file": (os.path.basename(link), f, f"image/{ext}")},
+                    data={"description": ""}
+                )
+            response.raise_for_status()
+            return response.json()["url"].replace("\\", "/")
+        except Exception as e:
+            logger.warning(f"Failed to upload image {link}: {str(e)}")
+            return None
+
+    with httpx.Client(timeout=settings.POSTPROCESS_HTTP_TIMEOUT_SECONDS) as client, \
+            ThreadPoolExecutor(max_workers=settings.POSTPROCESS_IMAGE_UPLOAD_CONCURRENCY) as pool:
+        urls = dict(zip(links, pool.map(lambda link: upload(client, link), links)))
+    uploaded = {link: url for link, url in urls.items() if url}
+    if not uploaded:
+        raise RuntimeError(f"Failed to upload all {len(links)} images")
+
+    markdown = LOCAL_IMAGE_LINK.sub(
+        lambda match: f"![{match.group(1)}]({uploaded[match.group(2)]})" if match.group(2) in uploaded else match.group(0),
+        markdown
+    )
+    _write_text(md_path, markdown)
+    return {"images": len(links), "uploaded": len(uploaded), "failed": len(links) - len(uploaded)}
+
+def split_text(text: str, max_chunk_size: int) -> List[str]:
+    """按段落把长文本切成不超过max_chunk_size个字符的块，优先在</p>、空行、句号处切分"""
+    chunks = []
+    while len(text) > max_chunk_size:
+        window = text[:max_chunk_size]
+        for separator in ("</p>", "\n\n", "。"):
+            split_pos = window.rfind(separator)
+            if split_pos > 0:
+                split_pos += len(separator)
+                break
+        else:
+            split_pos = max_chunk_size
+        chunks.append(text[:split_pos])
+        text = text[split_pos:]
+    if text:
+        chunks.append(text)
+    return chunks
+
+def run_llm_cleanup(stage: PostprocessStage, output_dir: str, md_path: str) -> dict:
+    """用大模型整理Markdown的格式，长文档分块处理，处理失败的块保留原文"""
+    model = stage.options.get("model") or settings.POSTPROCESS_LLM_MODEL
+    max_chunk_size = stage.options.get("max_chunk_size") or settings.POSTPROCESS_LLM_MAX_CHUNK_SIZE
+    with open(md_path, "r", encoding="utf-8") as f:
+        markdown = f.read()
+    if not markdown.strip():
+        return {"model": model, "chunks": 0, "failed": 0}
+
+    headers = {"Authorization": f"Bearer {settings.POSTPROCESS_LLM_API_KEY}"} if settings.POSTPROCESS_LLM_API_KEY else {}
+    chunks = split_text(markdown, max_chunk_size)
+    processed = []
+    failed = 0
+    with httpx.Client(timeout=settings.POSTPROCESS_HTTP_TIMEOUT_SECONDS, headers=headers) as client:
+        for index, chunk in enumerate(chunks):
+            try:
+                response = client.post(
+                    f"{settings.POSTPROCESS_LLM_BASE_URL.rstrip('/')}/chat/completions",
+                    json={
+                        "model": model,
+                        "messages": [{"role": "user", "content": f"{FORMAT_PROMPT}\n{chunk}"}],
+                        "temperature": settings.POSTPROCESS_LLM_TEMPERATURE,
+                        "max_tokens": settings.POSTPROCESS_LLM_MAX_TOKENS
+                    }
+                )
+                response.raise_for_status()
+                content = response.json()["choices"][0]["message"]["content"]
+                if not content:
+                    raise ValueError("Empty response")
+                processed.append(content)
+            except Exception as e:
+                logger.warning(f"LLM cleanup failed for chunk {index + 1}/{len(chunks)}: {str(e)}")
+                processed.append(chunk)
+                failed += 1
+    if failed == len(chunks):
+        raise RuntimeError(f"LLM cleanup failed for all {len(chunks)} chunks")
+
+    _write_text(md_path, "\n\n".join(processed))
+    return {"model": model, "chunks": len(chunks), "failed": failed}
+
+def run_kb_push(stage: PostprocessStage, output_dir: str, md_path: str) -> dict:
+    """把Markdown上传到知识库数据集并触发解析"""
+    kb_id = stage.options.get("kb_id") or settings.POSTPROCESS_KB_DEFAULT_ID
+    base_url = settings.POSTPROCESS_KB_BASE_URL.rstrip("/")
+    headers = {"Authorization": f"Bearer {settings.POSTPROCESS_KB_API_KEY}"} if settings.POSTPROCESS_KB_API_KEY else {}
+    with httpx.Client(timeout=settings.POSTPROCESS_HTTP_TIMEOUT_SECONDS, headers=headers) as client:
+        with open(md_path, "rb") as f:
+            response = client.post(
+                f"{base_url}/datasets/{kb_id}/documents",
+                files=[("file", (os.path.basename(md_path), f))]
+            )
+        response.raise_for_status()
+        document_ids = [doc["id"] for doc in response.json().get("data") or []]
+        if not document_ids:
+            raise RuntimeError(f"Knowledge base returned no document IDs: {response.text[:200]}")
+
+        response = client.post(f"{base_url}/datasets/{kb_id}/chunks", json={"document_ids": document_ids})
+        response.raise_for_status()
+    return {"kb_id": kb_id, "document_ids": document_ids}
+
+# 步骤名称: (执行函数, 需要配置的接口地址, 允许的参数及类型)
+STAGES: Dict[str, tuple] = {
+    "image_host": (run_image_host, "POSTPROCESS_IMAGE_HOST_URL", {}),
+    "llm_cleanup": (run_llm_cleanup, "POSTPROCESS_LLM_BASE_URL", {"model": str, "max_chunk_size": int}),
+    "kb_push": (run_kb_push, "POSTPROCESS_KB_BASE_URL", {"kb_id": str}),
+}
+
+# 重新执行后处理时，已完成的步骤不再执行（结果在外部系统中，重复执行会产生重复数据）
+RUN_ONCE_STAGES = {"kb_push"}
+
+def available_stages() -> List[str]:
+    """已配置接口地址、提交任务时可以声明的后处理步骤"""
+    return [name for name, (_, url_setting, _) in STAGES.items() if getattr(settings, url_setting)]
+
+def parse_postprocess(raw: Optional[str]) -> Optional[List[PostprocessStage]]:
+    """解析并检查提交任务时声明的后处理步骤（JSON数组），返回执行状态为pending的步骤列表"""
+    if not raw:
+        return None
+    try:
+        stages = TypeAdapter(List[PostprocessStage]).validate_json(raw)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid postprocess: {str(e)}")
+
+    for stage in stages:
+        if stage.name not in STAGES:
+            raise HTTPException(status_code=400, detail=f"Unknown postprocess stage: {stage.name}")
+        _, url_setting, allowed = STAGES[stage.name]
+        if not getattr(settings, url_setting):
+            raise HTTPException(status_code=400, detail=f"Postprocess stage {stage.name} is not configured ({url_setting})")
+        for key, value in stage.options.items():
+            if key not in allowed or not isinstance(value, allowed[key]) or isinstance(value, bool):
+                raise HTTPException(status_code=400, detail=f"Invalid option for {stage.name}: {key}={json.dumps(value)}")
+        if stage.options.get("max_chunk_size", 1) <= 0:
+            raise HTTPException(status_code=400, detail=f"Invalid option for {stage.name}: max_chunk_size must be positive")
+        if stage.name == "kb_push" and not (stage.options.get("kb_id") or settings.POSTPROCESS_KB_DEFAULT_ID):
+            raise HTTPException(status_code=400, detail="Postprocess stage kb_push requires kb_id")
+    if len({stage.name for stage in stages}) != len(stages):
+        raise HTTPException(status_code=400, detail="Duplicate postprocess stage")
+    return [PostprocessStage(name=stage.name, options=stage.options) for stage in stages]
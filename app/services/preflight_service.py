@@ -0,0 +1,112 @@
+import os
+import re
+import mmap
+import logging
+from typing import List, Optional
+import fitz
+
+from app.core.config import settings
+from app.models.task import PreflightInfo
+
+logger = logging.getLogger("mineru-api")
+
+# 页面至少包含这么多非空白字符才认为有可用的文本层
+MIN_TEXT_CHARS_PER_PAGE = 50
+# 图片覆盖页面面积超过该比例时认为是以图片为主的页面
+IMAGE_PAGE_AREA_RATIO = 0.5
+
+PAGE_OBJECT_PATTERN = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+IMAGE_OBJECT_PATTERN = re.compile(rb"/Subtype\s*/Image")
+
+def page_has_text_layer(page) -> bool:
+    """判断PyMuPDF页面是否有可直接抽取的文本层"""
+    text = "".join(page.get_text("text").split())
+    if len(text) < MIN_TEXT_CHARS_PER_PAGE:
+        return False
+    # 大量替换字符说明字体缺少编码映射，抽取出的是乱码
+    return text.count("�") / len(text) < 0.1
+
+def page_image_ratio(page) -> float:
+    """页面中图片覆盖的面积比例"""
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height
+    if page_area <= 0:
+        return 0.0
+    image_area = 0.0
+    for info in page.get_image_info():
+        bbox = page_rect & info["bbox"]
+        if not bbox.is_empty:
+            image_area += bbox.width * bbox.height
+    return min(image_area / page_area, 1.0)
+
+def sample_page_indexes(page_count: int, sample_size: int) -> List[int]:
+    """在文档中均匀抽取页面"""
+    if page_count <= sample_size:
+        return list(range(page_count))
+    step = page_count / sample_size
+    return sorted({int(i * step) for i in range(sample_size)})
+
+def estimate_seconds(page_count: int, text_coverage: Optional[float]) -> float:
+    """按文本页和扫描页的比例估算转换耗时"""
+    coverage = 0.0 if text_coverage is None else text_coverage
+    per_page = coverage * settings.PREFLIGHT_TEXT_PAGE_SECONDS + (1 - coverage) * settings.PREFLIGHT_OCR_PAGE_SECONDS
+    return page_count * per_page
+
+def _probe_with_fitz(pdf_path: str) -> PreflightInfo:
+    # MuPDF按需读取文件，不会把整个文档载入内存
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+        indexes = sample_page_indexes(page_count, settings.PREFLIGHT_SAMPLE_PAGES)
+        text_pages = 0
+        image_pages = 0
+        for index in indexes:
+            page = doc[index]
+            if page_has_text_layer(page):
+                text_pages += 1
+            if page_image_ratio(page) >= IMAGE_PAGE_AREA_RATIO:
+                image_pages += 1
+
+    sampled = max(len(indexes), 1)
+    text_coverage = text_pages / sampled
+    return PreflightInfo(
+        page_count=page_count,
+        text_coverage=text_coverage,
+        image_ratio=image_pages / sampled,
+        needs_ocr=text_coverage < 0.5,
+        estimated_seconds=estimate_seconds(page_count, text_coverage)
+    )
+
+def _probe_with_mmap(mm: mmap.mmap, file_size: int) -> PreflightInfo:
+    """PyMuPDF无法打开文件（如文件损坏）时直接扫描内存映射的文件内容估算页数"""
+    page_count = len(PAGE_OBJECT_PATTERN.findall(mm))
+    if page_count == 0:
+        # 页面对象位于压缩的对象流中，无法直接计数，按平均每页100KB估算
+        page_count = max(file_size // (100 * 1024), 1)
+    image_count = len(IMAGE_OBJECT_PATTERN.findall(mm))
+    return PreflightInfo(
+        page_count=page_count,
+        image_ratio=min(image_count / page_count, 1.0),
+        estimated_seconds=estimate_seconds(page_count, None)
+    )
+
+def probe_pdf(pdf_path: str) -> PreflightInfo:
+    """上传时的快速预检：页数、文本层覆盖率、图片比例和估算耗时
+
+    Raises:
+        ValueError: 文件不是PDF
+    """
+    file_size = os.path.getsize(pdf_path)
+    if file_size == 0:
+        raise ValueError("Empty file")
+
+    with open(pdf_path, "rb") as f:
+        if f.read(1024).find(b"%PDF-") < 0:
+            raise ValueError("Not a PDF file")
+
+    try:
+        return _probe_with_fitz(pdf_path)
+    except Exception as e:
+        # 文件损坏等情况交给MinerU处理，这里只按文件大小粗略估算
+        logger.warning(f"Preflight probe failed for {pdf_path}: {str(e)}")
+        with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _probe_with_mmap(mm, file_size)
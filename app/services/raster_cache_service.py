@@ -0,0 +1,95 @@
+import os
+import uuid
+import logging
+import threading
+from typing import Optional
+import numpy as np
+
+from app.core.config import settings
+from app.utils.fs import EVICTION_CHECK_FRACTION, evict_lru_files
+
+logger = logging.getLogger("mineru-api")
+
+# MinerU渲染页面图像的默认DPI
+DEFAULT_RASTER_DPI = 200
+
+class PageRasterCache:
+    """页面栅格图的磁盘缓存
+
+    键为文档内容哈希+页码+DPI，图像以.npy文件保存，读取时内存映射，不占用进程内存。
+    同一内容的文档在重试、换参数重跑和不同任务之间复用，总大小按LRU限制在max_bytes以内，多个进程可以共用同一目录。
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._unchecked_bytes = 0  # 上次按磁盘统计总大小之后本进程写入的字节数
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+            evict_lru_files(root, ".npy", max_bytes)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _file_name(doc_hash: str, page_index: int, dpi: int) -> str:
+        return f"{doc_hash}_{page_index}_{dpi}.npy"
+
+    def get(self, doc_hash: str, page_index: int, dpi: int) -> Optional[np.ndarray]:
+        # 直接读取文件，其他进程渲染的页面也能命中
+        path = os.path.join(self.root, self._file_name(doc_hash, page_index, dpi))
+        try:
+            # 写时复制映射：推理过程中修改图像不会改动缓存文件
+            img = np.load(path, mmap_mode="c")
+            os.utime(path)
+            return img
+        except (OSError, ValueError):
+            # 未缓存、已被淘汰或文件损坏
+            return None
+
+    def put(self, doc_hash: str, page_index: int, dpi: int, img: np.ndarray):
+        name = self._file_name(doc_hash, page_index, dpi)
+        path = os.path.join(self.root, name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(img), allow_pickle=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to cache page raster {name}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        size = os.path.getsize(path)
+
+        # 按磁盘上的实际大小淘汰，其他进程写入的文件也计入总大小
+        with self._lock:
+            self._unchecked_bytes += size
+            if self._unchecked_bytes < self.max_bytes // EVICTION_CHECK_FRACTION:
+                return
+            self._unchecked_bytes = 0
+        evict_lru_files(self.root, ".npy", self.max_bytes)
+
+    def attach(self, ds, doc_hash: str, page_offset: int = 0):
+        """让数据集的页面渲染经过缓存，page_offset为数据集第一页在原文档中的页码"""
+        if not self.enabled:
+            return
+        for index in range(len(ds)):
+            record = ds.get_page(index)
+            record.get_image = self._cached_get_image(record.get_image, doc_hash, page_offset + index)
+
+    def _cached_get_image(self, get_image, doc_hash: str, page_index: int):
+        def cached_get_image(*args, **kwargs):
+            dpi = kwargs.get("dpi", args[0] if args else DEFAULT_RASTER_DPI)
+            img = self.get(doc_hash, page_index, dpi)
+            if img is None:
+                result = get_image(*args, **kwargs)
+                self.put(doc_hash, page_index, dpi, result["img"])
+                return result
+            return {"img": img, "width": img.shape[1], "height": img.shape[0]}
+        return cached_get_image
+
+# 全局页面栅格缓存
+raster_cache = PageRasterCache(settings.RASTER_CACHE_DIR, settings.RASTER_CACHE_MAX_BYTES)
@@ -0,0 +1,383 @@
+import asyncio
+import logging
+import threading
+import multiprocessing
+from typing import Optional
+
+from app.core.config import settings
+from app.models.task import TaskStatus, TaskRecord
+from app.services.expiry_service import expiry_queue
+from app.services.pdf_service import (
+    tasks, notify_status, convert_task, postprocess_task, stop_requests, mark_stopped, warm_up_models
+)
+from app.services.thread_budget_service import thread_budget, thread_share, set_thread_limit
+
+logger = logging.getLogger("mineru-api")
+
+# 共用子进程的任务被取消或超时后，等待它在当前这段页面处理完后结束的时间，超时则结束整个子进程
+SHARED_STOP_GRACE_SECONDS = 30
+
+def _process_main(conn, threads):
+    """转换子进程入口：接收父进程的命令，转换中的状态变化通过管道回报给父进程
+
+    每个转换在单独的线程中执行，同一子进程中同时转换的小文档可以合并推理。
+    """
+    from app.utils.logger import setup_logger
+    from app.services import pdf_service
+
+    setup_logger()
+    if settings.THREAD_BUDGET:
+        # 模型加载前设置，按线程数环境变量初始化的推理库也使用这个份额
+        set_thread_limit(threads.value)
+        thread_budget.shared = threads
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def convert(task_id, pdf_path):
+        pdf_service.convert_task(task_id, pdf_path)
+        send(("done", pdf_service.tasks.pop(task_id).to_status().model_dump_json()))
+
+    pdf_service.status_listeners.append(lambda task: send(("status", task.model_dump_json())))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            # 父进程已退出
+            return
+        command, payload = message
+        if command == "warmup":
+            try:
+                pdf_service.warm_up_models()
+                conn.send(("ready", None))
+            except Exception as e:
+                conn.send(("ready", str(e)))
+            continue
+        if command == "stop":
+            # 与其他任务共用子进程的任务被取消或超时，在当前这段页面处理完后结束
+            task_id, status, error = payload
+            if task_id in pdf_service.tasks:
+                pdf_service.stop_requests[task_id] = (status, error)
+            continue
+
+        task_id, pdf_path, task_json = payload
+        pdf_service.tasks[task_id] = TaskRecord.from_status(TaskStatus.model_validate_json(task_json))
+        threading.Thread(target=convert, args=(task_id, pdf_path), name=f"convert-{task_id}", daemon=True).start()
+
+class _ConversionProcess:
+    """常驻的转换子进程，模型在进程内加载一次，被结束后由新进程替换
+
+    通常每个子进程同一时间只转换一个任务；开启跨任务合并推理时，同时转换的小文档放在同一个子进程中。
+    """
+
+    def __init__(self):
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        # 子进程的线程份额，默认按所有并发槽位都在转换计算
+        self.threads = context.Value("i", thread_share(settings.MAX_CONCURRENT_TASKS), lock=False)
+        self.process = context.Process(target=_process_main, args=(child_conn, self.threads), name="mineru-convert")
+        self.process.start()
+        # 只保留子进程持有的一端，子进程退出时父进程的recv才会收到EOF
+        child_conn.close()
+        self.stops = {}  # 子进程被结束时，导致结束的任务 {task_id: (最终状态, 错误信息)}
+        self.tasks = {}  # 子进程中正在转换的任务 {task_id: 接收该任务消息的队列}
+        self.batch = False  # 是否为可合并推理的小文档共用的子进程
+        self.reader = None  # 把子进程的消息分发给各任务的协程
+
+    def receive(self) -> Optional[tuple]:
+        """读取子进程的下一条消息，子进程已退出时返回None"""
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            return None
+
+    def warm_up(self):
+        """在子进程中加载模型，加载失败时抛出RuntimeError"""
+        self.conn.send(("warmup", None))
+        message = self.receive()
+        if message is None:
+            raise RuntimeError(f"Conversion process exited during warm-up (exit code {self.process.exitcode})")
+        if message[1] is not None:
+            raise RuntimeError(message[1])
+
+    async def read_messages(self):
+        """持续读取子进程的消息并按task_id分发，子进程退出时通知所有任务"""
+        while True:
+            message = await asyncio.to_thread(self.receive)
+            if message is None:
+                for queue in self.tasks.values():
+                    queue.put_nowait(None)
+                return
+            status = TaskStatus.model_validate_json(message[1])
+            queue = self.tasks.get(status.task_id)
+            if queue is not None:
+                queue.put_nowait((message[0], status))
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+
+    def close(self):
+        self.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+def task_timeout(task: TaskRecord) -> float:
+    """任务的转换时限（秒）：TASK_TIMEOUT_SECONDS和按页数计算的时限中较小的一个，0表示不限制"""
+    limits = []
+    if settings.TASK_TIMEOUT_SECONDS > 0:
+        limits.append(settings.TASK_TIMEOUT_SECONDS)
+    page_count = task.preflight.page_count if task.preflight else None
+    if settings.PAGE_TIMEOUT_SECONDS > 0 and page_count:
+        limits.append(settings.PAGE_TIMEOUT_SECONDS * page_count)
+    return min(limits) if limits else 0
+
+class ConversionRunner:
+    """执行转换任务，负责取消和超时
+
+    CONVERSION_ISOLATION为"process"时每个并发槽位对应一个常驻子进程，取消或超时时直接结束子进程，
+    槽位立即释放，并在后台启动加载好模型的替换进程供下一个任务使用；为"thread"时转换在线程中执行，
+    取消和超时在当前这段页面处理完后生效。
+
+    开启跨任务合并推理（MICRO_BATCH_WINDOW_MS）时，进程模式下同时转换的小文档被分配到同一个子进程，
+    在子进程中合并推理；这些任务的取消和超时与线程模式相同，超过SHARED_STOP_GRACE_SECONDS仍未结束时结束子进程。
+    """
+
+    def __init__(self):
+        self._running = {}  # {task_id: 执行该任务的子进程，线程模式下为None}
+        self._idle = []  # 空闲的子进程
+        self._warming = {}  # {预热协程: 正在加载模型的替换子进程}
+        self._postprocessing = set()  # 转换完成后正在执行后处理步骤的任务
+        self.models_ready = False
+        self.warmup_error = None
+
+    async def warm_up(self):
+        """预先加载模型：进程模式下为每个并发槽位启动子进程并在其中加载，完成后models_ready为True"""
+        try:
+            if settings.CONVERSION_ISOLATION == "process":
+                workers = [_ConversionProcess() for _ in range(settings.MAX_CONCURRENT_TASKS - len(self._idle))]
+                try:
+                    await asyncio.gather(*(asyncio.to_thread(worker.warm_up) for worker in workers))
+                except BaseException:
+                    for worker in workers:
+                        await asyncio.to_thread(worker.close)
+                    raise
+                for worker in workers:
+                    # 预热期间已有任务启动了自己的子进程时，多出的进程直接关闭
+                    if len(self._idle) + len(self._busy_workers()) < settings.MAX_CONCURRENT_TASKS:
+                        self._idle.append(worker)
+                    else:
+                        await asyncio.to_thread(worker.close)
+            else:
+                await asyncio.to_thread(warm_up_models)
+        except Exception as e:
+            self.warmup_error = str(e)
+            logger.error(f"Model warm-up failed: {str(e)}", exc_info=True)
+            return
+        self.models_ready = True
+        logger.info("Models loaded")
+
+    def is_running(self, task_id: str) -> bool:
+        return task_id in self._running
+
+    @property
+    def postprocessing_count(self) -> int:
+        return len(self._postprocessing)
+
+    async def postprocess(self, task_id: str):
+        """执行转换完成的任务的后处理步骤并发布输出，在线程中执行，不占用转换槽位和子进程"""
+        self._postprocessing.add(task_id)
+        try:
+            await asyncio.to_thread(postprocess_task, task_id)
+        finally:
+            self._postprocessing.discard(task_id)
+
+    async def run(self, task_id: str, pdf_path: str):
+        """执行一个任务直到结束、被取消或超时，需在事件循环中调用"""
+        # 分配到子进程之前先登记，等待替换进程加载模型期间的取消请求按线程模式记录
+        self._running[task_id] = None
+        timer = None
+        try:
+            worker = None
+            if settings.CONVERSION_ISOLATION == "process":
+                worker = await self._acquire_worker(task_id)
+            if task_id in stop_requests:
+                # 等待子进程期间已被取消
+                if worker is not None and not worker.tasks:
+                    self._idle.append(worker)
+                mark_stopped(task_id, *stop_requests[task_id])
+                notify_status(task_id)
+                return
+            
+            # 转换时限从分配到子进程后开始计算，不包括等待替换进程加载模型的时间
+            timeout = task_timeout(tasks[task_id])
+            if timeout > 0:
+                timer = asyncio.get_running_loop().call_later(
+                    timeout, self.cancel, task_id, "failed", f"Task timed out after {timeout:g} seconds"
+                )
+            if worker is not None:
+                await self._run_in_process(task_id, pdf_path, worker)
+            else:
+                # 转换在线程中执行，事件循环可以继续响应请求
+                await asyncio.to_thread(convert_task, task_id, pdf_path)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self._running.pop(task_id, None)
+            stop_requests.pop(task_id, None)
+
+    def _busy_workers(self) -> set:
+        """正在转换的子进程，多个小文档可能共用一个"""
+        return {worker for worker in self._running.values() if worker is not None}
+
+    def _batchable(self, task_id: str) -> bool:
+        """任务是否可以与其他小文档共用子进程合并推理"""
+        preflight = tasks[task_id].preflight
+        return (settings.MICRO_BATCH_WINDOW_MS > 0 and preflight is not None and preflight.page_count is not None
+                and preflight.page_count <= settings.MICRO_BATCH_MAX_DOC_PAGES)
+
+    async def _acquire_worker(self, task_id: str) -> _ConversionProcess:
+        """为任务分配子进程：小文档加入正在转换小文档的子进程，其余任务使用空闲的子进程；
+        没有空闲子进程但有替换进程正在加载模型时等待它就绪，都没有时启动新进程"""
+        batchable = self._batchable(task_id)
+        while True:
+            if batchable:
+                for worker in self._busy_workers():
+                    if worker.batch and not worker.stops and worker.process.is_alive():
+                        return worker
+            if self._idle or not self._warming:
+                break
+            await asyncio.wait(list(self._warming), return_when=asyncio.FIRST_COMPLETED)
+        worker = self._idle.pop() if self._idle else _ConversionProcess()
+        worker.batch = batchable
+        return worker
+
+    def _replace_worker(self):
+        """被结束或意外退出的子进程关闭后，在后台启动替换进程并加载模型，加载完成后才加入空闲列表"""
+        if not self.models_ready:
+            # 未预热时保持原来的行为，模型在第一个任务中加载
+            return
+        if len(self._idle) + len(self._busy_workers()) + len(self._warming) >= settings.MAX_CONCURRENT_TASKS:
+            return
+        worker = _ConversionProcess()
+        self._warming[asyncio.create_task(self._warm_up_replacement(worker))] = worker
+
+    async def _warm_up_replacement(self, worker: _ConversionProcess):
+        try:
+            await asyncio.to_thread(worker.warm_up)
+        except Exception as e:
+            logger.error(f"Replacement conversion process failed to load models: {str(e)}")
+            await asyncio.to_thread(worker.close)
+            return
+        finally:
+            self._warming.pop(asyncio.current_task(), None)
+        self._idle.append(worker)
+        logger.info("Replacement conversion process ready")
+
+    async def _run_in_process(self, task_id: str, pdf_path: str, worker: _ConversionProcess):
+        queue = worker.tasks[task_id] = asyncio.Queue()
+        self._running[task_id] = worker
+        if worker.reader is None:
+            worker.reader = asyncio.create_task(worker.read_messages())
+        self._rebalance()
+        try:
+            worker.conn.send(("convert", (task_id, pdf_path, tasks[task_id].to_status().model_dump_json())))
+            while True:
+                message = await queue.get()
+                if message is None:
+                    # 子进程已退出，等待回收后读取退出码
+                    await asyncio.to_thread(worker.process.join, 5)
+                    break
+                kind, status = message
+                self._apply_status(status)
+                if kind == "done":
+                    return
+        except Exception:
+            worker.kill()
+            raise
+        finally:
+            worker.tasks.pop(task_id, None)
+            self._running.pop(task_id, None)
+            if not worker.tasks:
+                if worker.process.is_alive() and not worker.stops:
+                    self._idle.append(worker)
+                else:
+                    await asyncio.to_thread(worker.close)
+                    self._replace_worker()
+            self._rebalance()
+
+        # 子进程被结束或意外退出
+        if task_id in worker.stops:
+            status, error = worker.stops[task_id]
+            logger.info(f"Task {task_id} stopped: {error or status}")
+        else:
+            status, error = "failed", f"Conversion process exited unexpectedly (exit code {worker.process.exitcode})"
+            logger.error(f"Task {task_id} failed: {error}")
+        mark_stopped(task_id, status, error)
+        notify_status(task_id)
+
+    def _rebalance(self):
+        """按正在转换的子进程数重新分配线程份额，子进程在下一次推理前生效"""
+        workers = self._busy_workers()
+        share = thread_share(len(workers))
+        for worker in workers:
+            worker.threads.value = share
+
+    def _apply_status(self, status: TaskStatus):
+        """把子进程回报的状态合并到本进程的任务记录中，排队预计时间由本进程的调度器维护"""
+        task = tasks.get(status.task_id)
+        if task is None:
+            return
+        for field, value in status:
+            if field != "eta":
+                setattr(task, field, value)
+        if task.expires_at:
+            expiry_queue.schedule(task.task_id, task.expires_at)
+        notify_status(task.task_id)
+
+    def cancel(self, task_id: str, status: str = "cancelled", error: Optional[str] = "Cancelled by user") -> bool:
+        """停止正在执行的任务，任务不在执行中时返回False。status为pending时任务被中断后由调用方重新入队"""
+        if task_id in self._postprocessing:
+            # 后处理步骤在线程中执行，当前步骤结束后停止
+            stop_requests[task_id] = (status, error)
+            logger.info(f"Stopping task {task_id}: {error or status}")
+            return True
+        if task_id not in self._running:
+            return False
+        worker = self._running[task_id]
+        if worker is None:
+            stop_requests[task_id] = (status, error)
+        elif worker.stops:
+            # 子进程已在结束中
+            pass
+        elif len(worker.tasks) > 1:
+            # 子进程中还有其他任务，只停止这个任务，长时间未结束时再结束子进程
+            worker.conn.send(("stop", (task_id, status, error)))
+            asyncio.get_running_loop().call_later(
+                SHARED_STOP_GRACE_SECONDS, self._kill_if_running, task_id, worker, status, error
+            )
+        else:
+            worker.stops[task_id] = (status, error)
+            worker.kill()
+        logger.info(f"Stopping task {task_id}: {error or status}")
+        return True
+
+    def _kill_if_running(self, task_id: str, worker: _ConversionProcess, status: str, error: Optional[str]):
+        """共用子进程的任务在宽限时间后仍未结束时结束子进程，同一子进程中的其他任务按意外退出处理"""
+        if task_id in worker.tasks:
+            logger.warning(f"Task {task_id} did not stop within {SHARED_STOP_GRACE_SECONDS}s, killing its conversion process")
+            worker.stops[task_id] = (status, error)
+            worker.kill()
+
+    def shutdown(self):
+        """结束所有子进程"""
+        for warming in self._warming:
+            warming.cancel()
+        for worker in self._idle + list(self._busy_workers()) + list(self._warming.values()):
+            worker.close()
+        self._idle.clear()
+
+# 全局执行器
+runner = ConversionRunner()
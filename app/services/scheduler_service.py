@@ -0,0 +1,97 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from datetime import datetime, timedelta
+
+from app.core.config import settings
+from app.services.pdf_service import tasks, postprocess_pending
+from app.services.runner_service import runner
+
+logger = logging.getLogger("mineru-api")
+
+def task_priority(estimated_seconds: float) -> float:
+    """排队优先级，值越小越先执行
+
+    相当于给每个任务一个"虚拟截止时间"：小任务排在大任务前面，
+    但大任务等待的时间会抵消它的估算耗时，不会被源源不断的小任务饿死。
+    """
+    return time.time() + estimated_seconds * settings.SCHEDULER_COST_WEIGHT
+
+class TaskScheduler:
+    """本地执行模式的任务调度器，按估算耗时排序并限制并发数"""
+
+    def __init__(self):
+        self._pending = []  # [(优先级, 序号, task_id, pdf_path, 估算耗时)]
+        self._running = {}  # {task_id: (开始时间, 估算耗时)}
+        self._counter = itertools.count()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    def submit(self, task_id: str, pdf_path: str, estimated_seconds: float):
+        """提交任务，需在事件循环中调用"""
+        heapq.heappush(
+            self._pending,
+            (task_priority(estimated_seconds), next(self._counter), task_id, pdf_path, estimated_seconds)
+        )
+        self._dispatch()
+
+    def _dispatch(self):
+        """在并发数允许的范围内启动排在最前面的任务"""
+        loop = asyncio.get_running_loop()
+        while self._pending and len(self._running) < settings.MAX_CONCURRENT_TASKS:
+            _, _, task_id, pdf_path, estimated_seconds = heapq.heappop(self._pending)
+            if task_id not in tasks:
+                continue
+            self._running[task_id] = (time.monotonic(), estimated_seconds)
+            loop.create_task(self._run(task_id, pdf_path))
+        self._update_eta()
+
+    def cancel_pending(self, task_id: str) -> bool:
+        """从等待队列中移除任务，任务不在排队时返回False"""
+        remaining = [entry for entry in self._pending if entry[2] != task_id]
+        if len(remaining) == len(self._pending):
+            return False
+        heapq.heapify(remaining)
+        self._pending = remaining
+        self._update_eta()
+        return True
+
+    async def _run(self, task_id: str, pdf_path: str):
+        try:
+            await runner.run(task_id, pdf_path)
+        finally:
+            self._running.pop(task_id, None)
+            self._dispatch()
+        # 后处理步骤在释放转换槽位之后执行
+        if postprocess_pending(task_id):
+            await runner.postprocess(task_id)
+
+    def _update_eta(self):
+        """模拟各并发槽位的空闲时间，估算每个任务的完成时间"""
+        now = time.monotonic()
+        wall_now = datetime.now()
+        slots = []
+        for task_id, (started, estimated_seconds) in self._running.items():
+            remaining = max(estimated_seconds - (now - started), 0)
+            slots.append(remaining)
+            if task_id in tasks:
+                tasks[task_id].eta = wall_now + timedelta(seconds=remaining)
+        slots.extend([0.0] * max(settings.MAX_CONCURRENT_TASKS - len(slots), 0))
+        heapq.heapify(slots)
+
+        for _, _, task_id, _, estimated_seconds in sorted(self._pending):
+            finish = heapq.heappop(slots) + estimated_seconds
+            heapq.heappush(slots, finish)
+            if task_id in tasks:
+                tasks[task_id].eta = wall_now + timedelta(seconds=finish)
+
+# 全局调度器
+scheduler = TaskScheduler()
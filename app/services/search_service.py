@@ -0,0 +1,148 @@
+import re
+import json
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+from typing import Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.models.search import SearchHit
+
+logger = logging.getLogger("mineru-api")
+
+# 表格正文中的HTML标签
+HTML_TAG = re.compile(r"<[^>]+>")
+
+def block_text(block: dict) -> str:
+    """内容块中可检索的文本：正文、公式，图片和表格取标题、脚注和表格内容"""
+    if block.get("type") in ("image", "table"):
+        parts = block.get("img_caption", []) + block.get("table_caption", [])
+        if block.get("table_body"):
+            parts.append(HTML_TAG.sub(" ", block["table_body"]))
+        parts += block.get("img_footnote", []) + block.get("table_footnote", [])
+        return " ".join(" ".join(parts).split())
+    return (block.get("text") or "").strip()
+
+def iter_blocks(content_list: list) -> Iterator[Tuple[str, int, str, Optional[str]]]:
+    """把content_list转换为索引行 (文本, 页码, 类型, bbox)"""
+    for block in content_list:
+        text = block_text(block)
+        if not text:
+            continue
+        block_type = block.get("type", "text")
+        if block_type == "text" and block.get("text_level"):
+            block_type = "title"
+        bbox = json.dumps(block["bbox"]) if block.get("bbox") else None
+        yield text, block.get("page_idx", 0), block_type, bbox
+
+class SearchIndex:
+    """转换结果的全文索引（SQLite FTS5）
+
+    任务完成时把content_list中的内容块写入索引，任务被清理时删除。每个任务的行在同一个事务中写入，
+    rowid连续，documents表记录每个任务的rowid区间，按任务删除和筛选不需要扫描全表。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每次操作使用独立连接，可在多个线程和进程中安全使用
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS blocks USING fts5("
+                        "text, task_id UNINDEXED, page UNINDEXED, type UNINDEXED, bbox UNINDEXED, "
+                        f"tokenize='{settings.SEARCH_TOKENIZER}')"
+                    )
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS documents ("
+                        "task_id TEXT PRIMARY KEY, first_row INTEGER NOT NULL, last_row INTEGER NOT NULL)"
+                    )
+                    self._initialized = True
+        return conn
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, task_id: str):
+        row = conn.execute("SELECT first_row, last_row FROM documents WHERE task_id = ?", (task_id,)).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM blocks WHERE rowid BETWEEN ? AND ?", row)
+            conn.execute("DELETE FROM documents WHERE task_id = ?", (task_id,))
+
+    def _insert(self, task_id: str, rows: Iterator[tuple]) -> int:
+        """在一个事务中替换任务的全部索引行，返回写入的行数"""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete(conn, task_id)
+                first_row = conn.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM blocks").fetchone()[0]
+                cursor = conn.executemany(
+                    "INSERT INTO blocks (rowid, text, task_id, page, type, bbox) VALUES (?, ?, ?, ?, ?, ?)",
+                    ((first_row + index, text, task_id, page, block_type, bbox)
+                     for index, (text, page, block_type, bbox) in enumerate(rows))
+                )
+                count = cursor.rowcount
+                if count > 0:
+                    conn.execute(
+                        "INSERT INTO documents (task_id, first_row, last_row) VALUES (?, ?, ?)",
+                        (task_id, first_row, first_row + count - 1)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def index_task(self, task_id: str, content_list: list):
+        """把任务的content_list写入索引，重复调用时替换已有的内容"""
+        count = self._insert(task_id, iter_blocks(content_list))
+        logger.info(f"Indexed {count} blocks of task {task_id}")
+
+    def copy_task(self, src_task_id: str, dst_task_id: str):
+        """复制另一个任务的索引行，用于共享转换结果的任务"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT first_row, last_row FROM documents WHERE task_id = ?", (src_task_id,)).fetchone()
+            rows = conn.execute(
+                "SELECT text, page, type, bbox FROM blocks WHERE rowid BETWEEN ? AND ? ORDER BY rowid", row
+            ).fetchall() if row else []
+        self._insert(dst_task_id, iter(rows))
+
+    def remove_task(self, task_id: str):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete(conn, task_id)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def search(self, query: str, task_id: Optional[str] = None, limit: int = 20) -> List[SearchHit]:
+        """按相关度返回匹配的内容块，query按短语匹配，task_id限定在一个任务内"""
+        # 作为短语查询，用户输入中的引号、运算符等不会被解释为FTS5语法
+        phrase = '"' + query.replace('"', '""') + '"'
+        sql = (
+            "SELECT blocks.task_id, page, type, snippet(blocks, 0, '**', '**', '…', 64), bbox "
+            "FROM blocks WHERE blocks MATCH ?"
+        )
+        params = [phrase]
+        with closing(self._connect()) as conn:
+            if task_id is not None:
+                row = conn.execute("SELECT first_row, last_row FROM documents WHERE task_id = ?", (task_id,)).fetchone()
+                if row is None:
+                    return []
+                sql += " AND rowid BETWEEN ? AND ?"
+                params += row
+            rows = conn.execute(sql + " ORDER BY rank LIMIT ?", (*params, limit)).fetchall()
+        return [
+            SearchHit(task_id=row[0], page=row[1], type=row[2], snippet=row[3], bbox=json.loads(row[4]) if row[4] else None)
+            for row in rows
+        ]
+
+# 全局检索索引
+search_index = SearchIndex(settings.SEARCH_INDEX_PATH)
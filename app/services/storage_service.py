@@ -0,0 +1,229 @@
+import os
+import shutil
+import logging
+from functools import lru_cache
+from typing import BinaryIO, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger("mineru-api")
+
+class StorageBackend:
+    """任务输出文件存储后端
+
+    转换过程始终写入本地工作目录（work_dir），任务完成后调用publish将输出发布到后端。
+    下载和打包通过后端接口读取，不直接依赖本地OUTPUT_DIR。
+    """
+
+    def work_dir(self, task_id: str) -> str:
+        """任务的本地工作目录，转换过程中的所有输出先写到这里"""
+        return os.path.join(settings.OUTPUT_DIR, task_id)
+
+    def get_writer(self, task_id: str, sub_dir: str = ""):
+        """返回写入工作目录的MinerU DataWriter"""
+        import magic_pdf.data.data_reader_writer as drw
+
+        path = os.path.join(self.work_dir(task_id), sub_dir) if sub_dir else self.work_dir(task_id)
+        os.makedirs(path, exist_ok=True)
+        return drw.FileBasedDataWriter(path)
+
+    def publish(self, task_id: str):
+        """将工作目录中的输出发布到存储后端"""
+        raise NotImplementedError
+
+    def exists(self, task_id: str, rel_path: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, task_id: str, rel_path: str) -> int:
+        raise NotImplementedError
+
+    def open(self, task_id: str, rel_path: str) -> BinaryIO:
+        """以二进制流方式读取文件"""
+        raise NotImplementedError
+
+    def read_range(self, task_id: str, rel_path: str, offset: int, length: int) -> bytes:
+        """读取文件中从offset开始的length个字节"""
+        raise NotImplementedError
+
+    def list_files(self, task_id: str, prefix: str = "") -> List[str]:
+        """列出任务下以prefix开头的所有文件（相对路径，使用/分隔）"""
+        raise NotImplementedError
+
+    def local_path(self, task_id: str, rel_path: str) -> Optional[str]:
+        """文件在本机的路径，不在本地存储时返回None"""
+        return None
+
+    def presigned_url(self, task_id: str, rel_path: str, filename: str, content_encoding: Optional[str] = None) -> Optional[str]:
+        """客户端可直接下载的预签名URL，content_encoding为响应的Content-Encoding，不支持时返回None"""
+        return None
+
+    def delete(self, task_id: str):
+        """删除任务的所有输出（包括本地工作目录）"""
+        raise NotImplementedError
+
+    def copy(self, src_task_id: str, dst_task_id: str):
+        """把一个任务已发布的全部输出复制到另一个任务下"""
+        raise NotImplementedError
+
+def _link_or_copy(src: str, dst: str):
+    """创建硬链接，跨文件系统等无法链接时复制文件"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+class LocalStorage(StorageBackend):
+    """本地文件系统存储，输出直接保留在OUTPUT_DIR/<task_id>下"""
+
+    def publish(self, task_id: str):
+        pass
+
+    def exists(self, task_id: str, rel_path: str) -> bool:
+        return os.path.isfile(self.local_path(task_id, rel_path))
+
+    def size(self, task_id: str, rel_path: str) -> int:
+        return os.path.getsize(self.local_path(task_id, rel_path))
+
+    def open(self, task_id: str, rel_path: str) -> BinaryIO:
+        return open(self.local_path(task_id, rel_path), "rb")
+
+    def read_range(self, task_id: str, rel_path: str, offset: int, length: int) -> bytes:
+        with open(self.local_path(task_id, rel_path), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def list_files(self, task_id: str, prefix: str = "") -> List[str]:
+        task_dir = self.work_dir(task_id)
+        result = []
+        for root, _, files in os.walk(task_dir):
+            for file in files:
+                rel_path = os.path.relpath(os.path.join(root, file), task_dir).replace(os.sep, "/")
+                if rel_path.startswith(prefix):
+                    result.append(rel_path)
+        return sorted(result)
+
+    def local_path(self, task_id: str, rel_path: str) -> Optional[str]:
+        return os.path.join(self.work_dir(task_id), *rel_path.split("/"))
+
+    def delete(self, task_id: str):
+        task_dir = self.work_dir(task_id)
+        if os.path.exists(task_dir):
+            shutil.rmtree(task_dir, ignore_errors=True)
+
+    def copy(self, src_task_id: str, dst_task_id: str):
+        # 输出生成后不再修改，优先使用硬链接，不占用额外磁盘空间
+        shutil.copytree(self.work_dir(src_task_id), self.work_dir(dst_task_id),
+                        copy_function=_link_or_copy, dirs_exist_ok=True)
+
+class S3Storage(StorageBackend):
+    """S3兼容对象存储（AWS S3、MinIO等）
+
+    publish时使用分段上传，下载通过预签名URL由客户端直接从对象存储获取，API节点不转发文件内容。
+    """
+
+    def __init__(self):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = settings.S3_BUCKET
+        self.prefix = settings.S3_PREFIX
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            aws_access_key_id=settings.S3_ACCESS_KEY,
+            aws_secret_access_key=settings.S3_SECRET_KEY,
+            region_name=settings.S3_REGION
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.S3_MULTIPART_CHUNKSIZE
+        )
+
+    def _key(self, task_id: str, rel_path: str = "") -> str:
+        return f"{self.prefix}{task_id}/{rel_path}"
+
+    def publish(self, task_id: str):
+        task_dir = self.work_dir(task_id)
+        for root, _, files in os.walk(task_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                rel_path = os.path.relpath(file_path, task_dir).replace(os.sep, "/")
+                self.client.upload_file(file_path, self.bucket, self._key(task_id, rel_path), Config=self.transfer_config)
+        logger.info(f"Published outputs of task {task_id} to s3://{self.bucket}/{self._key(task_id)}")
+        # 输出已上传，本地工作目录不再需要
+        shutil.rmtree(task_dir, ignore_errors=True)
+
+    def _head(self, task_id: str, rel_path: str) -> Optional[dict]:
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(task_id, rel_path))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, task_id: str, rel_path: str) -> bool:
+        return self._head(task_id, rel_path) is not None
+
+    def size(self, task_id: str, rel_path: str) -> int:
+        return self._head(task_id, rel_path)["ContentLength"]
+
+    def open(self, task_id: str, rel_path: str) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(task_id, rel_path))["Body"]
+
+    def read_range(self, task_id: str, rel_path: str, offset: int, length: int) -> bytes:
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self._key(task_id, rel_path), Range=f"bytes={offset}-{offset + length - 1}"
+        )
+        return response["Body"].read()
+
+    def list_files(self, task_id: str, prefix: str = "") -> List[str]:
+        base = self._key(task_id)
+        result = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=base + prefix):
+            for obj in page.get("Contents", []):
+                result.append(obj["Key"][len(base):])
+        return sorted(result)
+
+    def presigned_url(self, task_id: str, rel_path: str, filename: str, content_encoding: Optional[str] = None) -> Optional[str]:
+        params = {
+            "Bucket": self.bucket,
+            "Key": self._key(task_id, rel_path),
+            "ResponseContentDisposition": f'attachment; filename="{filename}"'
+        }
+        if content_encoding:
+            params["ResponseContentEncoding"] = content_encoding
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params=params,
+            ExpiresIn=settings.S3_PRESIGNED_EXPIRES
+        )
+
+    def delete(self, task_id: str):
+        keys = [self._key(task_id, rel_path) for rel_path in self.list_files(task_id)]
+        # delete_objects每次最多1000个对象
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": True}
+            )
+        shutil.rmtree(self.work_dir(task_id), ignore_errors=True)
+
+    def copy(self, src_task_id: str, dst_task_id: str):
+        # 服务端复制，大对象自动使用分段复制，数据不经过API节点
+        for rel_path in self.list_files(src_task_id):
+            self.client.copy(
+                {"Bucket": self.bucket, "Key": self._key(src_task_id, rel_path)},
+                self.bucket, self._key(dst_task_id, rel_path), Config=self.transfer_config
+            )
+
+@lru_cache(maxsize=None)
+def get_storage() -> StorageBackend:
+    """根据配置返回存储后端实例"""
+    if settings.STORAGE_BACKEND == "s3":
+        return S3Storage()
+    if settings.STORAGE_BACKEND != "local":
+        raise ValueError(f"Unsupported storage backend: {settings.STORAGE_BACKEND}")
+    return LocalStorage()
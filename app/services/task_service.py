@@ -1,52 +1,139 @@
 import os
+import json
 import shutil
 import asyncio
 import logging
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 import uuid
-from fastapi import UploadFile, HTTPException, BackgroundTasks
+from fastapi import UploadFile, HTTPException
 import zipfile
+from contextlib import closing
 from tempfile import NamedTemporaryFile
+from typing import List, Optional, Tuple
 
 from app.core.config import settings
-from app.models.task import TaskStatus
-from app.services.pdf_service import tasks, active_tasks, process_pdf
+from app.models.task import TaskStatus, TaskRecord, BulkStatusResponse, TaskList, PostprocessStage
+from app.services.pdf_service import tasks, notify_status, mark_stopped
+from app.services.expiry_service import expiry_queue
+from app.services.storage_service import get_storage
+from app.services.broker_service import get_broker, select_tasks
+from app.services.preflight_service import probe_pdf
+from app.services.scheduler_service import scheduler, task_priority
+from app.services.runner_service import runner
+from app.services.drain_service import drain_state
+from app.services.coalesce_service import single_flight
+from app.services.search_service import search_index
+from app.services.postprocess_service import parse_postprocess
+from app.services.compression_service import stored_file, open_output, write_precompressed
+from app.utils.fs import get_dir_size, file_sha256
 
 logger = logging.getLogger("mineru-api")
 
+# /stream每次读取的最大字节数
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# 本地执行模式下的幂等键 {Idempotency-Key: task_id}
+idempotency_keys = {}
+
+def _delete_task_files(task_id: str):
+    """删除任务的上传文件和输出文件（在线程中执行）"""
+    # 删除上传的文件
+    task_upload_dir = os.path.join(settings.UPLOAD_DIR, task_id)
+    if os.path.exists(task_upload_dir):
+        shutil.rmtree(task_upload_dir, ignore_errors=True)
+    
+    # 删除输出文件
+    get_storage().delete(task_id)
+
+async def remove_task(task_id: str):
+    """移除任务记录并在工作线程中删除其文件，按配置限制删除速率"""
+    tasks.pop(task_id, None)
+    for key in [key for key, value in idempotency_keys.items() if value == task_id]:
+        del idempotency_keys[key]
+    if settings.EXECUTION_MODE == "broker":
+        await asyncio.to_thread(get_broker().delete_status, task_id)
+    if settings.SEARCH_INDEX_ENABLED:
+        await asyncio.to_thread(search_index.remove_task, task_id)
+    await asyncio.to_thread(_delete_task_files, task_id)
+    await asyncio.sleep(1 / settings.CLEANUP_MAX_DELETES_PER_SECOND)
+
+async def enforce_output_quota():
+    """OUTPUT_DIR超出配额时，按创建时间从旧到新淘汰已完成的任务"""
+    total_size = await asyncio.to_thread(get_dir_size, settings.OUTPUT_DIR)
+    if total_size <= settings.OUTPUT_DIR_QUOTA_BYTES:
+        return
+    
+    logger.warning(f"Output dir size {total_size} exceeds quota {settings.OUTPUT_DIR_QUOTA_BYTES}, evicting oldest tasks")
+    completed = sorted(
+        (task for task in tasks.values() if task.status == "completed"),
+        key=lambda task: task.created_at
+    )
+    for task in completed:
+        if total_size <= settings.OUTPUT_DIR_QUOTA_BYTES:
+            break
+        task_size = await asyncio.to_thread(get_dir_size, os.path.join(settings.OUTPUT_DIR, task.task_id))
+        await remove_task(task.task_id)
+        total_size -= task_size
+        logger.info(f"Evicted task {task.task_id} to free {task_size} bytes")
+
 async def cleanup_expired_tasks():
-    """定期清理过期的任务"""
+    """清理过期的任务：睡眠到最近的过期时间再处理，并定期检查磁盘配额"""
+    expiry_queue.bind()
+    for task_id, task in list(tasks.items()):
+        if task.expires_at:
+            expiry_queue.schedule(task_id, task.expires_at)
+    
+    next_quota_check = time.monotonic()
     while True:
         now = datetime.now()
-        expired_tasks = [task_id for task_id, task in tasks.items() 
-                        if task.expires_at and now > task.expires_at]
-        
-        for task_id in expired_tasks:
-            # 删除上传的文件
-            task_upload_dir = os.path.join(settings.UPLOAD_DIR, task_id)
-            if os.path.exists(task_upload_dir):
-                shutil.rmtree(task_upload_dir)
-            
-            # 删除输出文件
-            task_output_dir = os.path.join(settings.OUTPUT_DIR, task_id)
-            if os.path.exists(task_output_dir):
-                shutil.rmtree(task_output_dir)
-            
-            # 从任务列表中移除
-            del tasks[task_id]
+        for task_id in expiry_queue.pop_due(now):
+            task = tasks.get(task_id)
+            # 任务已删除或过期时间已被推后的旧堆条目直接跳过
+            if task is None or not task.expires_at or task.expires_at > now:
+                continue
+            await remove_task(task_id)
             logger.info(f"Cleaned up expired task {task_id}")
         
-        # 每小时检查一次
-        await asyncio.sleep(3600)
+        timeout = None
+        next_expiry = expiry_queue.next_expiry()
+        if next_expiry is not None:
+            timeout = max((next_expiry - datetime.now()).total_seconds(), 0)
+        
+        if settings.OUTPUT_DIR_QUOTA_BYTES > 0:
+            if time.monotonic() >= next_quota_check:
+                await enforce_output_quota()
+                next_quota_check = time.monotonic() + settings.QUOTA_CHECK_INTERVAL_SECONDS
+            quota_timeout = max(next_quota_check - time.monotonic(), 0)
+            timeout = quota_timeout if timeout is None else min(timeout, quota_timeout)
+        
+        await expiry_queue.wait(timeout)
 
-async def create_task(file: UploadFile, background_tasks: BackgroundTasks) -> TaskStatus:
-    """创建新的PDF处理任务"""
-    # 检查并发任务数
-    if active_tasks >= settings.MAX_CONCURRENT_TASKS:
+def claim_idempotency_key(key: str, task_id: str) -> str:
+    """把幂等键关联到新任务，键已被占用时返回已关联的task_id"""
+    if settings.EXECUTION_MODE == "broker":
+        return get_broker().claim_key(key, task_id)
+    return idempotency_keys.setdefault(key, task_id)
+
+def release_idempotency_key(key: str):
+    """任务创建失败时释放幂等键，客户端可以用同一个键重试"""
+    if settings.EXECUTION_MODE == "broker":
+        get_broker().release_key(key)
+    else:
+        idempotency_keys.pop(key, None)
+
+def check_queue_capacity():
+    """检查节点是否在接收任务以及排队任务数"""
+    drain_state.check_accepting()
+    if settings.EXECUTION_MODE != "broker" and scheduler.pending_count >= settings.MAX_QUEUED_TASKS:
         raise HTTPException(
             status_code=429,
-            detail="Too many concurrent tasks. Please try again later."
+            detail="Too many queued tasks. Please try again later."
         )
+
+async def create_task(file: UploadFile, idempotency_key: Optional[str] = None, postprocess: Optional[str] = None) -> TaskStatus:
+    """创建新的PDF处理任务，带幂等键的重复请求返回已创建的任务；postprocess为声明后处理步骤的JSON数组"""
+    check_queue_capacity()
     
     # 验证文件是PDF
     if not file.filename.endswith('.pdf'):
@@ -54,76 +141,351 @@ async def create_task(file: UploadFile, background_tasks: BackgroundTasks) -> Ta
             status_code=400,
             detail="Only PDF files are supported"
         )
-    
-    # 检查文件大小
-    file_size = 0
-    chunk_size = 1024 * 1024  # 1MB
-    chunks = []
-    
-    while True:
-        chunk = await file.read(chunk_size)
-        if not chunk:
-            break
-        file_size += len(chunk)
-        chunks.append(chunk)
-        
-        if file_size > settings.MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=413,
-                detail=f"File too large. Maximum size is {settings.MAX_FILE_SIZE / (1024 * 1024)}MB"
-            )
+    stages = parse_postprocess(postprocess)
     
     # 创建任务ID
     task_id = str(uuid.uuid4())
-    task_upload_dir = os.path.join(settings.UPLOAD_DIR, task_id)
-    os.makedirs(task_upload_dir, exist_ok=True)
+    
+    if idempotency_key:
+        existing_id = await asyncio.to_thread(claim_idempotency_key, idempotency_key, task_id)
+        if existing_id != task_id:
+            existing = await asyncio.to_thread(find_task, existing_id)
+            if existing is None:
+                # 键已被占用但任务尚未创建完成
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still being processed"
+                )
+            logger.info(f"Idempotency-Key matched existing task {existing_id}")
+            return existing.to_status()
+    
+    try:
+        # 检查文件大小
+        file_size = 0
+        chunk_size = 1024 * 1024  # 1MB
+        chunks = []
+        
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            file_size += len(chunk)
+            chunks.append(chunk)
+            
+            if file_size > settings.MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Maximum size is {settings.MAX_FILE_SIZE / (1024 * 1024)}MB"
+                )
+        
+        task_upload_dir = os.path.join(settings.UPLOAD_DIR, task_id)
+        os.makedirs(task_upload_dir, exist_ok=True)
+        
+        # 保存上传的文件
+        file_path = os.path.join(task_upload_dir, file.filename)
+        with open(file_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        
+        logger.info(f"File uploaded: {file.filename}, task ID: {task_id}")
+        
+        return await submit_task(task_id, file_path, file.filename, stages)
+    except BaseException:
+        if idempotency_key:
+            await asyncio.to_thread(release_idempotency_key, idempotency_key)
+        raise
+
+async def submit_task(task_id: str, file_path: str, file_name: str,
+                      postprocess: Optional[List[PostprocessStage]] = None) -> TaskStatus:
+    """为已保存到上传目录的PDF创建任务：预检后交给调度器或投递到队列"""
     task_output_dir = os.path.join(settings.OUTPUT_DIR, task_id)
     os.makedirs(task_output_dir, exist_ok=True)
     
-    # 保存上传的文件
-    file_path = os.path.join(task_upload_dir, file.filename)
-    with open(file_path, "wb") as f:
-        for chunk in chunks:
-            f.write(chunk)
+    # 预检：页数、是否需要OCR和估算耗时，用于调度和限制超大文档
+    try:
+        preflight = await asyncio.to_thread(probe_pdf, file_path)
+    except ValueError as e:
+        await asyncio.to_thread(_delete_task_files, task_id)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid PDF file: {str(e)}"
+        )
     
-    logger.info(f"File uploaded: {file.filename}, task ID: {task_id}")
+    if settings.MAX_PAGES_PER_TASK and preflight.page_count and preflight.page_count > settings.MAX_PAGES_PER_TASK:
+        await asyncio.to_thread(_delete_task_files, task_id)
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many pages ({preflight.page_count}). Maximum is {settings.MAX_PAGES_PER_TASK}"
+        )
     
     # 创建任务状态
-    tasks[task_id] = TaskStatus(
+    task = TaskRecord(
         task_id=task_id,
         status="pending",
-        created_at=datetime.now()
+        preflight=preflight,
+        postprocess=postprocess
     )
     
-    # 在后台处理PDF
-    background_tasks.add_task(process_pdf, task_id, file_path)
+    if settings.EXECUTION_MODE != "broker" and settings.COALESCE_IDENTICAL_UPLOADS:
+        # 相同的文件正在排队或转换时跟随该任务，不再重复转换
+        # 后处理步骤不同的任务输出不同，不合并
+        key = f"{await asyncio.to_thread(file_sha256, file_path)}:{file_name}"
+        if postprocess:
+            key += ":" + json.dumps([stage.model_dump(include={"name", "options"}) for stage in postprocess], sort_keys=True)
+        if single_flight.follow(key, task, file_path, preflight.estimated_seconds):
+            return task.to_status()
+        single_flight.lead(key, task_id)
     
-    return tasks[task_id]
+    await _dispatch_task(task, file_path, file_name)
+    return task.to_status()
+
+def _enqueue_task(task: TaskRecord, file_name: str, estimated_seconds: float):
+    """保存任务状态并投递到队列，由工作进程处理"""
+    broker = get_broker()
+    broker.save_status(task.to_status())
+    broker.enqueue({
+        "task_id": task.task_id,
+        "file_name": file_name,
+        "priority": task_priority(estimated_seconds)
+    })
+
+async def _dispatch_task(task: TaskRecord, file_path: str, file_name: str):
+    """把待处理的任务交给调度器或投递到队列"""
+    estimated_seconds = task.preflight.estimated_seconds if task.preflight else 0.0
+    if settings.EXECUTION_MODE == "broker":
+        await asyncio.to_thread(_enqueue_task, task, file_name, estimated_seconds)
+    else:
+        # 交给调度器在后台处理PDF
+        tasks[task.task_id] = task
+        scheduler.submit(task.task_id, file_path, estimated_seconds)
 
-def get_task(task_id: str) -> TaskStatus:
+async def retry_task(task_id: str) -> TaskStatus:
+    """重新提交失败的任务，从最近的检查点继续转换"""
+    task = await asyncio.to_thread(get_task, task_id)
+    
+    if task.status != "failed":
+        raise HTTPException(
+            status_code=400,
+            detail="Only failed tasks can be retried"
+        )
+    
+    check_queue_capacity()
+    
+    task_upload_dir = os.path.join(settings.UPLOAD_DIR, task_id)
+    original_files = [f for f in os.listdir(task_upload_dir) if f.endswith('.pdf')] if os.path.isdir(task_upload_dir) else []
+    if not original_files:
+        raise HTTPException(
+            status_code=410,
+            detail="Uploaded file is no longer available"
+        )
+    
+    task.status = "pending"
+    task.error = None
+    task.expires_at = None
+    task.retries = 0
+    task.files = None
+    await _dispatch_task(task, os.path.join(task_upload_dir, original_files[0]), original_files[0])
+    logger.info(f"Task {task_id} resubmitted for retry")
+    return task.to_status()
+
+async def cancel_task(task_id: str) -> TaskStatus:
+    """取消排队中或执行中的任务，执行中的任务被立即结束并释放并发槽位"""
+    task = await asyncio.to_thread(get_task, task_id)
+    
+    if task.status not in ("pending", "processing"):
+        raise HTTPException(
+            status_code=409,
+            detail="Task already finished"
+        )
+    
+    if settings.EXECUTION_MODE == "broker":
+        # 工作进程出队时跳过已取消的任务，执行中的任务由工作进程检查到取消标记后结束
+        broker = get_broker()
+        await asyncio.to_thread(broker.request_cancel, task_id)
+        if task.status == "pending":
+            task.status = "cancelled"
+            task.error = "Cancelled by user"
+            task.expires_at = datetime.now() + timedelta(hours=1)
+            await asyncio.to_thread(broker.save_status, task.to_status())
+    elif single_flight.detach(task_id) or scheduler.cancel_pending(task_id):
+        mark_stopped(task_id, "cancelled", "Cancelled by user")
+        notify_status(task_id)
+    elif not runner.cancel(task_id):
+        # 调度器刚取出任务，转换协程还未开始执行
+        await asyncio.sleep(0)
+        runner.cancel(task_id)
+    
+    logger.info(f"Task {task_id} cancellation requested")
+    return task.to_status()
+
+def find_task(task_id: str) -> Optional[TaskRecord]:
+    """查找任务状态，不存在时返回None"""
+    if settings.EXECUTION_MODE == "broker":
+        status = get_broker().load_status(task_id)
+        return TaskRecord.from_status(status) if status else None
+    return tasks.get(task_id)
+
+def get_task_statuses(task_ids: List[str]) -> BulkStatusResponse:
+    """批量查询任务状态，按请求的顺序返回，不存在的任务ID放在missing中"""
+    if len(task_ids) > settings.MAX_BULK_STATUS_IDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many task ids. Maximum is {settings.MAX_BULK_STATUS_IDS}"
+        )
+    
+    if settings.EXECUTION_MODE == "broker":
+        found = {task.task_id: task for task in get_broker().load_statuses(list(dict.fromkeys(task_ids)))}
+    else:
+        found = {}
+        for task_id in task_ids:
+            task = tasks.get(task_id)
+            if task is not None:
+                found[task_id] = task.to_status()
+    return BulkStatusResponse(
+        tasks=[found[task_id] for task_id in task_ids if task_id in found],
+        missing=[task_id for task_id in task_ids if task_id not in found]
+    )
+
+def _encode_cursor(task) -> str:
+    return f"{task.created_at.isoformat()}|{task.task_id}"
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, task_id = cursor.split("|", 1)
+        return datetime.fromisoformat(created_at), task_id
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid cursor"
+        )
+
+def list_tasks(status: Optional[str] = None, since: Optional[datetime] = None,
+               cursor: Optional[str] = None, limit: int = 100) -> TaskList:
+    """按创建时间分页列出任务，可按状态和创建时间筛选"""
+    if since is not None and since.tzinfo is not None:
+        # 任务的创建时间为本地时间
+        since = since.astimezone().replace(tzinfo=None)
+    after = _decode_cursor(cursor) if cursor else None
+    
+    # 多取一个任务判断是否还有下一页
+    if settings.EXECUTION_MODE == "broker":
+        page = get_broker().query_statuses(status, since, after, limit + 1)
+    else:
+        page = [task.to_status() for task in select_tasks(list(tasks.values()), status, since, after, limit + 1)]
+    
+    next_cursor = _encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return TaskList(tasks=page[:limit], next_cursor=next_cursor)
+
+def get_task(task_id: str) -> TaskRecord:
     """获取任务状态"""
-    if task_id not in tasks:
+    task = find_task(task_id)
+    if task is None:
         raise HTTPException(
             status_code=404,
             detail="Task not found"
         )
-    return tasks[task_id]
+    return task
+
+def markdown_file_name(task: TaskRecord) -> Optional[str]:
+    """任务的Markdown输出文件名，转换完成前根据上传的文件名推算"""
+    for file_name in task.files or []:
+        if file_name.endswith(".md"):
+            return file_name
+    task_upload_dir = os.path.join(settings.UPLOAD_DIR, task.task_id)
+    if os.path.isdir(task_upload_dir):
+        for file_name in os.listdir(task_upload_dir):
+            if file_name.endswith(".pdf"):
+                return f"{file_name.split('.')[0]}.md"
+    return None
+
+def _read_chunk(path: str, position: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(position)
+        return f.read(STREAM_CHUNK_SIZE)
+
+def markdown_rewritten(task: TaskRecord) -> bool:
+    """转换写出的Markdown之后是否还会被改写（图片后处理替换图片文件名，后处理步骤替换链接或整理格式）"""
+    return settings.IMAGE_POSTPROCESS or bool(task.postprocess)
+
+async def iter_markdown(task_id: str, md_name: str, offset: int = 0):
+    """从offset开始输出任务的Markdown，转换进行中时持续输出新追加的内容，直到任务结束
+
+    Markdown在转换后还会被改写时，已输出的内容与最终文件不一致，等任务完成后才输出。
+    """
+    storage = get_storage()
+    local_path = os.path.join(storage.work_dir(task_id), md_name)
+    position = offset
+    while True:
+        # 先取状态再读文件，任务结束前写入的内容一定能读到
+        task = await asyncio.to_thread(find_task, task_id)
+        finished = task is None or task.status not in ("pending", "processing")
+        
+        if task is not None and task.status != "completed" and markdown_rewritten(task):
+            if finished:
+                return
+            await asyncio.sleep(settings.STREAM_POLL_INTERVAL)
+            continue
+        
+        if os.path.isfile(local_path):
+            chunk = await asyncio.to_thread(_read_chunk, local_path, position)
+            if chunk:
+                position += len(chunk)
+                yield chunk
+                continue
+        elif finished and task is not None and task.status == "completed":
+            # 输出已发布到对象存储或压缩保存，剩余部分从存储后端读取
+            with closing(await asyncio.to_thread(open_output, storage, task_id, md_name)) as src:
+                skipped = 0
+                while True:
+                    chunk = await asyncio.to_thread(src.read, STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if skipped < position:
+                        drop = min(position - skipped, len(chunk))
+                        skipped += drop
+                        chunk = chunk[drop:]
+                    if chunk:
+                        yield chunk
+            return
+        
+        if finished:
+            return
+        await asyncio.sleep(settings.STREAM_POLL_INTERVAL)
+
+def _add_to_zip(zipf: zipfile.ZipFile, storage, task_id: str, rel_path: str):
+    """从存储后端流式读取文件写入ZIP，压缩保存的文件直接复用已压缩的数据"""
+    stored = stored_file(storage, task_id, rel_path)
+    if stored is None:
+        return
+    stored_path, compressed = stored
+    if compressed and write_precompressed(zipf, storage, task_id, stored_path, rel_path):
+        return
+    with closing(open_output(storage, task_id, rel_path)) as src, zipf.open(rel_path, 'w', force_zip64=True) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+def _write_zip(zip_path: str, task_id: str, files: List[str]):
+    """把任务的输出文件和图片目录写入ZIP"""
+    storage = get_storage()
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        # 添加所有文件到ZIP
+        for file_name in files:
+            _add_to_zip(zipf, storage, task_id, file_name)
+        
+        # 添加图片目录（如果存在）
+        for rel_path in storage.list_files(task_id, "images/"):
+            _add_to_zip(zipf, storage, task_id, rel_path)
 
 async def create_zip_archive(task_id: str) -> tuple:
     """为任务创建ZIP压缩包"""
-    if task_id not in tasks:
-        raise HTTPException(
-            status_code=404,
-            detail="Task not found"
-        )
+    task = await asyncio.to_thread(get_task, task_id)
         
-    if tasks[task_id].status != "completed":
+    if task.status != "completed":
         raise HTTPException(
             status_code=400,
             detail="Task not completed"
         )
     
-    if not tasks[task_id].files:
+    if not task.files:
         raise HTTPException(
             status_code=400,
             detail="No files available for download"
@@ -133,26 +495,9 @@ async def create_zip_archive(task_id: str) -> tuple:
     with NamedTemporaryFile(delete=False, suffix=".zip") as tmp_file:
         zip_path = tmp_file.name
     
-    # 创建ZIP文件
+    # 创建ZIP文件（对象存储的读取是同步请求，在线程中执行）
     try:
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            task_dir = os.path.join(settings.OUTPUT_DIR, task_id)
-            
-            # 添加所有文件到ZIP
-            for file_name in tasks[task_id].files:
-                file_path = os.path.join(task_dir, file_name)
-                if os.path.exists(file_path):
-                    zipf.write(file_path, file_name)
-            
-            # 添加图片目录（如果存在）
-            images_dir = os.path.join(task_dir, "images")
-            if os.path.exists(images_dir) and os.path.isdir(images_dir):
-                for root, _, files in os.walk(images_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        # 计算相对于task_dir的路径
-                        rel_path = os.path.relpath(file_path, task_dir)
-                        zipf.write(file_path, rel_path)
+        await asyncio.to_thread(_write_zip, zip_path, task_id, task.files)
         
         # 获取原始PDF文件名（不含扩展名）作为ZIP文件名的一部分
         original_files = [f for f in os.listdir(os.path.join(settings.UPLOAD_DIR, task_id)) if f.endswith('.pdf')]
@@ -0,0 +1,59 @@
+import os
+import sys
+import logging
+import threading
+
+from app.core.config import settings
+
+logger = logging.getLogger("mineru-api")
+
+# 在初始化时读取线程数的推理库（OpenMP、MKL、OpenBLAS，以及随后创建的ONNX Runtime会话）
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+def available_cores() -> int:
+    """转换可用的CPU核数，THREAD_BUDGET_CORES为0时按本进程的CPU亲和性计算"""
+    if settings.THREAD_BUDGET_CORES > 0:
+        return settings.THREAD_BUDGET_CORES
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def thread_share(active: int) -> int:
+    """active个转换同时执行时每个转换分到的线程数"""
+    return max(1, available_cores() // max(1, active))
+
+def set_thread_limit(threads: int):
+    """设置本进程推理库的线程数：已加载的torch和OpenCV立即生效，其余库在初始化时读取环境变量"""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+    cv2 = sys.modules.get("cv2")
+    if cv2 is not None:
+        cv2.setNumThreads(threads)
+
+class ThreadBudget:
+    """把CPU核数分给同时执行的转换，避免每个转换的推理库都按全部核数启动线程
+
+    线程模式下所有转换在同一进程中，按正在执行的任务数平均分配；进程模式下父进程在任务开始和结束时
+    把份额写入每个子进程的共享内存。转换线程在每次推理前调用apply，份额变化时重新设置线程数。
+    """
+
+    def __init__(self):
+        self.shared = None  # 进程模式下由父进程写入的线程数
+        # torch的OpenMP线程数按调用线程生效，每个转换线程分别记录
+        self._local = threading.local()
+
+    def apply(self, active: int):
+        """按当前份额设置调用线程的推理线程数，active为本进程中正在执行的转换数"""
+        if not settings.THREAD_BUDGET:
+            return
+        threads = self.shared.value if self.shared is not None else thread_share(active)
+        if threads > 0 and threads != getattr(self._local, "threads", None):
+            set_thread_limit(threads)
+            self._local.threads = threads
+            logger.debug(f"Inference threads set to {threads} ({active} active conversions)")
+
+# 全局线程预算
+thread_budget = ThreadBudget()
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+from collections import defaultdict
+from fastapi import HTTPException, Request
+
+from app.core.config import settings
+from app.models.task import TaskStatus
+from app.models.upload import UploadCreate, UploadSession
+from app.services.task_service import find_task, submit_task, check_queue_capacity
+from app.services.drain_service import drain_state
+
+logger = logging.getLogger("mineru-api")
+
+# 上传会话的元数据文件，与分块写入的PDF放在同一个上传目录中，完成后删除
+UPLOAD_META_FILE = ".upload.json"
+# 分块数据累积到这么多字节再写入磁盘
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# 同一上传会话的分块按顺序写入
+_upload_locks = defaultdict(asyncio.Lock)
+
+def _meta_path(upload_id: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, upload_id, UPLOAD_META_FILE)
+
+def _load_session(upload_id: str) -> UploadSession:
+    """读取上传会话，偏移量即已写入文件的大小，API重启或换节点后仍可续传"""
+    try:
+        with open(_meta_path(upload_id), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(
+            status_code=404,
+            detail="Upload not found"
+        )
+    data_path = os.path.join(settings.UPLOAD_DIR, upload_id, meta["file_name"])
+    offset = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+    return UploadSession(upload_id=upload_id, offset=offset, **meta)
+
+def sweep_stale_uploads():
+    """删除超过UPLOAD_SESSION_EXPIRY_HOURS没有新数据的未完成上传"""
+    cutoff = time.time() - settings.UPLOAD_SESSION_EXPIRY_HOURS * 3600
+    with os.scandir(settings.UPLOAD_DIR) as entries:
+        for entry in entries:
+            meta_path = os.path.join(entry.path, UPLOAD_META_FILE)
+            if not entry.is_dir() or not os.path.exists(meta_path):
+                continue
+            try:
+                last_activity = max(os.path.getmtime(os.path.join(entry.path, name)) for name in os.listdir(entry.path))
+            except (OSError, ValueError):
+                # 目录正在被完成或删除
+                continue
+            if last_activity < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                _upload_locks.pop(entry.name, None)
+                logger.info(f"Removed stale upload {entry.name}")
+
+def _create_session_files(upload_id: str, file_name: str, length: int):
+    """创建空的上传文件和会话元数据"""
+    upload_dir = os.path.join(settings.UPLOAD_DIR, upload_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    open(os.path.join(upload_dir, file_name), "wb").close()
+    with open(_meta_path(upload_id), "w", encoding="utf-8") as f:
+        json.dump({"file_name": file_name, "length": length}, f)
+
+async def create_upload(request: UploadCreate) -> UploadSession:
+    """创建可续传的上传会话"""
+    drain_state.check_accepting()
+    file_name = os.path.basename(request.file_name)
+    if not file_name.endswith('.pdf'):
+        raise HTTPException(
+            status_code=400,
+            detail="Only PDF files are supported"
+        )
+    
+    if request.length <= 0 or request.length > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size is {settings.MAX_FILE_SIZE / (1024 * 1024)}MB"
+        )
+    
+    await asyncio.to_thread(sweep_stale_uploads)
+    
+    upload_id = str(uuid.uuid4())
+    await asyncio.to_thread(_create_session_files, upload_id, file_name, request.length)
+    
+    logger.info(f"Upload created: {file_name}, {request.length} bytes, upload ID: {upload_id}")
+    return UploadSession(upload_id=upload_id, file_name=file_name, offset=0, length=request.length)
+
+def get_upload(upload_id: str) -> UploadSession:
+    """获取上传进度"""
+    return _load_session(upload_id)
+
+def _write_chunk(path: str, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+
+async def append_chunk(upload_id: str, offset: int, request: Request) -> UploadSession:
+    """把请求体追加到上传文件，offset必须等于已接收的字节数"""
+    async with _upload_locks[upload_id]:
+        session = await asyncio.to_thread(_load_session, upload_id)
+        if offset != session.offset:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload offset mismatch, expected {session.offset}",
+                headers={"Upload-Offset": str(session.offset)}
+            )
+        
+        data_path = os.path.join(settings.UPLOAD_DIR, upload_id, session.file_name)
+        received = session.offset
+        buffer = bytearray()
+        # 连接中断时已写入的数据保留，客户端通过HEAD查询偏移量后续传
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > session.length:
+                await asyncio.to_thread(os.truncate, data_path, session.offset)
+                raise HTTPException(
+                    status_code=413,
+                    detail="Chunk exceeds declared upload length"
+                )
+            buffer.extend(chunk)
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                await asyncio.to_thread(_write_chunk, data_path, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(_write_chunk, data_path, bytes(buffer))
+        
+        session.offset = received
+        return session
+
+async def finalize_upload(upload_id: str) -> TaskStatus:
+    """上传完成后创建转换任务，重复调用返回同一个任务"""
+    async with _upload_locks[upload_id]:
+        task = await asyncio.to_thread(find_task, upload_id)
+        if task is not None:
+            return task.to_status()
+        
+        session = await asyncio.to_thread(_load_session, upload_id)
+        if session.offset != session.length:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload incomplete, received {session.offset} of {session.length} bytes",
+                headers={"Upload-Offset": str(session.offset)}
+            )
+        
+        check_queue_capacity()
+        # 文件已在上传目录中，直接以上传ID作为任务ID
+        await asyncio.to_thread(os.remove, _meta_path(upload_id))
+        logger.info(f"Upload {upload_id} finalized, creating task")
+        task = await submit_task(upload_id, os.path.join(settings.UPLOAD_DIR, upload_id, session.file_name), session.file_name)
+    _upload_locks.pop(upload_id, None)
+    return task
@@ -0,0 +1,213 @@
+import os
+import signal
+import socket
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import settings
+from app.models.task import TaskRecord, TaskStatus
+from app.services.pdf_service import tasks, status_listeners, notify_status, mark_stopped, postprocess_pending
+from app.services.broker_service import Broker, get_broker
+from app.services.expiry_service import expiry_queue
+from app.services.runner_service import runner
+from app.services.task_service import cleanup_expired_tasks
+
+logger = logging.getLogger("mineru-api")
+
+class StatusWriter:
+    """状态监听者，把任务状态写回队列，所有写入在一个专用线程中按提交顺序执行
+
+    进程模式下状态回报、取消和超时在事件循环中调用notify_status，此时只提交写入不等待，
+    避免SQLite/Redis写入阻塞事件循环；在转换线程中调用时等待写入完成。
+    """
+
+    def __init__(self, broker: Broker):
+        self.broker = broker
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="status-writer")
+
+    def __call__(self, status: TaskStatus):
+        future = self._executor.submit(self._save, status)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            future.result()
+
+    def _save(self, status: TaskStatus):
+        try:
+            self.broker.save_status(status)
+        except Exception as e:
+            logger.error(f"Failed to save status of task {status.task_id}: {str(e)}", exc_info=True)
+
+    async def flush(self):
+        """等待已提交的状态写入完成"""
+        await asyncio.wrap_future(self._executor.submit(lambda: None))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+async def watch_cancel(broker: Broker, task_id: str):
+    """轮询取消标记，API节点请求取消时结束正在执行的任务"""
+    while True:
+        await asyncio.sleep(settings.WORKER_POLL_INTERVAL)
+        if await asyncio.to_thread(broker.cancel_requested, task_id):
+            runner.cancel(task_id)
+            return
+
+async def keep_lease(broker: Broker, job: dict):
+    """执行期间定期续约，避免任务被当作崩溃工作进程遗留的任务放回队列"""
+    while True:
+        await asyncio.sleep(settings.BROKER_LEASE_SECONDS / 3)
+        try:
+            await asyncio.to_thread(broker.renew, job)
+        except Exception as e:
+            logger.warning(f"Failed to renew lease of task {job['task_id']}: {str(e)}")
+
+async def reclaim_expired_jobs(broker: Broker):
+    """定期把租约过期的任务放回队列，由存活的工作进程重新执行（从检查点继续）"""
+    while True:
+        await asyncio.sleep(settings.BROKER_LEASE_SECONDS / 2)
+        try:
+            count = await asyncio.to_thread(broker.reclaim_expired)
+        except Exception as e:
+            logger.warning(f"Failed to reclaim expired jobs: {str(e)}")
+            continue
+        if count:
+            logger.warning(f"Reclaimed {count} jobs whose worker stopped renewing its lease")
+
+async def release_job(broker: Broker, writer: StatusWriter, job: dict, *keepers: asyncio.Task):
+    """停止任务的取消监听和续约，最终状态写回队列后，被中断的任务放回队列，其余任务确认完成"""
+    for keeper in keepers:
+        keeper.cancel()
+    await writer.flush()
+    if tasks[job["task_id"]].status == "pending":
+        # 工作进程退出前被中断，放回队列由其他工作进程从检查点继续
+        await asyncio.to_thread(broker.requeue, job)
+    else:
+        await asyncio.to_thread(broker.ack, job)
+
+async def postprocess_job(broker: Broker, writer: StatusWriter, job: dict, *keepers: asyncio.Task):
+    """执行转换完成的任务的后处理步骤，结束后再确认任务，期间继续续约和监听取消"""
+    try:
+        await runner.postprocess(job["task_id"])
+    finally:
+        await release_job(broker, writer, job, *keepers)
+
+async def run_job(broker: Broker, writer: StatusWriter, job: dict, postprocessing: dict):
+    """执行队列中的一个转换任务，后处理步骤交给postprocessing中的协程执行，不占用转换槽位"""
+    task_id = job["task_id"]
+    task = await asyncio.to_thread(broker.load_status, task_id)
+    if task is None:
+        logger.warning(f"Task {task_id} no longer exists, skipping")
+        await asyncio.to_thread(broker.ack, job)
+        return
+    
+    if task.status in ("completed", "failed"):
+        # 上一个工作进程已执行完毕，但在ack之前退出，任务被重新放回了队列
+        logger.info(f"Task {task_id} already {task.status}, skipping")
+        await asyncio.to_thread(broker.ack, job)
+        return
+    
+    task = tasks[task_id] = TaskRecord.from_status(task)
+    if await asyncio.to_thread(broker.cancel_requested, task_id):
+        # 排队期间已被取消
+        logger.info(f"Task {task_id} was cancelled before it started, skipping")
+        if task.status != "cancelled":
+            mark_stopped(task_id, "cancelled", "Cancelled by user")
+            notify_status(task_id)
+            await writer.flush()
+        elif task.expires_at:
+            expiry_queue.schedule(task_id, task.expires_at)
+        await asyncio.to_thread(broker.ack, job)
+        return
+    
+    pdf_path = os.path.join(settings.UPLOAD_DIR, task_id, job["file_name"])
+    watcher = asyncio.create_task(watch_cancel(broker, task_id))
+    lease_keeper = asyncio.create_task(keep_lease(broker, job))
+    handed_off = False
+    try:
+        # 转换在线程或子进程中执行，工作进程的事件循环仍可处理过期清理和取消
+        await runner.run(task_id, pdf_path)
+        if postprocess_pending(task_id):
+            finisher = asyncio.create_task(postprocess_job(broker, writer, job, watcher, lease_keeper))
+            postprocessing[finisher] = task_id
+            finisher.add_done_callback(lambda done: postprocessing.pop(done, None))
+            handed_off = True
+    finally:
+        if not handed_off:
+            await release_job(broker, writer, job, watcher, lease_keeper)
+
+async def worker_loop():
+    """从队列中持续拉取任务执行，直到进程退出"""
+    broker = get_broker()
+    worker_name = f"{socket.gethostname()}-{os.getpid()}"
+    
+    # 状态变化时写回队列，API节点从队列读取状态
+    writer = StatusWriter(broker)
+    status_listeners.append(writer)
+    
+    # 已完成任务的过期清理由工作进程负责，启动时接管队列中已有的任务
+    for task in await asyncio.to_thread(broker.list_statuses):
+        if task.expires_at:
+            tasks[task.task_id] = TaskRecord.from_status(task)
+    cleanup_task = asyncio.create_task(cleanup_expired_tasks())
+    reclaim_task = asyncio.create_task(reclaim_expired_jobs(broker))
+    
+    # 模型加载完成后再开始拉取任务，任务留在队列中由已就绪的工作进程处理
+    if settings.WARMUP_MODELS:
+        await runner.warm_up()
+    
+    # 收到SIGTERM/SIGINT后停止拉取任务并排空
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    stop_waiter = asyncio.create_task(stopping.wait())
+    
+    # 同时处理多个任务 {job_task: task_id}，转换完成后执行后处理步骤的任务 {finisher: task_id}
+    running = {}
+    postprocessing = {}
+    
+    logger.info(f"Worker {worker_name} started, broker: {settings.BROKER_URL}, concurrency: {settings.MAX_CONCURRENT_TASKS}")
+    try:
+        while not stopping.is_set():
+            if len(running) >= settings.MAX_CONCURRENT_TASKS:
+                # 等待有任务结束或收到停止信号
+                await asyncio.wait([stop_waiter, *running], return_when=asyncio.FIRST_COMPLETED)
+                continue
+            job = await asyncio.to_thread(broker.dequeue, settings.WORKER_POLL_INTERVAL)
+            if job is None:
+                continue
+            if stopping.is_set():
+                await asyncio.to_thread(broker.requeue, job)
+                break
+            logger.info(f"Worker {worker_name} picked up task {job['task_id']}")
+            job_task = asyncio.create_task(run_job(broker, writer, job, postprocessing))
+            running[job_task] = job["task_id"]
+            job_task.add_done_callback(lambda done: running.pop(done, None))
+        
+        # 等待执行中的任务完成，超时仍未完成的任务被中断并放回队列
+        if running or postprocessing:
+            logger.info(f"Worker {worker_name} draining {len(running)} running, {len(postprocessing)} post-processing tasks")
+            deadline = loop.time() + settings.SHUTDOWN_DRAIN_TIMEOUT_SECONDS
+            # 转换完成的任务会转入postprocessing，两者都为空才算排空
+            while (running or postprocessing) and loop.time() < deadline:
+                await asyncio.wait([*running, *postprocessing], timeout=deadline - loop.time(),
+                                   return_when=asyncio.FIRST_COMPLETED)
+            for task_id in [*running.values(), *postprocessing.values()]:
+                runner.cancel(task_id, "pending", None)
+            while running or postprocessing:
+                await asyncio.wait([*running, *postprocessing])
+        logger.info(f"Worker {worker_name} stopped")
+    finally:
+        stop_waiter.cancel()
+        cleanup_task.cancel()
+        reclaim_task.cancel()
+        for job_task in [*running, *postprocessing]:
+            job_task.cancel()
+        runner.shutdown()
+        writer.shutdown()
+
+def run_worker():
+    """工作进程入口"""
+    asyncio.run(worker_loop())
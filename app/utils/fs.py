@@ -0,0 +1,67 @@
+import os
+import hashlib
+
+# 磁盘缓存每写入上限的几分之一按磁盘重新统计一次总大小，多个进程合计最多超出上限的(进程数/该值)
+EVICTION_CHECK_FRACTION = 20
+
+
+def get_dir_size(path: str) -> int:
+    """递归计算目录下所有文件的总字节数"""
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        total += get_dir_size(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return total
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def evict_lru_files(root: str, suffix: str, max_bytes: int) -> int:
+    """按磁盘上的实际大小把目录中以suffix结尾的文件限制在max_bytes以内，返回删除的文件数
+
+    按修改时间从旧到新删除，最新的文件始终保留。缓存命中时更新文件的修改时间，
+    多个进程共用同一目录时也按全局的最近使用顺序淘汰，总大小不随进程数成倍增加。
+    """
+    files = []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if not entry.name.endswith(suffix):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+    except OSError:
+        return 0
+
+    total = sum(size for _, _, size in files)
+    removed = 0
+    for _, path, size in sorted(files)[:-1]:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            # 其他进程已经删除
+            pass
+        total -= size
+    return removed
@@ -0,0 +1,75 @@
+import os
+import re
+from typing import Callable, Iterator, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+def _iter_file_range(path: str, start: int, length: int, chunk_size: int = 1024 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def parse_range(request: Request, size: int) -> Optional[Tuple[int, int]]:
+    """解析单段Range请求头，返回(start, end)（包含end）；没有Range时返回None，范围无效时返回416"""
+    range_header: Optional[str] = request.headers.get("range")
+    if not range_header:
+        return None
+
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        raise HTTPException(status_code=416, detail="Invalid range", headers={"Content-Range": f"bytes */{size}"})
+
+    if match.group(1) == "":
+        # bytes=-N 表示最后N个字节
+        start = max(size - int(match.group(2)), 0)
+        end = size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def ranged_stream_response(request: Request, size: int, iter_range: Callable[[int, int], Iterator[bytes]], filename: str,
+                           media_type: str = "application/octet-stream", headers: Optional[dict] = None):
+    """返回按需生成的内容，支持单段Range请求；iter_range(start, length)输出指定范围的字节"""
+    byte_range = parse_range(request, size)
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1
+    response_headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(length),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        **(headers or {})
+    }
+    if byte_range:
+        response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        iter_range(start, length),
+        status_code=206 if byte_range else 200,
+        media_type=media_type,
+        headers=response_headers
+    )
+
+def ranged_file_response(request: Request, path: str, filename: str, media_type: str = "application/octet-stream"):
+    """返回本地文件，支持单段Range请求（断点续传、分段下载）"""
+    if not request.headers.get("range"):
+        return FileResponse(path=path, filename=filename, media_type=media_type, headers={"Accept-Ranges": "bytes"})
+
+    return ranged_stream_response(
+        request,
+        os.path.getsize(path),
+        lambda start, length: _iter_file_range(path, start, length),
+        filename,
+        media_type
+    )
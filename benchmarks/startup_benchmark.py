@@ -0,0 +1,96 @@
+"""API启动耗时基准
+
+测量两项指标：
+1. 在新的解释器中导入app.main的耗时，以及导入后是否已加载magic_pdf；
+2. 启动uvicorn后/healthz和/readyz首次返回200的耗时。
+
+用法（在项目根目录执行）:
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --serve --port 8765
+"""
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+IMPORT_SNIPPET = (
+    "import sys, time, json; start = time.perf_counter(); import app.main; "
+    "print(json.dumps({'seconds': time.perf_counter() - start, "
+    "'magic_pdf_loaded': any(name.startswith('magic_pdf') for name in sys.modules)}))"
+)
+
+def measure_import(runs: int) -> dict:
+    """在新进程中导入app.main，返回耗时的中位数和magic_pdf是否被加载"""
+    samples = []
+    magic_pdf_loaded = False
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        samples.append(result["seconds"])
+        magic_pdf_loaded = magic_pdf_loaded or result["magic_pdf_loaded"]
+    return {
+        "import_median_seconds": round(statistics.median(samples), 3),
+        "import_max_seconds": round(max(samples), 3),
+        "magic_pdf_loaded_at_import": magic_pdf_loaded
+    }
+
+def _wait_for(url: str, deadline: float) -> float:
+    """轮询url直到返回200，返回耗时，超时返回-1"""
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            pass
+        time.sleep(0.05)
+    return -1
+
+def measure_serve(port: int, timeout: float) -> dict:
+    """启动uvicorn，测量/healthz和/readyz首次返回200的耗时"""
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=PROJECT_ROOT
+    )
+    try:
+        deadline = start + timeout
+        healthz = _wait_for(f"http://127.0.0.1:{port}/healthz", deadline)
+        healthz_seconds = time.perf_counter() - start if healthz >= 0 else -1
+        readyz = _wait_for(f"http://127.0.0.1:{port}/readyz", deadline)
+        readyz_seconds = time.perf_counter() - start if readyz >= 0 else -1
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "healthz_seconds": round(healthz_seconds, 3),
+        "readyz_seconds": round(readyz_seconds, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API startup time")
+    parser.add_argument("--runs", type=int, default=5, help="导入耗时的测量次数")
+    parser.add_argument("--serve", action="store_true", help="同时测量/healthz和/readyz的就绪耗时")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=600, help="等待/readyz的最长时间（秒）")
+    args = parser.parse_args()
+    
+    result = measure_import(args.runs)
+    if args.serve:
+        result.update(measure_serve(args.port, args.timeout))
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
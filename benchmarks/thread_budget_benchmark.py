@@ -0,0 +1,109 @@
+"""并发转换吞吐基准
+
+对每个并发数分别启动一次API（MAX_CONCURRENT_TASKS=并发数），开启和关闭THREAD_BUDGET各测一次：
+等/readyz就绪（模型已加载）后同时提交 并发数×--rounds 份样例PDF，统计全部完成的耗时，
+输出总吞吐（页/秒）。栅格缓存被关闭，避免相同文件之间复用渲染结果。
+
+用法（在项目根目录执行）:
+    python benchmarks/thread_budget_benchmark.py --pdf sample.pdf --concurrency 1 2 4 5
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+
+import fitz
+import requests
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+def wait_ready(base_url: str, timeout: float):
+    """等待/readyz返回200"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError("Server did not become ready")
+
+def run_batch(base_url: str, pdf_path: str, documents: int, timeout: float) -> float:
+    """同时提交documents份PDF，返回从提交到全部完成的耗时"""
+    start = time.perf_counter()
+    task_ids = []
+    for _ in range(documents):
+        with open(pdf_path, "rb") as f:
+            response = requests.post(f"{base_url}/convert/", files={"file": (os.path.basename(pdf_path), f, "application/pdf")})
+        response.raise_for_status()
+        task_ids.append(response.json()["task_id"])
+
+    deadline = start + timeout
+    while time.perf_counter() < deadline:
+        statuses = requests.post(f"{base_url}/status/bulk", json={"task_ids": task_ids}).json()["tasks"]
+        failed = [status for status in statuses if status["status"] in ("failed", "cancelled")]
+        if failed:
+            raise RuntimeError(f"Conversion failed: {failed[0]['error']}")
+        if all(status["status"] == "completed" for status in statuses):
+            return time.perf_counter() - start
+        time.sleep(0.5)
+    raise TimeoutError("Conversions did not finish")
+
+def measure(pdf_path: str, page_count: int, concurrency: int, thread_budget: bool, args) -> dict:
+    """按给定并发数和线程预算开关启动API并测量吞吐"""
+    env = dict(
+        os.environ,
+        MAX_CONCURRENT_TASKS=str(concurrency),
+        THREAD_BUDGET=str(thread_budget).lower(),
+        WARMUP_MODELS="true",
+        RASTER_CACHE_MAX_BYTES="0",
+        PAGE_RESULT_CACHE_MAX_BYTES="0",
+        MICRO_BATCH_WINDOW_MS="0",
+        # 重复提交同一个PDF，关闭缓存和合并，每个任务都实际推理
+        COALESCE_IDENTICAL_UPLOADS="false"
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=PROJECT_ROOT, env=env
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url, args.timeout)
+        documents = concurrency * args.rounds
+        seconds = run_batch(base_url, pdf_path, documents, args.timeout)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "concurrency": concurrency,
+        "thread_budget": thread_budget,
+        "documents": documents,
+        "seconds": round(seconds, 2),
+        "pages_per_second": round(documents * page_count / seconds, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure aggregate conversion throughput at different concurrency levels")
+    parser.add_argument("--pdf", required=True, help="样例PDF")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rounds", type=int, default=2, help="每个并发槽位转换的文档数")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=1800, help="模型加载和每轮转换的最长等待时间（秒）")
+    args = parser.parse_args()
+
+    with fitz.open(args.pdf) as doc:
+        page_count = doc.page_count
+
+    results = []
+    for concurrency in args.concurrency:
+        for thread_budget in (False, True):
+            result = measure(os.path.abspath(args.pdf), page_count, concurrency, thread_budget, args)
+            print(json.dumps(result), flush=True)
+            results.append(result)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
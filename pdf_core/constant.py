@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 # 服务器URL相关常量
 API_URL = "http://123.157.247.187:31000"  # MinerU 服务地址
 IMAGES_API_URL = "http://123.157.247.187:31002/api/images/upload"  # 图片上传服务地址
@@ -16,6 +19,17 @@ DEFAULT_MAX_CHUNK_SIZE = 102400  # 默认文本块最大字符数
 DEFAULT_TEMPERATURE = 0.3  # 默认温度参数
 DEFAULT_MAX_TOKENS = 1024 * 100  # 默认最大生成token数
 
+# 结果处理相关常量
+ZIP_STREAMING_PIPELINE = True  # 只解压Markdown和图片，其余ZIP成员按原始压缩数据直接复制，不落盘、不重新压缩
+
+# 服务端后处理相关常量（PDF转换完成后由API服务执行的步骤及其显示名称）
+POSTPROCESS_STAGE_LABELS = {"image_host": "图片处理", "llm_cleanup": "AI优化", "kb_push": "知识库上传"}
+
+# 临时工作区相关常量
+WORKSPACE_ROOT = os.path.join(tempfile.gettempdir(), "mineru_web_workspaces")  # 所有任务工作区的根目录
+WORKSPACE_QUOTA_BYTES = 5 * 1024 * 1024 * 1024  # 已完成工作区的总字节上限（5GB）
+WORKSPACE_MAX_FINISHED = 50  # 最多保留的已完成工作区数量，超出后按LRU删除
+
 # UI相关常量
 # 自定义CSS样式
 CUSTOM_CSS = """
@@ -3,9 +3,11 @@ import json
 import os
 import re
 import shutil
+import struct
 import subprocess
 import tempfile
 import zipfile
+import zlib
 
 import requests
 
@@ -156,8 +158,9 @@ def replace_image_links_in_file(file_path, replacements):
         shutil.copy2(backup_path, file_path)
         return False
     finally:
-        # 保留备份文件，以防需要手动恢复
-        pass
+        # 写入完成或已恢复后备份不再需要，避免在工作区中堆积
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
 
 
 def process_markdown_images(markdown_file, extract_dir):
@@ -247,7 +250,7 @@ def process_markdown_images(markdown_file, extract_dir):
             success = replace_image_links_in_file(markdown_file, replacements)
 
             if success:
-                logger.info("替换完成! 原文件已备份为 .bak 文件")
+                logger.info("替换完成!")
             else:
                 logger.error("替换失败! 已恢复原文件")
                 return False, {"图片链接": len(image_links_by_line), "上传成功": success_count, "上传失败": fail_count}
@@ -305,12 +308,28 @@ def process_all_markdown_files(extract_dir, markdown_files):
     return all_success, total_stats
 
 
-def extract_and_find_markdown_files(zip_path):
+def is_needed_member(member_name):
+    """
+    判断ZIP成员是否为后处理需要的文件（Markdown或images目录下的图片）
+
+    Args:
+        member_name: ZIP成员名称
+
+    Returns:
+        bool: 是否需要解压
+    """
+    name = member_name.lower()
+    return name.endswith('.md') or '/images/' in f"/{name}"
+
+
+def extract_and_find_markdown_files(zip_path, needed_only=False, extract_dir=None):
     """
     解压ZIP文件并查找其中的Markdown文件和images目录
 
     Args:
         zip_path: ZIP文件路径
+        needed_only: 为True时只解压Markdown和图片，跳过调试PDF、JSON等大文件
+        extract_dir: 解压目录（通常位于任务工作区内），默认新建临时目录
 
     Returns:
         tuple: (temp_extract_dir, markdown_files, images_dirs)
@@ -319,13 +338,22 @@ def extract_and_find_markdown_files(zip_path):
             images_dirs: images目录路径列表
     """
     # 创建临时目录用于解压
-    temp_extract_dir = tempfile.mkdtemp()
+    if extract_dir:
+        os.makedirs(extract_dir, exist_ok=True)
+        temp_extract_dir = extract_dir
+    else:
+        temp_extract_dir = tempfile.mkdtemp()
 
     try:
         # 解压ZIP文件
         logger.info(f"正在解压文件: {zip_path}")
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_extract_dir)
+            if needed_only:
+                members = [name for name in zip_ref.namelist() if is_needed_member(name)]
+                logger.info(f"仅解压需要的 {len(members)}/{len(zip_ref.namelist())} 个成员")
+                zip_ref.extractall(temp_extract_dir, members=members)
+            else:
+                zip_ref.extractall(temp_extract_dir)
 
         # 查找所有Markdown文件
         markdown_files = []
@@ -401,6 +429,135 @@ def create_new_zip_with_processed_files(original_zip_path, processed_dir):
     return new_zip_path
 
 
+def copy_zip_member_raw(src_zip, dst_zip, info, arcname=None):
+    """
+    将ZIP成员的原始压缩数据直接复制到另一个ZIP中，不解压也不重新压缩
+
+    zipfile没有公开的原始复制接口，这里直接读取源文件的本地文件头定位压缩数据，
+    再按zipfile写入成员时的方式追加到目标ZIP（目标ZIP必须以'w'模式打开且可seek）。
+
+    Args:
+        src_zip: 以'r'模式打开的源ZipFile
+        dst_zip: 以'w'模式打开的目标ZipFile
+        info: 源成员的ZipInfo
+        arcname: 目标中的成员名称，默认与源成员相同
+    """
+    src_fp = src_zip.fp
+    src_fp.seek(info.header_offset)
+    header = src_fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"成员本地文件头损坏: {info.filename}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    src_fp.seek(info.header_offset + zipfile.sizeFileHeader + name_len + extra_len)
+
+    new_info = zipfile.ZipInfo(arcname or info.filename, info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.CRC = info.CRC
+    new_info.compress_size = info.compress_size
+    new_info.file_size = info.file_size
+    new_info.external_attr = info.external_attr
+    new_info.create_system = info.create_system
+    # 大小和CRC已写入本地文件头，不再需要数据描述符
+    new_info.flag_bits = info.flag_bits & ~0x08
+
+    with dst_zip._lock:
+        dst_zip.fp.seek(dst_zip.start_dir)
+        new_info.header_offset = dst_zip.fp.tell()
+        zip64 = new_info.file_size > zipfile.ZIP64_LIMIT or new_info.compress_size > zipfile.ZIP64_LIMIT
+        dst_zip.fp.write(new_info.FileHeader(zip64))
+
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = src_fp.read(min(1024 * 1024, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"成员数据不完整: {info.filename}")
+            dst_zip.fp.write(chunk)
+            remaining -= len(chunk)
+
+        dst_zip.start_dir = dst_zip.fp.tell()
+        dst_zip.filelist.append(new_info)
+        dst_zip.NameToInfo[new_info.filename] = new_info
+        dst_zip._didModify = True
+
+
+def file_crc32(file_path):
+    """
+    流式计算文件的CRC32
+
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        int: CRC32值
+    """
+    crc = 0
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def rewrite_zip_with_processed_files(original_zip_path, processed_dir):
+    """
+    以原始ZIP为基础流式重写出新的ZIP：处理过的文件重新压缩写入，其余成员直接复制原始压缩数据
+
+    与create_new_zip_with_processed_files不同，这里不要求processed_dir包含完整解压内容，
+    配合extract_and_find_markdown_files(needed_only=True)使用。
+
+    Args:
+        original_zip_path: 原始ZIP文件路径
+        processed_dir: 处理后的文件目录（只需包含被解压出来的成员）
+
+    Returns:
+        str: 新ZIP文件路径
+    """
+    new_zip_path = original_zip_path.replace('.zip', '_processed.zip')
+    logger.info(f"流式重写ZIP文件: {new_zip_path}")
+
+    copied_count = 0
+    rewritten_count = 0
+    with zipfile.ZipFile(original_zip_path, 'r') as src, \
+            zipfile.ZipFile(new_zip_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for info in src.infolist():
+            local_path = os.path.join(processed_dir, *info.filename.split('/'))
+            changed = (not info.is_dir() and os.path.isfile(local_path)
+                       and (os.path.getsize(local_path) != info.file_size
+                            or file_crc32(local_path) != info.CRC))
+            if changed:
+                logger.info(f"写入处理后的文件: {info.filename}")
+                dst.write(local_path, info.filename)
+                rewritten_count += 1
+            else:
+                copy_zip_member_raw(src, dst, info)
+                copied_count += 1
+
+    logger.info(f"新ZIP文件创建完成: {new_zip_path}，重新压缩 {rewritten_count} 个，原样复制 {copied_count} 个")
+    return new_zip_path
+
+
+def merge_zip_files(zip_entries, output_path):
+    """
+    将多个ZIP合并为一个，每个ZIP的成员放在各自的前缀目录下，成员数据原样复制
+
+    Args:
+        zip_entries: [(前缀目录, ZIP文件路径), ...]
+        output_path: 合并后的ZIP文件路径
+
+    Returns:
+        str: 合并后的ZIP文件路径
+    """
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for prefix, zip_path in zip_entries:
+            with zipfile.ZipFile(zip_path, 'r') as src:
+                for info in src.infolist():
+                    arcname = f"{prefix}/{info.filename}"
+                    logger.info(f"添加文件到合并ZIP: {arcname}")
+                    copy_zip_member_raw(src, dst, info, arcname)
+
+    logger.info(f"合并ZIP文件创建完成: {output_path}，包含 {len(zip_entries)} 个结果")
+    return output_path
+
+
 def upload_files_to_dataset(file_paths, dataset_id, api_key=None):
     """
     向指定的数据集上传多个文件并解析
@@ -561,6 +718,7 @@ def process_markdown_with_ai(markdown_file, ai_processor):
     Returns:
         bool: 是否成功处理
     """
+    backup_path = f"{markdown_file}.original"
     try:
         logger.info(f"使用AI处理Markdown文件: {markdown_file}")
 
@@ -569,7 +727,6 @@ def process_markdown_with_ai(markdown_file, ai_processor):
             content = file.read()
 
         # 创建备份
-        backup_path = f"{markdown_file}.original"
         if not os.path.exists(backup_path):
             logger.info(f"创建原始文件备份: {backup_path}")
             shutil.copy2(markdown_file, backup_path)
@@ -591,7 +748,14 @@ def process_markdown_with_ai(markdown_file, ai_processor):
 
     except Exception as e:
         logger.exception(f"AI处理Markdown文件时出错: {e}")
+        # 写入中途失败时恢复原文
+        if os.path.exists(backup_path):
+            shutil.copy2(backup_path, markdown_file)
         return False
+    finally:
+        # 仅在写入过程中防止原文丢失，处理结束后删除备份
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
 
 
 def process_all_markdown_files_with_ai(markdown_files, ai_base_url=AI_API_BASE_URL,
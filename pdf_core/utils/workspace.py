@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from utils.Logger import logger
+from constant import WORKSPACE_ROOT, WORKSPACE_QUOTA_BYTES, WORKSPACE_MAX_FINISHED
+
+
+class WorkspaceManager:
+    """任务临时工作区管理类
+
+    每个任务在根目录下拥有独立的工作区。任务结束后工作区进入已完成队列，
+    结果ZIP仍可供Gradio下载；已完成工作区的总大小或数量超出上限时按LRU删除最旧的工作区。
+    """
+
+    def __init__(self, root: str = WORKSPACE_ROOT, quota_bytes: int = WORKSPACE_QUOTA_BYTES,
+                 max_finished: int = WORKSPACE_MAX_FINISHED):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._active = set()
+        self._finished = OrderedDict()  # {工作区路径: 字节数}，按完成时间排序
+        os.makedirs(self.root, exist_ok=True)
+
+    def sweep(self):
+        """
+        清理根目录下不属于当前进程的工作区（启动时调用，清除上次运行遗留的文件）
+
+        Returns:
+            int: 删除的工作区数量
+        """
+        removed = 0
+        with self._lock:
+            known = self._active | set(self._finished)
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.path in known:
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"清理工作区失败: {entry.path}, {e}")
+        logger.info(f"工作区清理完成: {self.root}，删除 {removed} 个遗留工作区")
+        return removed
+
+    def create(self, prefix="job"):
+        """
+        创建新的工作区
+
+        Args:
+            prefix: 工作区目录名前缀
+
+        Returns:
+            str: 工作区路径
+        """
+        path = tempfile.mkdtemp(prefix=f"{prefix}_", dir=self.root)
+        with self._lock:
+            self._active.add(path)
+        logger.info(f"创建工作区: {path}")
+        return path
+
+    def release(self, path):
+        """
+        标记工作区已完成，删除其中的备份文件，并按配额淘汰旧工作区
+
+        Args:
+            path: 工作区路径
+        """
+        size = 0
+        for root, _, files in os.walk(path):
+            for file in files:
+                file_path = os.path.join(root, file)
+                try:
+                    if file.endswith('.bak') or file.endswith('.original'):
+                        os.remove(file_path)
+                    else:
+                        size += os.path.getsize(file_path)
+                except OSError:
+                    pass
+
+        with self._lock:
+            self._active.discard(path)
+            self._finished[path] = size
+            self._finished.move_to_end(path)
+            evicted = self._pop_over_quota()
+
+        for old_path in evicted:
+            shutil.rmtree(old_path, ignore_errors=True)
+            logger.info(f"淘汰已完成的工作区: {old_path}")
+
+    def _pop_over_quota(self):
+        """弹出超出配额的最旧工作区（调用方需持有锁），最新完成的工作区始终保留"""
+        evicted = []
+        total = sum(self._finished.values())
+        while len(self._finished) > 1 and (total > self.quota_bytes or len(self._finished) > self.max_finished):
+            old_path, old_size = self._finished.popitem(last=False)
+            total -= old_size
+            evicted.append(old_path)
+        return evicted
+
+
+# 全局工作区管理器
+workspace_manager = WorkspaceManager()
@@ -2,26 +2,42 @@ import gradio as gr
 import requests
 import time
 import os
+import json
 import tempfile
 import shutil
 import zipfile
-from constant import API_URL, CUSTOM_CSS, DEFAULT_AI_MODEL, DEFAULT_MAX_CHUNK_SIZE, DEFAULT_KB_ID
+from constant import API_URL, CUSTOM_CSS, DEFAULT_AI_MODEL, DEFAULT_MAX_CHUNK_SIZE, DEFAULT_KB_ID, \
+    ZIP_STREAMING_PIPELINE, POSTPROCESS_STAGE_LABELS
 from utils.Logger import logger
+from utils.workspace import workspace_manager
 from utils.public import process_all_markdown_files, extract_and_find_markdown_files, upload_to_knowledge_base, \
-    create_new_zip_with_processed_files, process_all_markdown_files_with_ai
+    create_new_zip_with_processed_files, process_all_markdown_files_with_ai, rewrite_zip_with_processed_files, \
+    merge_zip_files
+
+
+def get_server_postprocess_stages():
+    """API服务已配置、可以在服务端执行的后处理步骤，查询失败或旧版本服务不支持时返回空集合"""
+    try:
+        response = requests.get(f"{API_URL}/capabilities", timeout=10)
+        response.raise_for_status()
+        return set(response.json().get("postprocess_stages") or [])
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"查询服务端后处理能力失败，后处理在客户端执行: {str(e)}")
+        return set()
 
 
 def process_html_file(html_file, upload_to_kb_flag, kb_id, use_ai_flag=True, ai_model=DEFAULT_AI_MODEL,
-                       max_chunk_size=DEFAULT_MAX_CHUNK_SIZE, progress=gr.Progress()):
+                       max_chunk_size=DEFAULT_MAX_CHUNK_SIZE, progress=gr.Progress(), workspace_dir=None):
     """处理HTML文件，直接转换为Markdown并处理"""
     if not html_file:
         return {"error": "❌ 请选择HTML文件"}, None
 
+    # 批量处理时使用调用方的工作区，否则单独创建工作区
+    temp_dir = tempfile.mkdtemp(prefix="html_", dir=workspace_dir) if workspace_dir else workspace_manager.create("html")
     try:
-        # 创建临时目录
+        # 准备处理
         progress(0.1, desc="📋 准备处理HTML文件...")
         logger.info(f"准备处理HTML文件: {html_file.name}")
-        temp_dir = tempfile.mkdtemp()
         
         # 创建保存HTML的临时路径
         html_temp_path = os.path.join(temp_dir, os.path.basename(html_file.name))
@@ -143,10 +159,13 @@ def process_html_file(html_file, upload_to_kb_flag, kb_id, use_ai_flag=True, ai_
     except Exception as e:
         logger.exception(f"处理出错: {str(e)}")
         return {"error": f"❌ 处理失败: {str(e)}"}, None
+    finally:
+        if not workspace_dir:
+            workspace_manager.release(temp_dir)
 
 
 def upload_and_convert_pdf(pdf_file, upload_to_kb_flag, kb_id, use_ai_flag=True, ai_model=DEFAULT_AI_MODEL,
-                           max_chunk_size=DEFAULT_MAX_CHUNK_SIZE, progress=gr.Progress()):
+                           max_chunk_size=DEFAULT_MAX_CHUNK_SIZE, progress=gr.Progress(), workspace_dir=None):
     """上传PDF/HTML文件并处理"""
     if not pdf_file:
         return {"error": "❌ 请选择文件"}, None
@@ -157,18 +176,47 @@ def upload_and_convert_pdf(pdf_file, upload_to_kb_flag, kb_id, use_ai_flag=True,
     # 如果是HTML文件，使用HTML处理流程
     if file_extension == '.html':
         logger.info(f"检测到HTML文件: {pdf_file.name}，使用HTML处理流程")
-        return process_html_file(pdf_file, upload_to_kb_flag, kb_id, use_ai_flag, ai_model, max_chunk_size, progress)
+        return process_html_file(pdf_file, upload_to_kb_flag, kb_id, use_ai_flag, ai_model, max_chunk_size, progress,
+                                 workspace_dir)
     
     # 否则按照原PDF处理流程处理
+    temp_dir = tempfile.mkdtemp(prefix="pdf_", dir=workspace_dir) if workspace_dir else workspace_manager.create("pdf")
     try:
         # 准备上传文件
         progress(0.1, desc="📋 准备上传文件...")
         logger.info(f"准备上传文件: {pdf_file.name}")
         files = {"file": (os.path.basename(pdf_file.name), open(pdf_file.name, "rb"), "application/pdf")}
 
+        # 图床、AI优化和知识库上传优先由服务端在转换完成后执行，服务端未配置的步骤在客户端对下载的结果执行
+        extra_info = {}
+        server_stages = get_server_postprocess_stages()
+        postprocess = []
+        local_image = "image_host" not in server_stages
+        if not local_image:
+            postprocess.append({"name": "image_host"})
+        local_ai = False
+        if use_ai_flag:
+            local_ai = "llm_cleanup" not in server_stages
+            if not local_ai:
+                postprocess.append({"name": "llm_cleanup", "options": {"model": ai_model, "max_chunk_size": int(max_chunk_size)}})
+        else:
+            logger.info("跳过AI优化文档")
+            extra_info["AI优化"] = "⏭️ 已跳过"
+        local_kb = False
+        if upload_to_kb_flag:
+            if kb_id:
+                # 知识库中应是处理后的Markdown，有步骤在客户端执行时由客户端在处理后上传
+                local_kb = local_image or local_ai or "kb_push" not in server_stages
+                if not local_kb:
+                    postprocess.append({"name": "kb_push", "options": {"kb_id": kb_id}})
+            else:
+                logger.warning("未提供知识库ID，无法上传")
+                extra_info["知识库上传"] = "❌ 失败: 未提供知识库ID"
+
         # 发送请求
         progress(0.2, desc="📤 正在上传文件...")
-        response = requests.post(f"{API_URL}/convert/", files=files)
+        data = {"postprocess": json.dumps(postprocess)} if postprocess else {}
+        response = requests.post(f"{API_URL}/convert/", files=files, data=data)
         response.raise_for_status()
 
         # 解析响应
@@ -192,14 +240,22 @@ def upload_and_convert_pdf(pdf_file, upload_to_kb_flag, kb_id, use_ai_flag=True,
             if status not in ["pending", "processing"]:
                 break
 
-            # 检查是否超时
+            # 检查是否超时，超时后取消服务端任务，释放转换资源
             if time.time() - start_time > timeout:
-                return {"error": "⏱️ 转换超时，请稍后检查结果或尝试重新上传"}, None
+                try:
+                    requests.delete(f"{API_URL}/tasks/{task_id}", timeout=10)
+                except requests.RequestException as e:
+                    logger.warning(f"取消任务失败: {task_id}, {str(e)}")
+                return {"error": "⏱️ 转换超时，任务已取消，请稍后重新上传"}, None
 
-            # 更新进度
+            # 更新进度，服务端执行后处理步骤时显示当前步骤
             elapsed = time.time() - start_time
             progress_value = min(0.3 + (elapsed / timeout) * 0.6, 0.9)
-            progress(progress_value, desc=f"🔄 正在转换中，已用时 {int(elapsed)}秒，请耐心等待...")
+            running = [stage["name"] for stage in result.get("postprocess") or [] if stage["status"] == "running"]
+            if running:
+                progress(progress_value, desc=f"🧩 服务端正在执行{POSTPROCESS_STAGE_LABELS.get(running[0], running[0])}，已用时 {int(elapsed)}秒...")
+            else:
+                progress(progress_value, desc=f"🔄 正在转换中，已用时 {int(elapsed)}秒，请耐心等待...")
 
             # 等待一段时间再次检查
             time.sleep(3)
@@ -209,8 +265,7 @@ def upload_and_convert_pdf(pdf_file, upload_to_kb_flag, kb_id, use_ai_flag=True,
             progress(0.95, desc="✅ 转换完成，准备下载结果...")
             logger.info(f"转换完成，任务ID: {task_id}")
 
-            # 创建临时目录存储下载的文件
-            temp_dir = tempfile.mkdtemp()
+            # 下载的文件存放在任务工作区中
             output_path = os.path.join(temp_dir, f"{os.path.basename(pdf_file.name).split('.')[0]}_results.zip")
 
             # 下载ZIP文件
@@ -222,53 +277,54 @@ def upload_and_convert_pdf(pdf_file, upload_to_kb_flag, kb_id, use_ai_flag=True,
                 for chunk in response.iter_content(chunk_size=8192):
                     f.write(chunk)
 
-            # 处理额外的上传选项和图片处理
-            extra_info = {}
-            final_output_path = output_path  # 默认使用原始输出路径
-
-            # 解压并查找Markdown文件和images目录
-            progress(0.96, desc="📄 正在解析转换结果...")
-            extract_dir, markdown_files, images_dirs = extract_and_find_markdown_files(output_path)
-
-            # 添加找到的文件信息到结果中
-            extra_info["找到的Markdown文件"] = len(markdown_files)
-            extra_info["找到的images目录"] = len(images_dirs)
-
-            # 处理所有Markdown文件中的图片链接
-            if markdown_files:
-                progress(0.97, desc="🖼️ 正在处理图片链接...")
-                logger.info("开始处理所有Markdown文件中的图片链接")
-                success, stats = process_all_markdown_files(extract_dir, markdown_files)
-
-                # AI 大模型清洗
-                ai_success_count = 0
-                ai_fail_count = 0
-                if use_ai_flag:
-                    progress(0.98, desc="🧠 正在使用AI优化文档...")
-                    logger.info(f"开始使用AI大模型清洗文档，模型: {ai_model}，最大块大小: {max_chunk_size}")
-                    ai_success_count, ai_fail_count = process_all_markdown_files_with_ai(markdown_files,
-                                                                                         ai_model=ai_model,
-                                                                                         max_chunk_size=max_chunk_size)
-                    extra_info[
-                        "AI优化"] = f"✅ 成功: {ai_success_count} 个文件" if ai_fail_count == 0 else f"⚠️ 部分成功: {ai_success_count} 成功, {ai_fail_count} 失败"
-                else:
-                    logger.info("跳过AI优化文档")
-                    extra_info["AI优化"] = "⏭️ 已跳过"
-
-                # 创建包含处理后文件的新ZIP
-                progress(0.99, desc="📦 正在创建新的ZIP文件...")
-                final_output_path = create_new_zip_with_processed_files(output_path, extract_dir)
-
-                # 添加处理统计信息
-                extra_info["图片处理"] = "✅ 成功" if success else "⚠️ 部分成功"
-                extra_info["处理统计"] = stats
-
-            # 如果选择了上传知识库
-            if upload_to_kb_flag:
-                if not kb_id:
-                    logger.warning("未提供知识库ID，无法上传")
-                    extra_info["知识库上传"] = "❌ 失败: 未提供知识库ID"
+            # 各后处理步骤的执行结果
+            for stage in result.get("postprocess") or []:
+                label = POSTPROCESS_STAGE_LABELS.get(stage["name"], stage["name"])
+                if stage["status"] == "completed":
+                    extra_info[label] = "✅ 成功"
                 else:
+                    extra_info[label] = f"❌ 失败: {stage.get('error') or stage['status']}"
+                    logger.warning(f"{label}失败: {stage.get('error')}")
+                if stage.get("detail"):
+                    extra_info[f"{label}结果"] = stage["detail"]
+            final_output_path = output_path
+
+            if local_image or local_ai or local_kb:
+                # 解压并查找Markdown文件和images目录
+                progress(0.96, desc="📄 正在解析转换结果...")
+                extract_dir, markdown_files, images_dirs = extract_and_find_markdown_files(
+                    output_path, needed_only=ZIP_STREAMING_PIPELINE, extract_dir=os.path.join(temp_dir, "extract"))
+                extra_info["找到的Markdown文件"] = len(markdown_files)
+                extra_info["找到的images目录"] = len(images_dirs)
+
+                if markdown_files and (local_image or local_ai):
+                    # 处理所有Markdown文件中的图片链接
+                    if local_image:
+                        progress(0.97, desc="🖼️ 正在处理图片链接...")
+                        logger.info("开始处理所有Markdown文件中的图片链接")
+                        success, stats = process_all_markdown_files(extract_dir, markdown_files)
+                        extra_info["图片处理"] = "✅ 成功" if success else "⚠️ 部分成功"
+                        extra_info["处理统计"] = stats
+
+                    # AI 大模型清洗
+                    if local_ai:
+                        progress(0.98, desc="🧠 正在使用AI优化文档...")
+                        logger.info(f"开始使用AI大模型清洗文档，模型: {ai_model}，最大块大小: {max_chunk_size}")
+                        ai_success_count, ai_fail_count = process_all_markdown_files_with_ai(markdown_files,
+                                                                                             ai_model=ai_model,
+                                                                                             max_chunk_size=max_chunk_size)
+                        extra_info[
+                            "AI优化"] = f"✅ 成功: {ai_success_count} 个文件" if ai_fail_count == 0 else f"⚠️ 部分成功: {ai_success_count} 成功, {ai_fail_count} 失败"
+
+                    # 创建包含处理后文件的新ZIP
+                    progress(0.99, desc="📦 正在创建新的ZIP文件...")
+                    if ZIP_STREAMING_PIPELINE:
+                        final_output_path = rewrite_zip_with_processed_files(output_path, extract_dir)
+                    else:
+                        final_output_path = create_new_zip_with_processed_files(output_path, extract_dir)
+
+                # 如果选择了上传知识库
+                if local_kb:
                     progress(0.99, desc="📚 正在上传到知识库...")
                     logger.info(f"开始上传到知识库 {kb_id}")
 
@@ -305,6 +361,9 @@ def upload_and_convert_pdf(pdf_file, upload_to_kb_flag, kb_id, use_ai_flag=True,
     except Exception as e:
         logger.exception(f"处理出错: {str(e)}")
         return {"error": f"❌ 处理失败: {str(e)}"}, None
+    finally:
+        if not workspace_dir:
+            workspace_manager.release(temp_dir)
 
 
 def show_kb_id_input(upload_to_kb):
@@ -328,13 +387,14 @@ def process_multiple_files(pdf_files, upload_to_kb_flag, kb_id, use_ai_flag=True
         else:
             return upload_and_convert_pdf(pdf_file, upload_to_kb_flag, kb_id, use_ai_flag, ai_model, max_chunk_size, progress)
     
-    # 创建临时目录来存储所有处理结果
-    main_temp_dir = tempfile.mkdtemp()
+    # 创建工作区来存储所有处理结果，各文件的处理也在其中进行
+    main_temp_dir = workspace_manager.create("batch")
     main_output_path = os.path.join(main_temp_dir, "combined_results.zip")
     
     # 用于存储所有处理结果
     all_results = {}
     all_extract_dirs = []
+    all_output_zips = []
     success_count = 0
     fail_count = 0
     
@@ -366,23 +426,27 @@ def process_multiple_files(pdf_files, upload_to_kb_flag, kb_id, use_ai_flag=True
                     # 处理HTML文件
                     result, output_path = process_html_file(
                         pdf_file, upload_to_kb_flag, kb_id, use_ai_flag, ai_model, max_chunk_size, 
-                        gr.Progress(lambda v, d: sub_progress(v, d))
+                        gr.Progress(lambda v, d: sub_progress(v, d)), workspace_dir=main_temp_dir
                     )
                 else:
                     # 处理PDF文件
                     result, output_path = upload_and_convert_pdf(
                         pdf_file, upload_to_kb_flag, kb_id, use_ai_flag, ai_model, max_chunk_size, 
-                        gr.Progress(lambda v, d: sub_progress(v, d))
+                        gr.Progress(lambda v, d: sub_progress(v, d)), workspace_dir=main_temp_dir
                     )
                 
                 if "error" not in result:
                     success_count += 1
                     all_results[file_name] = result
                     
-                    # 如果有输出路径，解压它以便合并
+                    # 如果有输出路径，记录或解压它以便合并
                     if output_path and os.path.exists(output_path):
-                        extract_dir, _, _ = extract_and_find_markdown_files(output_path)
-                        all_extract_dirs.append((file_name, extract_dir))
+                        if ZIP_STREAMING_PIPELINE:
+                            all_output_zips.append((os.path.splitext(file_name)[0], output_path))
+                        else:
+                            extract_dir, _, _ = extract_and_find_markdown_files(
+                                output_path, extract_dir=tempfile.mkdtemp(prefix="merge_", dir=main_temp_dir))
+                            all_extract_dirs.append((file_name, extract_dir))
                 else:
                     fail_count += 1
                     all_results[file_name] = result
@@ -393,18 +457,22 @@ def process_multiple_files(pdf_files, upload_to_kb_flag, kb_id, use_ai_flag=True
         
         # 创建合并的ZIP文件
         progress(0.95, desc="📦 正在创建合并的ZIP文件...")
-        with zipfile.ZipFile(main_output_path, 'w', zipfile.ZIP_DEFLATED) as main_zip:
-            # 添加每个处理好的目录到ZIP中
-            for file_name, extract_dir in all_extract_dirs:
-                base_name = os.path.splitext(file_name)[0]
-                for root, _, files in os.walk(extract_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        # 计算相对路径，并添加文件名前缀以区分不同文件的结果
-                        rel_path = os.path.relpath(file_path, extract_dir)
-                        zip_path = os.path.join(base_name, rel_path)
-                        logger.info(f"添加文件到合并ZIP: {zip_path}")
-                        main_zip.write(file_path, zip_path)
+        if ZIP_STREAMING_PIPELINE:
+            # 直接复制各结果ZIP的成员数据，不再解压和重新压缩
+            merge_zip_files(all_output_zips, main_output_path)
+        else:
+            with zipfile.ZipFile(main_output_path, 'w', zipfile.ZIP_DEFLATED) as main_zip:
+                # 添加每个处理好的目录到ZIP中
+                for file_name, extract_dir in all_extract_dirs:
+                    base_name = os.path.splitext(file_name)[0]
+                    for root, _, files in os.walk(extract_dir):
+                        for file in files:
+                            file_path = os.path.join(root, file)
+                            # 计算相对路径，并添加文件名前缀以区分不同文件的结果
+                            rel_path = os.path.relpath(file_path, extract_dir)
+                            zip_path = os.path.join(base_name, rel_path)
+                            logger.info(f"添加文件到合并ZIP: {zip_path}")
+                            main_zip.write(file_path, zip_path)
         
         # 总结处理结果
         progress(1.0, desc="🎉 所有文件处理完成！")
@@ -422,6 +490,8 @@ def process_multiple_files(pdf_files, upload_to_kb_flag, kb_id, use_ai_flag=True
     except Exception as e:
         logger.exception(f"批量处理过程中发生错误: {e}")
         return {"error": f"❌ 批量处理失败: {str(e)}"}, None
+    finally:
+        workspace_manager.release(main_temp_dir)
 
 
 def create_ui():
@@ -499,6 +569,8 @@ if __name__ == "__main__":
     logger.info("=" * 50)
     logger.info("启动PDF转换Web应用")
     logger.info("=" * 50)
+    # 清理上次运行遗留的工作区
+    workspace_manager.sweep()
     demo = create_ui()
     demo.queue()
     demo.launch(share=False, server_name='0.0.0.0')
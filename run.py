@@ -1,16 +1,89 @@
 import uvicorn
 import os
 import sys
+import asyncio
+import argparse
 
 # 添加当前目录到路径，确保可以导入app包
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
+from app.core.config import settings
+
+class DrainingServer(uvicorn.Server):
+    """收到第一次停止信号时先排空本进程中的转换任务再退出，再次收到信号立即退出"""
+
+    def __init__(self, config: uvicorn.Config, drain_timeout: float):
+        super().__init__(config)
+        self.drain_timeout = drain_timeout
+        self.drain_task = None
+
+    def handle_exit(self, sig, frame):
+        if self.drain_task is None and self.drain_timeout > 0:
+            self.drain_task = asyncio.ensure_future(self.drain_then_exit(sig, frame))
+        else:
+            super().handle_exit(sig, frame)
+
+    async def drain_then_exit(self, sig, frame):
+        from app.services.drain_service import drain_state
+        await drain_state.drain(self.drain_timeout)
+        super().handle_exit(sig, frame)
+
+def parse_args() -> argparse.Namespace:
+    """命令行参数，未指定时使用环境变量/.env中的配置"""
+    parser = argparse.ArgumentParser(description=settings.APP_NAME)
+    parser.add_argument("--mode", choices=["dev", "prod"], default=settings.SERVER_MODE)
+    parser.add_argument("--prod", dest="mode", action="store_const", const="prod", help="等同于--mode prod")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS)
+    parser.add_argument("--loop", default=settings.SERVER_LOOP, help="auto、uvloop或asyncio")
+    parser.add_argument("--http", default=settings.SERVER_HTTP, help="auto、httptools或h11")
+    parser.add_argument("--backlog", type=int, default=settings.SERVER_BACKLOG)
+    parser.add_argument("--keep-alive", type=int, default=settings.SERVER_KEEPALIVE_SECONDS)
+    parser.add_argument("--drain-timeout", type=float, default=settings.SHUTDOWN_DRAIN_TIMEOUT_SECONDS)
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.mode == "prod" and args.workers > 1 and settings.EXECUTION_MODE != "broker":
+        parser.error("--workers > 1 requires EXECUTION_MODE=broker: local mode keeps task state in a single process")
+    return args
+
 if __name__ == "__main__":
-    # 启动FastAPI应用
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="info"
-    ) 
\ No newline at end of file
+    args = parse_args()
+
+    if args.mode == "dev":
+        # 开发模式：单进程，代码变化时自动重载
+        uvicorn.run(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            reload=True,
+            log_level="info"
+        )
+    elif args.workers > 1:
+        # 多个HTTP进程共享监听端口，转换由broker模式的工作进程执行
+        uvicorn.run(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            loop=args.loop,
+            http=args.http,
+            backlog=args.backlog,
+            timeout_keep_alive=args.keep_alive,
+            timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT_SECONDS,
+            log_level="info"
+        )
+    else:
+        config = uvicorn.Config(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            loop=args.loop,
+            http=args.http,
+            backlog=args.backlog,
+            timeout_keep_alive=args.keep_alive,
+            timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT_SECONDS,
+            log_level="info"
+        )
+        DrainingServer(config, args.drain_timeout).run()
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# 添加当前目录到路径，确保可以导入app包
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from app.utils.logger import setup_logger
+from app.services.worker_service import run_worker
+
+if __name__ == "__main__":
+    # 启动转换工作进程（需设置 EXECUTION_MODE=broker，与API节点使用相同的 BROKER_URL）
+    setup_logger()
+    run_worker()
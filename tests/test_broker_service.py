@@ -0,0 +1,91 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import settings
+from app.models.task import TaskStatus
+from app.services.broker_service import RedisBroker, SQLiteBroker
+
+@pytest.fixture(params=["sqlite", "redis"])
+def broker(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "BROKER_LEASE_SECONDS", 60)
+    if request.param == "sqlite":
+        return SQLiteBroker(str(tmp_path / "broker.db"))
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisBroker(client=fakeredis.FakeRedis())
+
+def test_dequeue_by_priority(broker):
+    broker.enqueue({"task_id": "slow", "file_name": "a.pdf", "priority": 2.0})
+    broker.enqueue({"task_id": "fast", "file_name": "b.pdf", "priority": 1.0})
+
+    first = broker.dequeue(0.1)
+    second = broker.dequeue(0.1)
+    assert (first["task_id"], second["task_id"]) == ("fast", "slow")
+    assert second["file_name"] == "a.pdf"
+    assert broker.dequeue(0.05) is None
+
+    broker.ack(first)
+    broker.requeue(second)
+    assert broker.dequeue(0.1)["task_id"] == "slow"
+
+def test_expired_lease_is_reclaimed(broker, monkeypatch):
+    broker.enqueue({"task_id": "task", "file_name": "a.pdf", "priority": 1.0})
+    assert broker.dequeue(0.1)["task_id"] == "task"
+    assert broker.reclaim_expired() == 0
+    assert broker.dequeue(0.05) is None
+
+    # 取出任务的工作进程崩溃，不再续约
+    start = time.time()
+    monkeypatch.setattr(time, "time", lambda: start + 61)
+    assert broker.reclaim_expired() == 1
+    reclaimed = broker.dequeue(0.1)
+    assert reclaimed["task_id"] == "task"
+    broker.ack(reclaimed)
+    assert broker.reclaim_expired() == 0
+
+def test_renewed_lease_is_kept(broker, monkeypatch):
+    broker.enqueue({"task_id": "task", "file_name": "a.pdf", "priority": 1.0})
+    job = broker.dequeue(0.1)
+
+    start = time.time()
+    monkeypatch.setattr(time, "time", lambda: start + 50)
+    broker.renew(job)
+    monkeypatch.setattr(time, "time", lambda: start + 100)
+    assert broker.reclaim_expired() == 0
+    monkeypatch.setattr(time, "time", lambda: start + 111)
+    assert broker.reclaim_expired() == 1
+
+def test_status_round_trip(broker):
+    created = datetime(2024, 1, 1)
+    for i, status in enumerate(["pending", "completed", "completed"]):
+        broker.save_status(TaskStatus(task_id=f"task-{i}", status=status, created_at=created + timedelta(minutes=i)))
+
+    assert broker.load_status("task-0").status == "pending"
+    assert broker.load_status("missing") is None
+    assert sorted(task.task_id for task in broker.load_statuses(["task-0", "task-2", "missing"])) == ["task-0", "task-2"]
+
+    page = broker.query_statuses(status="completed", limit=1)
+    assert [task.task_id for task in page] == ["task-1"]
+    page = broker.query_statuses(status="completed", after=(page[0].created_at, page[0].task_id))
+    assert [task.task_id for task in page] == ["task-2"]
+
+    broker.delete_status("task-0")
+    assert broker.load_status("task-0") is None
+
+def test_idempotency_key_and_cancel(broker):
+    broker.save_status(TaskStatus(task_id="first", status="pending"))
+    assert broker.claim_key("key", "first") == "first"
+    assert broker.claim_key("key", "second") == "first"
+
+    assert not broker.cancel_requested("first")
+    broker.request_cancel("first")
+    assert broker.cancel_requested("first")
+
+    # 删除任务时一并释放幂等键和取消标记
+    broker.delete_status("first")
+    assert not broker.cancel_requested("first")
+    assert broker.claim_key("key", "second") == "second"
+    broker.release_key("key")
+    assert broker.claim_key("key", "third") == "third"
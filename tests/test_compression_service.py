@@ -0,0 +1,75 @@
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.services.compression_service import (
+    COMPRESSED_SUFFIX, accepts_gzip, compress_outputs, decompressed_size, iter_decompressed
+)
+from app.services.storage_service import LocalStorage
+from app.utils.http import ranged_stream_response
+
+CONTENT = "".join(f"第{i}行 line {i}\n" for i in range(2000)).encode("utf-8")
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("identity", False),
+    ("gzip", True),
+    ("br, gzip;q=0.5", True),
+    ("gzip;q=0", False),
+    ("*", True),
+    ("gzip;q=abc", True),
+    ("gzip;q=", True),
+    ("gzip; Q=0", False),
+    ("*;q=1, gzip;q=0", False),
+    ("gzip;q=0, *", False),
+    ("br, *;q=0.1", True),
+    ("*;q=0", False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "OUTPUT_DIR", str(tmp_path))
+    os.makedirs(tmp_path / "task")
+    (tmp_path / "task" / "doc.md").write_bytes(CONTENT)
+    compress_outputs(str(tmp_path / "task"), ["doc.md"])
+    return LocalStorage()
+
+def test_iter_decompressed_range(storage):
+    rel_path = "doc.md" + COMPRESSED_SUFFIX
+    assert decompressed_size(storage, "task", rel_path) == len(CONTENT)
+    assert b"".join(iter_decompressed(storage, "task", rel_path)) == CONTENT
+    assert b"".join(iter_decompressed(storage, "task", rel_path, 1000, 500, chunk_size=64)) == CONTENT[1000:1500]
+
+def test_ranged_stream_response(storage):
+    app = FastAPI()
+    rel_path = "doc.md" + COMPRESSED_SUFFIX
+
+    @app.get("/doc.md")
+    def download(request: Request):
+        return ranged_stream_response(
+            request, len(CONTENT),
+            lambda start, length: iter_decompressed(storage, "task", rel_path, start, length),
+            "doc.md"
+        )
+
+    client = TestClient(app)
+    response = client.get("/doc.md")
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.content == CONTENT
+
+    response = client.get("/doc.md", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 0-9/{len(CONTENT)}"
+    assert response.content == CONTENT[:10]
+
+    response = client.get("/doc.md", headers={"Range": "bytes=-7"})
+    assert response.content == CONTENT[-7:]
+
+    response = client.get("/doc.md", headers={"Range": f"bytes={len(CONTENT)}-"})
+    assert response.status_code == 416
@@ -0,0 +1,23 @@
+import os
+
+from app.core.config import settings
+from app.services.image_service import postprocess_images
+
+def test_duplicates_are_removed_after_all_references_are_updated(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_TRANSCODE_FORMAT", "")
+    monkeypatch.setattr(settings, "IMAGE_THUMBNAIL_SIZE", 0)
+    output_dir = tmp_path / "output"
+    (output_dir / "images").mkdir(parents=True)
+    (output_dir / "images" / "a.jpg").write_bytes(b"logo")
+    (output_dir / "images" / "b.jpg").write_bytes(b"logo")
+    (output_dir / "images" / "c.jpg").write_bytes(b"chart")
+    (output_dir / "doc.md").write_text("![](images/a.jpg)\n![](images/b.jpg)\n![](images/c.jpg)\n", encoding="utf-8")
+    checkpoint = tmp_path / "pages_0_9_txt.middle.json"
+    checkpoint.write_text('{"image_path": "b.jpg"}', encoding="utf-8")
+
+    postprocess_images(str(output_dir), "images", [str(checkpoint)])
+
+    assert sorted(os.listdir(output_dir / "images")) == ["a.jpg", "c.jpg"]
+    assert (output_dir / "doc.md").read_text(encoding="utf-8") == "![](images/a.jpg)\n![](images/a.jpg)\n![](images/c.jpg)\n"
+    # 重试时从检查点重新输出的内容引用保留的图片
+    assert checkpoint.read_text(encoding="utf-8") == '{"image_path": "a.jpg"}'
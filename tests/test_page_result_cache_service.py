@@ -0,0 +1,13 @@
+import os
+
+from app.services.page_result_cache_service import PageResultCache
+
+def test_max_bytes_is_shared_between_processes(tmp_path):
+    page = {"layout_dets": [{"category_id": 1, "text": "x" * 1000}], "page_info": {"page_no": 0}}
+    caches = [PageResultCache(str(tmp_path), 8 * 1024) for _ in range(3)]
+    for index in range(30):
+        caches[index % 3].put(f"key{index}", page)
+
+    files = [name for name in os.listdir(tmp_path) if name.endswith(".json")]
+    assert sum(os.path.getsize(tmp_path / name) for name in files) <= 8 * 1024
+    assert caches[1].get("key29") == page
@@ -0,0 +1,240 @@
+import json
+import time
+from functools import partial
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.models.task import PostprocessStage, TaskRecord
+from app.services import postprocess_service
+from app.services.pdf_service import tasks, status_listeners, run_postprocess
+from app.services.postprocess_service import (
+    parse_postprocess, run_image_host, run_kb_push, run_llm_cleanup, split_text
+)
+
+@pytest.fixture(autouse=True)
+def configured(monkeypatch):
+    monkeypatch.setattr(settings, "POSTPROCESS_IMAGE_HOST_URL", "http://images.test/upload")
+    monkeypatch.setattr(settings, "POSTPROCESS_LLM_BASE_URL", "http://llm.test/v1")
+    monkeypatch.setattr(settings, "POSTPROCESS_KB_BASE_URL", "http://kb.test/api/v1")
+    monkeypatch.setattr(settings, "POSTPROCESS_KB_DEFAULT_ID", "")
+
+@pytest.fixture
+def serve(monkeypatch):
+    """用MockTransport代替图床、大模型和知识库接口，handler接收httpx.Request返回httpx.Response"""
+    def install(handler):
+        monkeypatch.setattr(httpx, "Client", partial(httpx.Client, transport=httpx.MockTransport(handler)))
+    return install
+
+@pytest.fixture
+def document(tmp_path):
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "a.jpg").write_bytes(b"a")
+    (tmp_path / "images" / "b.jpg").write_bytes(b"b")
+    md_path = tmp_path / "doc.md"
+    md_path.write_text("![](images/a.jpg)\n正文\n![图](images/b.jpg)\n", encoding="utf-8")
+    return md_path
+
+def test_image_host_keeps_links_of_failed_uploads(serve, document):
+    def handler(request):
+        if b'filename="b.jpg"' in request.content:
+            return httpx.Response(500)
+        return httpx.Response(200, json={"url": "http://cdn.test\\a.jpg"})
+    serve(handler)
+
+    detail = run_image_host(PostprocessStage(name="image_host"), str(document.parent), str(document))
+
+    assert detail == {"images": 2, "uploaded": 1, "failed": 1}
+    assert document.read_text(encoding="utf-8") == "![](http://cdn.test/a.jpg)\n正文\n![图](images/b.jpg)\n"
+
+def test_image_host_raises_when_all_uploads_fail(serve, document):
+    serve(lambda request: httpx.Response(502))
+    original = document.read_text(encoding="utf-8")
+
+    with pytest.raises(RuntimeError):
+        run_image_host(PostprocessStage(name="image_host"), str(document.parent), str(document))
+    assert document.read_text(encoding="utf-8") == original
+
+def llm_reply(content):
+    return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+def test_llm_cleanup_keeps_failed_chunks(serve, tmp_path):
+    md_path = tmp_path / "doc.md"
+    md_path.write_text("第一段。\n\n第二段。", encoding="utf-8")
+
+    def handler(request):
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        if "第二段" in prompt:
+            return httpx.Response(500)
+        return llm_reply("# 第一段")
+    serve(handler)
+
+    stage = PostprocessStage(name="llm_cleanup", options={"max_chunk_size": 6})
+    detail = run_llm_cleanup(stage, str(tmp_path), str(md_path))
+
+    assert detail["chunks"] == 2 and detail["failed"] == 1
+    assert md_path.read_text(encoding="utf-8") == "# 第一段\n\n第二段。"
+
+def test_llm_cleanup_raises_when_all_chunks_fail(serve, tmp_path):
+    md_path = tmp_path / "doc.md"
+    md_path.write_text("第一段。\n\n第二段。", encoding="utf-8")
+    serve(lambda request: llm_reply(""))
+
+    with pytest.raises(RuntimeError):
+        run_llm_cleanup(PostprocessStage(name="llm_cleanup", options={"max_chunk_size": 6}), str(tmp_path), str(md_path))
+    assert md_path.read_text(encoding="utf-8") == "第一段。\n\n第二段。"
+
+@pytest.mark.parametrize("text, max_chunk_size, expected", [
+    ("短文本", 10, ["短文本"]),
+    ("", 10, []),
+    # </p>优先于后面的空行
+    ("ab</p>cd\n\nef", 10, ["ab</p>", "cd\n\nef"]),
+    ("一二。三四五六", 4, ["一二。", "三四五六"]),
+    # 没有分隔符时按长度硬切
+    ("abcdefg", 3, ["abc", "def", "g"]),
+    # 分隔符在窗口开头时不能切出空块
+    ("\n\nabcd", 3, ["\n\na", "bcd"]),
+])
+def test_split_text(text, max_chunk_size, expected):
+    chunks = split_text(text, max_chunk_size)
+    assert chunks == expected
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= max_chunk_size for chunk in chunks)
+
+def test_kb_push_uploads_and_triggers_parsing(serve, document):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.path.endswith("/documents"):
+            return httpx.Response(200, json={"data": [{"id": "doc-1"}]})
+        return httpx.Response(200, json={})
+    serve(handler)
+
+    detail = run_kb_push(PostprocessStage(name="kb_push", options={"kb_id": "kb-1"}), str(document.parent), str(document))
+
+    assert detail == {"kb_id": "kb-1", "document_ids": ["doc-1"]}
+    assert [request.url.path for request in requests] == ["/api/v1/datasets/kb-1/documents", "/api/v1/datasets/kb-1/chunks"]
+    assert json.loads(requests[1].content) == {"document_ids": ["doc-1"]}
+
+def test_kb_push_raises_without_document_ids(serve, document):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"data": []})
+    serve(handler)
+
+    with pytest.raises(RuntimeError):
+        run_kb_push(PostprocessStage(name="kb_push", options={"kb_id": "kb-1"}), str(document.parent), str(document))
+    # 没有文档ID时不触发解析
+    assert len(requests) == 1
+
+def test_parse_postprocess_accepts_configured_stages():
+    stages = parse_postprocess(json.dumps([
+        {"name": "image_host"},
+        {"name": "llm_cleanup", "options": {"model": "m", "max_chunk_size": 100}},
+        {"name": "kb_push", "options": {"kb_id": "kb-1"}},
+    ]))
+
+    assert [stage.name for stage in stages] == ["image_host", "llm_cleanup", "kb_push"]
+    assert all(stage.status == "pending" for stage in stages)
+    assert parse_postprocess(None) is None
+
+@pytest.mark.parametrize("stages", [
+    "not json",
+    [{"name": "unknown"}],
+    [{"name": "llm_cleanup", "options": {"max_chunk_size": "100"}}],
+    [{"name": "llm_cleanup", "options": {"max_chunk_size": True}}],
+    [{"name": "llm_cleanup", "options": {"max_chunk_size": 0}}],
+    [{"name": "llm_cleanup", "options": {"temperature": 1}}],
+    [{"name": "image_host"}, {"name": "image_host"}],
+    [{"name": "kb_push"}],
+])
+def test_parse_postprocess_rejects_invalid_stages(stages):
+    raw = stages if isinstance(stages, str) else json.dumps(stages)
+    with pytest.raises(HTTPException) as exc_info:
+        parse_postprocess(raw)
+    assert exc_info.value.status_code == 400
+
+def test_parse_postprocess_rejects_unconfigured_stage(monkeypatch):
+    monkeypatch.setattr(settings, "POSTPROCESS_IMAGE_HOST_URL", "")
+
+    with pytest.raises(HTTPException) as exc_info:
+        parse_postprocess(json.dumps([{"name": "image_host"}]))
+    assert "POSTPROCESS_IMAGE_HOST_URL" in exc_info.value.detail
+
+def test_parse_postprocess_uses_default_kb_id(monkeypatch):
+    monkeypatch.setattr(settings, "POSTPROCESS_KB_DEFAULT_ID", "kb-default")
+
+    assert [stage.name for stage in parse_postprocess(json.dumps([{"name": "kb_push"}]))] == ["kb_push"]
+
+@pytest.fixture
+def postprocess_task(monkeypatch, document):
+    """注册一个声明了llm_cleanup和kb_push的任务，步骤函数替换为记录调用的桩，返回调用记录和状态变化记录"""
+    calls = []
+    history = []
+    # llm_cleanup第一次执行失败
+    failures = {"llm_cleanup"}
+
+    def stage_stub(stage, output_dir, md_path):
+        calls.append(stage.name)
+        if stage.name in failures:
+            failures.discard(stage.name)
+            raise RuntimeError("llm down")
+        return {"ok": True}
+
+    for name in ("llm_cleanup", "kb_push"):
+        monkeypatch.setitem(postprocess_service.STAGES, name, (stage_stub, *postprocess_service.STAGES[name][1:]))
+    task_id = "postprocess-test"
+    monkeypatch.setitem(tasks, task_id, TaskRecord(task_id, "processing", files=[document.name], postprocess=[
+        PostprocessStage(name="llm_cleanup"), PostprocessStage(name="kb_push", options={"kb_id": "kb-1"})
+    ]))
+    listener = lambda status: history.append([(stage.name, stage.status) for stage in status.postprocess])
+    status_listeners.append(listener)
+    yield task_id, calls, history
+    status_listeners.remove(listener)
+
+def test_run_postprocess_reports_stage_status(postprocess_task, document):
+    task_id, calls, history = postprocess_task
+
+    run_postprocess(task_id, str(document.parent), document.name)
+
+    assert calls == ["llm_cleanup", "kb_push"]
+    assert history == [
+        [("llm_cleanup", "running"), ("kb_push", "pending")],
+        [("llm_cleanup", "failed"), ("kb_push", "pending")],
+        [("llm_cleanup", "failed"), ("kb_push", "running")],
+        [("llm_cleanup", "failed"), ("kb_push", "completed")],
+    ]
+    stages = tasks[task_id].postprocess
+    assert stages[0].error == "llm down"
+    assert stages[1].detail == {"ok": True}
+
+def test_run_postprocess_skips_completed_run_once_stages(postprocess_task, document):
+    task_id, calls, history = postprocess_task
+    run_postprocess(task_id, str(document.parent), document.name)
+    calls.clear()
+    history.clear()
+
+    run_postprocess(task_id, str(document.parent), document.name)
+
+    # 失败的步骤重新执行，已推送到知识库的步骤不再执行
+    assert calls == ["llm_cleanup"]
+    assert [stage.status for stage in tasks[task_id].postprocess] == ["completed", "completed"]
+    assert history[0] == [("llm_cleanup", "running"), ("kb_push", "completed")]
+
+def test_run_postprocess_fails_stages_after_timeout(postprocess_task, document, monkeypatch):
+    task_id, calls, history = postprocess_task
+    monkeypatch.setattr(settings, "POSTPROCESS_TIMEOUT_SECONDS", 0.05)
+    stage_stub = postprocess_service.STAGES["llm_cleanup"][0]
+    monkeypatch.setitem(postprocess_service.STAGES, "llm_cleanup",
+                        (lambda *args: time.sleep(0.1) or stage_stub(*args), *postprocess_service.STAGES["llm_cleanup"][1:]))
+
+    run_postprocess(task_id, str(document.parent), document.name)
+
+    assert calls == ["llm_cleanup"]
+    stages = tasks[task_id].postprocess
+    assert stages[1].status == "failed" and "timed out" in stages[1].error
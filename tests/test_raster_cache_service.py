@@ -0,0 +1,28 @@
+import os
+
+import numpy as np
+
+from app.services.raster_cache_service import PageRasterCache
+
+PAGE = np.zeros((100, 100, 3), dtype=np.uint8)
+
+def test_get_sees_pages_written_by_other_process(tmp_path):
+    writer = PageRasterCache(str(tmp_path), 10 * 1024 * 1024)
+    reader = PageRasterCache(str(tmp_path), 10 * 1024 * 1024)
+    assert reader.get("doc", 0, 200) is None
+
+    writer.put("doc", 0, 200, PAGE)
+    img = reader.get("doc", 0, 200)
+    assert img is not None and img.shape == PAGE.shape
+
+def test_max_bytes_is_shared_between_processes(tmp_path):
+    page_bytes = PAGE.nbytes + 128
+    caches = [PageRasterCache(str(tmp_path), 4 * page_bytes) for _ in range(3)]
+    for index in range(12):
+        caches[index % 3].put("doc", index, 200, PAGE)
+
+    files = [name for name in os.listdir(tmp_path) if name.endswith(".npy")]
+    assert sum(os.path.getsize(tmp_path / name) for name in files) <= 4 * page_bytes
+    # 最近写入的页面保留
+    assert caches[0].get("doc", 11, 200) is not None
+    assert caches[0].get("doc", 0, 200) is None
@@ -0,0 +1,101 @@
+import os
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from app.core.config import settings
+from app.services.storage_service import LocalStorage, S3Storage
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+PART_SIZE = 5 * 1024 * 1024  # S3分段上传的最小分段
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "S3_ENDPOINT_URL", None)
+    monkeypatch.setattr(settings, "S3_BUCKET", "test-bucket")
+    monkeypatch.setattr(settings, "S3_PREFIX", "outputs/")
+    monkeypatch.setattr(settings, "S3_ACCESS_KEY", "testing")
+    monkeypatch.setattr(settings, "S3_SECRET_KEY", "testing")
+    monkeypatch.setattr(settings, "S3_REGION", "us-east-1")
+    monkeypatch.setattr(settings, "S3_MULTIPART_THRESHOLD", PART_SIZE)
+    monkeypatch.setattr(settings, "S3_MULTIPART_CHUNKSIZE", PART_SIZE)
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="test-bucket")
+        yield S3Storage()
+
+def write_outputs(storage, task_id: str) -> bytes:
+    work_dir = storage.work_dir(task_id)
+    os.makedirs(os.path.join(work_dir, "images"))
+    large = os.urandom(2 * PART_SIZE + 1024)
+    with open(os.path.join(work_dir, "doc.md"), "wb") as f:
+        f.write(b"# title\n![](images/a.jpg)\n")
+    with open(os.path.join(work_dir, "images", "a.jpg"), "wb") as f:
+        f.write(large)
+    return large
+
+def test_publish_and_read(s3):
+    large = write_outputs(s3, "task")
+    s3.publish("task")
+
+    # 发布后删除本地工作目录
+    assert not os.path.exists(s3.work_dir("task"))
+    assert s3.list_files("task") == ["doc.md", "images/a.jpg"]
+    assert s3.list_files("task", "images/") == ["images/a.jpg"]
+    assert s3.exists("task", "doc.md")
+    assert not s3.exists("task", "missing.md")
+    assert s3.size("task", "images/a.jpg") == len(large)
+    assert s3.open("task", "doc.md").read() == b"# title\n![](images/a.jpg)\n"
+    assert s3.read_range("task", "images/a.jpg", PART_SIZE - 10, 20) == large[PART_SIZE - 10:PART_SIZE + 10]
+    assert s3.local_path("task", "doc.md") is None
+
+def test_publish_uses_multipart_upload(s3):
+    write_outputs(s3, "task")
+    s3.publish("task")
+
+    head = s3.client.head_object(Bucket="test-bucket", Key="outputs/task/images/a.jpg")
+    # 分段上传对象的ETag为"<md5>-<分段数>"
+    assert head["ETag"].strip('"').endswith("-3")
+    head = s3.client.head_object(Bucket="test-bucket", Key="outputs/task/doc.md")
+    assert "-" not in head["ETag"]
+
+def test_presigned_url(s3):
+    write_outputs(s3, "task")
+    s3.publish("task")
+
+    url = s3.presigned_url("task", "doc.md.gz", "doc.md", "gzip")
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    assert parsed.path.endswith("/outputs/task/doc.md.gz")
+    assert query["response-content-disposition"] == ['attachment; filename="doc.md"']
+    assert query["response-content-encoding"] == ["gzip"]
+    assert "response-content-encoding" not in parse_qs(urlparse(s3.presigned_url("task", "doc.md", "doc.md")).query)
+
+def test_copy_and_delete(s3):
+    write_outputs(s3, "task")
+    s3.publish("task")
+
+    s3.copy("task", "copy")
+    assert s3.list_files("copy") == ["doc.md", "images/a.jpg"]
+    assert s3.size("copy", "images/a.jpg") == s3.size("task", "images/a.jpg")
+
+    s3.delete("task")
+    assert s3.list_files("task") == []
+    assert s3.list_files("copy") == ["doc.md", "images/a.jpg"]
+
+def test_local_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "OUTPUT_DIR", str(tmp_path))
+    storage = LocalStorage()
+    large = write_outputs(storage, "task")
+    storage.publish("task")
+
+    assert storage.list_files("task") == ["doc.md", "images/a.jpg"]
+    assert storage.read_range("task", "images/a.jpg", 100, 10) == large[100:110]
+    assert storage.presigned_url("task", "doc.md", "doc.md") is None
+
+    storage.copy("task", "copy")
+    storage.delete("task")
+    assert not storage.exists("task", "doc.md")
+    assert storage.size("copy", "images/a.jpg") == len(large)
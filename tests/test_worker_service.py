@@ -0,0 +1,43 @@
+import time
+import asyncio
+import threading
+
+from app.models.task import TaskStatus
+from app.services.worker_service import StatusWriter
+
+class SlowBroker:
+    def __init__(self):
+        self.saved = []
+
+    def save_status(self, task: TaskStatus):
+        time.sleep(0.05)
+        self.saved.append((task.status, threading.current_thread().name))
+
+def test_status_writer_does_not_block_event_loop():
+    broker = SlowBroker()
+    writer = StatusWriter(broker)
+
+    async def notify():
+        started = time.monotonic()
+        for status in ("processing", "completed"):
+            writer(TaskStatus(task_id="t", status=status))
+        elapsed = time.monotonic() - started
+        await writer.flush()
+        return elapsed
+
+    try:
+        assert asyncio.run(notify()) < 0.05
+        # 写入在专用线程中按提交顺序执行
+        assert [status for status, _ in broker.saved] == ["processing", "completed"]
+        assert all(name.startswith("status-writer") for _, name in broker.saved)
+    finally:
+        writer.shutdown()
+
+def test_status_writer_waits_outside_event_loop():
+    broker = SlowBroker()
+    writer = StatusWriter(broker)
+    try:
+        writer(TaskStatus(task_id="t", status="processing"))
+        assert [status for status, _ in broker.saved] == ["processing"]
+    finally:
+        writer.shutdown()